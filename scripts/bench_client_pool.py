@@ -0,0 +1,136 @@
+"""Benchmark: fresh provider clients vs the pooled client registry
+
+Starts a local OpenAI-compatible stand-in server that counts accepted TCP
+connections and can delay each new connection to emulate a TLS handshake to a
+remote provider. It then issues requests the old way (a new ChatOpenAI per
+request, as every `switch`/fallback used to do) and through
+ProviderClientRegistry, and reports connection counts and p50/p99 latency.
+
+Requests are made without streaming: openai-python closes a streamed
+response as soon as it sees `[DONE]`, which discards the connection before
+the pool can reuse it, so streamed calls would hide the effect being measured.
+
+Usage:
+    python scripts/bench_client_pool.py --requests 200 --handshake-ms 40
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from clients import PoolLimits, ProviderClientRegistry  # noqa: E402
+from providers import Provider, ProviderConfig  # noqa: E402
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handshake_delay: float):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.handshake_delay = handshake_delay
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        time.sleep(self.server.handshake_delay)
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if body.get("stream"):
+            chunks = [
+                {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": body.get("model"),
+                 "choices": [{"index": 0, "delta": {"role": "assistant", "content": "pong"}, "finish_reason": None}]},
+                {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": body.get("model"),
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]},
+            ]
+            payload = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+            content_type = "text/event-stream"
+        else:
+            payload = json.dumps({
+                "id": "bench", "object": "chat.completion", "created": 0, "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "pong"},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            })
+            content_type = "application/json"
+        data = payload.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(label, server, requests, get_client):
+    server.connections = 0
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        get_client().invoke("ping", stream=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "mode": label,
+        "requests": requests,
+        "connections": server.connections,
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client pooling benchmark")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--handshake-ms", type=float, default=40.0,
+                        help="Delay added to each new connection to emulate TLS setup")
+    opts = parser.parse_args()
+
+    server = StubServer(opts.handshake_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    providers = {Provider.OPENAI: ProviderConfig(
+        api_key="sk-bench", model="bench-model", base_url=f"http://127.0.0.1:{server.server_port}/v1"
+    )}
+
+    def fresh_client():
+        # Previous behaviour: a brand-new client (and connection pool) per request
+        return ProviderClientRegistry(providers, PoolLimits()).get(Provider.OPENAI)
+
+    registry = ProviderClientRegistry(providers, PoolLimits())
+    results = [
+        run("fresh-client", server, opts.requests, fresh_client),
+        run("registry", server, opts.requests, lambda: registry.get(Provider.OPENAI)),
+    ]
+    registry.close()
+    server.shutdown()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
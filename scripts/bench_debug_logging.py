@@ -0,0 +1,127 @@
+"""Benchmark: per-request cost of the debug logging callbacks
+
+Drives the callback path directly (request start + request end) with a
+realistic prompt and response and measures the time spent in the calling
+thread, which is the time added to every request. Compares:
+
+- legacy: the previous handler's ~15 f-string `logger.debug` calls per request
+  (including `str(response)`) into a synchronous rotating file sink
+- structured: one lazily built, redacted JSON record per request written by
+  loguru's background (`enqueue=True`) writer
+- structured-filtered: the structured handler with no sink accepting DEBUG,
+  so the record is never built
+
+Usage:
+    python scripts/bench_debug_logging.py --requests 2000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from langchain_core.messages import AIMessage, HumanMessage  # noqa: E402
+from langchain_core.outputs import ChatGeneration, LLMResult  # noqa: E402
+from loguru import logger  # noqa: E402
+
+from providers import Provider  # noqa: E402
+from request_log import DebugCallbackHandler, add_request_sink  # noqa: E402
+
+PARAMS = {"model_name": "gpt-3.5-turbo", "temperature": 0.7, "max_tokens": 1000}
+
+
+class LegacyDebugHandler:
+    """The logging calls the previous DebugCallbackHandler made per request"""
+    def __init__(self, provider: Provider):
+        self.provider = provider
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.start_time = time.time()
+        logger.debug("LLM Request:")
+        logger.debug(f"Provider: {self.provider.value}")
+        logger.debug(f"Model: {kwargs.get('invocation_params', {}).get('model_name', 'unknown')}")
+        logger.debug(f"Temperature: {kwargs.get('invocation_params', {}).get('temperature', 0.7)}")
+        logger.debug(f"Max Tokens: {kwargs.get('invocation_params', {}).get('max_tokens', 1000)}")
+        logger.debug("OpenAI Request Details:")
+        logger.debug(f"System Messages: {kwargs.get('messages', [])}")
+        logger.debug(f"Function Calls: {kwargs.get('functions', [])}")
+        logger.debug("Prompts:")
+        for i, prompt in enumerate(messages):
+            logger.debug(f"Prompt {i + 1}:\n{prompt}")
+
+    def on_llm_end(self, response, **kwargs):
+        logger.debug("LLM Response:")
+        logger.debug(f"Provider: {self.provider.value}")
+        logger.debug("OpenAI Response Details:")
+        logger.debug(f"Completion Tokens: {(response.llm_output or {}).get('token_usage', {}).get('completion_tokens', 'unknown')}")
+        logger.debug(f"Raw Response: {str(response)}")
+        logger.debug(f"Response Time: {time.time() - self.start_time:.2f}s")
+
+
+def make_request(prompt_chars: int, response_chars: int):
+    messages = [[HumanMessage(("The quick brown fox jumps over the lazy dog. " * 100)[:prompt_chars])]]
+    response = LLMResult(
+        generations=[[ChatGeneration(message=AIMessage(
+            ("Lorem ipsum dolor sit amet. " * 100)[:response_chars],
+            usage_metadata={"input_tokens": prompt_chars // 4, "output_tokens": response_chars // 4,
+                            "total_tokens": (prompt_chars + response_chars) // 4}
+        ))]],
+        llm_output={"token_usage": {"completion_tokens": response_chars // 4}}
+    )
+    return messages, response
+
+
+def run(name: str, handler, requests: int, messages, response) -> dict:
+    timings = []
+    for _ in range(requests):
+        run_id = uuid.uuid4()
+        start = time.perf_counter()
+        handler.on_chat_model_start({}, messages, run_id=run_id, invocation_params=PARAMS)
+        handler.on_llm_end(response, run_id=run_id)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {
+        "mode": name,
+        "mean_us": round(statistics.mean(timings) * 1e6, 1),
+        "p50_us": round(timings[len(timings) // 2] * 1e6, 1),
+        "p99_us": round(timings[int(len(timings) * 0.99)] * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Debug logging overhead benchmark")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--prompt-chars", type=int, default=4000)
+    parser.add_argument("--response-chars", type=int, default=2000)
+    opts = parser.parse_args()
+
+    messages, response = make_request(opts.prompt_chars, opts.response_chars)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        logger.remove()
+        logger.add(os.path.join(tmp, "chat.log"), rotation="1 MB", retention="7 days")
+        results.append(run("legacy", LegacyDebugHandler(Provider.OPENAI),
+                           opts.requests, messages, response))
+
+        logger.remove()
+        add_request_sink(os.path.join(tmp, "requests.jsonl"))
+        results.append(run("structured", DebugCallbackHandler(Provider.OPENAI),
+                           opts.requests, messages, response))
+        logger.complete()
+
+        logger.remove()
+        add_request_sink(os.path.join(tmp, "requests.jsonl"), level="INFO")
+        results.append(run("structured-filtered", DebugCallbackHandler(Provider.OPENAI),
+                           opts.requests, messages, response))
+        logger.remove()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
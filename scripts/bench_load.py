@@ -0,0 +1,183 @@
+"""Load generator: synthetic concurrent sessions against the mock provider
+
+Drives ChatApp's conversation chain (history, prompt, router, rate limiter,
+retries, callbacks and metrics) with N concurrent sessions of T turns each,
+served by the local mock provider so no network or API key is involved.
+Reports, as JSON:
+
+- framework overhead per turn: process CPU time per turn. The mock model only
+  sleeps, so all CPU spent is the application's own (chain, history, routing,
+  callbacks, metrics); with one event loop this also bounds throughput at
+  1 / overhead turns per second
+- throughput in turns/s and reply tokens/s
+- p50/p90/p99 turn latency and time to first token
+- share of prompt tokens served from the (simulated) provider prompt cache
+- requests coalesced onto an identical in-flight call (every session asks
+  the same first question unless `--distinct`)
+- memory growth per session, measured in a separate tracemalloc pass so
+  tracing does not distort the timings
+
+`--baseline` compares against a previous result and exits 1 when overhead
+per turn or memory per session regresses by more than `--tolerance`.
+
+Usage:
+    python scripts/bench_load.py --sessions 200 --turns 5 --profile instant -o load.json
+    python scripts/bench_load.py --profile typical --baseline load.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+
+def percentile(values, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def latency_summary(values) -> dict:
+    return {name: round(percentile(values, q) * 1000, 3) if values else None
+            for name, q in (("p50_ms", 0.5), ("p90_ms", 0.9), ("p99_ms", 0.99))}
+
+
+async def run_session(engine, provider, session_id: str, turns: int, prompt: str, samples: list,
+                      distinct: bool = False):
+    if distinct:
+        prompt = f"{prompt} [{session_id}]"
+    for turn in range(turns):
+        start = time.perf_counter()
+        first = None
+        tokens = 0
+        async for _ in engine.astream(session_id, f"{prompt} (turn {turn})", provider):
+            if first is None:
+                first = time.perf_counter()
+            tokens += 1
+        stats = engine.turn_stats.get(session_id)
+        prompt_tokens = (stats.prompt_tokens or 0) if stats else 0
+        cached_tokens = (stats.cached_tokens or 0) if stats else 0
+        samples.append((time.perf_counter() - start, (first - start) if first else None, tokens,
+                        prompt_tokens, cached_tokens))
+
+
+async def run_load(engine, provider, sessions: int, turns: int, prompt: str, prefix: str,
+                   distinct: bool = False) -> list:
+    samples = []
+    await asyncio.gather(*(run_session(engine, provider, f"{prefix}-{i}", turns, prompt, samples, distinct)
+                           for i in range(sessions)))
+    return samples
+
+
+def measure_memory(app, provider, sessions: int, turns: int, prompt: str) -> float:
+    """Bytes retained per session after its turns complete"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    app.loop.run_until_complete(run_load(app.engine, provider, sessions, turns, prompt, "mem"))
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    growth = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return growth / sessions
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for key in ("overhead_per_turn_ms", "memory_per_session_kb"):
+        old, new = baseline.get(key), result.get(key)
+        if old and new is not None and new > old * (1 + tolerance):
+            regressions.append(f"{key}: {old} -> {new} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent session load test on the mock provider")
+    parser.add_argument("--sessions", type=int, default=100, help="Concurrent synthetic sessions")
+    parser.add_argument("--turns", type=int, default=5, help="Turns per session")
+    parser.add_argument("--profile", default="instant", help="Mock latency profile (instant, typical, slow, flaky)")
+    parser.add_argument("--prompt", default="Summarize the benefits of connection pooling in two sentences.")
+    parser.add_argument("--distinct", action="store_true",
+                        help="Give every session its own prompt so no requests can be coalesced")
+    parser.add_argument("--memory-sessions", type=int, default=None,
+                        help="Sessions for the memory pass (default: --sessions)")
+    parser.add_argument("-o", "--output", help="Write the JSON result to this file")
+    parser.add_argument("--baseline", help="Previous JSON result to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    opts = parser.parse_args()
+
+    os.environ.setdefault("MOCK_PROVIDER", "on")
+    os.environ["MOCK_PROFILE"] = opts.profile
+    os.environ.setdefault("SESSION_STORE", "memory")
+    os.environ.setdefault("RESPONSE_CACHE", "off")
+    os.environ.setdefault("MAX_CONCURRENCY_PER_PROVIDER", str(max(32, opts.sessions)))
+
+    from loguru import logger
+    logger.remove()
+    import chat
+    from providers import Provider
+
+    provider = Provider.MOCK
+    app = chat.ChatApp(batch=True)
+    try:
+        app.loop.run_until_complete(app.engine.activate(provider))
+        # Warm up: builds the chain and model once, outside the measurement
+        app.loop.run_until_complete(run_load(app.engine, provider, 1, 1, opts.prompt, "warmup"))
+
+        warmup_flight = app.engine.single_flight.stats() if app.engine.single_flight else {}
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        samples = app.loop.run_until_complete(
+            run_load(app.engine, provider, opts.sessions, opts.turns, opts.prompt, "load", opts.distinct))
+        elapsed = time.perf_counter() - start
+        cpu_time = time.process_time() - cpu_start
+        single_flight = app.engine.single_flight.stats() if app.engine.single_flight else {}
+
+        latencies = [sample[0] for sample in samples]
+        ttfts = [sample[1] for sample in samples if sample[1] is not None]
+        turns = len(samples)
+        tokens = sum(sample[2] for sample in samples)
+        prompt_tokens = sum(sample[3] for sample in samples)
+        cached_tokens = sum(sample[4] for sample in samples)
+        memory = measure_memory(app, provider, opts.memory_sessions or opts.sessions, opts.turns, opts.prompt)
+        result = {
+            "profile": opts.profile,
+            "sessions": opts.sessions,
+            "turns_per_session": opts.turns,
+            "turns": turns,
+            "elapsed_s": round(elapsed, 3),
+            "turns_per_s": round(turns / elapsed, 1),
+            "tokens_per_s": round(tokens / elapsed, 1),
+            "overhead_per_turn_ms": round(cpu_time / turns * 1000, 3),
+            "latency": latency_summary(latencies),
+            "time_to_first_token": latency_summary(ttfts),
+            "cached_prompt_ratio": round(cached_tokens / prompt_tokens, 3) if prompt_tokens else None,
+            "memory_per_session_kb": round(memory / 1024, 2),
+            "retries": app.engine.retry.retries,
+            "coalesced_requests": single_flight.get("coalesced", 0) - warmup_flight.get("coalesced", 0),
+            "upstream_calls": single_flight.get("upstream_calls", 0) - warmup_flight.get("upstream_calls", 0),
+        }
+    finally:
+        app._shutdown()
+
+    print(json.dumps(result, indent=2))
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(result, f, indent=2)
+    if opts.baseline:
+        with open(opts.baseline) as f:
+            regressions = compare(result, json.load(f), opts.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Benchmark: long-term recall latency at large index sizes
+
+Fills a RecallStore with synthetic turns (clustered random unit vectors
+written in bulk, so filling 1M rows takes seconds rather than embedding 1M
+texts), reopens it from disk and reports:
+
+- bulk insert throughput and the latency of incremental single-turn inserts
+  (embedding included)
+- time to reopen the store (the vector file is memory-mapped, not loaded)
+- p50/p99 latency of the raw index query and of a full `search()` (query
+  embedding, index query and snippet lookup)
+- for ANN backends, recall@k against exact brute-force search
+- peak RSS
+
+Usage:
+    python scripts/bench_recall.py --turns 1000000 --backend numpy
+    python scripts/bench_recall.py --turns 1000000 --backend hnswlib -o recall.json
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from loguru import logger
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from recall import NumpyIndex, RecallStore, build_embedder  # noqa: E402
+
+
+def synthetic_vectors(rng, centers, count: int, noise: float):
+    labels = rng.integers(0, len(centers), size=count)
+    vectors = centers[labels] + noise * rng.standard_normal((count, centers.shape[1]), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def percentiles(samples) -> dict:
+    ordered = sorted(samples)
+    return {
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall index latency benchmark")
+    parser.add_argument("--turns", type=int, default=1000000, help="Stored turns")
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--backend", default="numpy", help="numpy, hnswlib, faiss or auto")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=50000, help="Rows per bulk insert")
+    parser.add_argument("--path", help="Store directory (default: a temporary directory, removed afterwards)")
+    parser.add_argument("-o", "--output", help="Write the JSON result to this file")
+    opts = parser.parse_args()
+    logger.remove()
+
+    path = opts.path or tempfile.mkdtemp(prefix="recall-bench-")
+    embed, dim = build_embedder("ngram", opts.dim)
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((1000, dim), dtype=np.float32)
+    result = {"turns": opts.turns, "dim": dim}
+    try:
+        store = RecallStore(path, embed, dim, backend=opts.backend, min_score=-1.0, scope="all")
+        result["backend"] = store.index.name
+        started = time.perf_counter()
+        for start in range(store.count, opts.turns, opts.batch):
+            count = min(opts.batch, opts.turns - start)
+            entries = [(f"bench-{(start + i) % 1000}", f"synthetic turn {start + i}") for i in range(count)]
+            store.add_vectors(entries, synthetic_vectors(rng, centers, count, 0.5))
+        fill_seconds = time.perf_counter() - started
+        result["bulk_insert_rows_per_s"] = round(opts.turns / fill_seconds) if fill_seconds else None
+
+        samples = []
+        for i in range(100):
+            started = time.perf_counter()
+            store.add("bench-incremental", f"User: incremental question {i}\nAssistant: answer {i}")
+            samples.append(time.perf_counter() - started)
+        result["incremental_insert"] = percentiles(samples)
+        store.close()
+
+        started = time.perf_counter()
+        store = RecallStore(path, embed, dim, backend=opts.backend, min_score=-1.0, scope="all")
+        result["reopen_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        result["index_bytes"] = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+        queries = synthetic_vectors(rng, centers, opts.queries, 0.5)
+        samples, found = [], []
+        for query in queries:
+            started = time.perf_counter()
+            ids, _ = store.index.search(query, opts.k)
+            samples.append(time.perf_counter() - started)
+            found.append(ids)
+        result["index_query"] = percentiles(samples)
+
+        if store.index.name != "numpy":
+            exact = NumpyIndex(store)
+            hits = sum(len(set(ids) & set(exact.search(query, opts.k)[0])) for ids, query in zip(found, queries))
+            result[f"recall_at_{opts.k}"] = round(hits / (opts.k * opts.queries), 3)
+
+        samples = []
+        for i in range(opts.queries):
+            started = time.perf_counter()
+            store.search(f"what did we decide about synthetic turn {i * 997}?", opts.k, "bench-query", recent=4)
+            samples.append(time.perf_counter() - started)
+        result["search"] = percentiles(samples)
+        store.close()
+        result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    finally:
+        if not opts.path:
+            shutil.rmtree(path, ignore_errors=True)
+
+    print(json.dumps(result, indent=2))
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
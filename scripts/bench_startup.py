@@ -0,0 +1,88 @@
+"""Benchmark: cold-start import cost of the chat application
+
+Runs `python -X importtime -c "import chat"` in a fresh interpreter, sums the
+cumulative import time of the top-level modules and lists the slowest ones,
+then times full `python src/chat.py --help` cold starts. It also checks that
+no provider SDK is imported at startup (they are loaded when a provider is
+first selected).
+
+Exits non-zero when the median cold start exceeds the budget, so it can gate
+CI.
+
+Usage:
+    python scripts/bench_startup.py --runs 5 --budget-ms 1500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+PROVIDER_SDKS = ("langchain_openai", "langchain_community", "langchain_anthropic", "openai", "anthropic", "cohere")
+
+
+def import_profile(module: str = "chat"):
+    """Parse -X importtime output into {module: (self_us, cumulative_us, depth)}"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        profile[name.strip()] = (int(self_us), int(cumulative_us), depth)
+    return profile
+
+
+def cold_start(runs: int):
+    """Wall-clock seconds for `chat.py --help` in fresh interpreters"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(SRC, "chat.py"), "--help"],
+                       cwd=SRC, capture_output=True, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to list")
+    parser.add_argument("--budget-ms", type=float, default=1500.0,
+                        help="Maximum median cold-start time before failing")
+    opts = parser.parse_args()
+
+    profile = import_profile()
+    top_level = {name: cumulative for name, (_, cumulative, depth) in profile.items() if depth == 1}
+    slowest = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:opts.top]
+    timings = cold_start(opts.runs)
+    median_ms = statistics.median(timings) * 1000
+
+    report = {
+        "import_chat_ms": round(profile["chat"][1] / 1000, 1),
+        "slowest_imports_ms": {name: round(us / 1000, 1) for name, us in slowest},
+        "provider_sdks_imported": [name for name in PROVIDER_SDKS if name in profile],
+        "cold_start_ms": {
+            "median": round(median_ms, 1),
+            "min": round(min(timings) * 1000, 1),
+            "max": round(max(timings) * 1000, 1),
+        },
+        "budget_ms": opts.budget_ms,
+        "within_budget": median_ms <= opts.budget_ms,
+    }
+    print(json.dumps(report, indent=2))
+    if not report["within_budget"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Benchmark: concurrent tool execution against running the same calls one by one
+
+Builds a `ToolRuntime` with the built-in stand-in tools and, for one reply's
+worth of tool calls (async waits, blocking waits and CPU-bound prime counts),
+reports:
+
+- the time to run them one after another and through `ToolRuntime.run`
+- the time of the same reply again, with idempotent results cached
+- the worst event-loop stall while the calls run, which stays small because
+  blocking and CPU-bound tools run off the loop
+- per-tool p50 latency from the metrics registry
+
+Usage:
+    python scripts/bench_tools.py
+    python scripts/bench_tools.py --io-calls 8 --cpu-calls 4 --limit 5000000 -o tools.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from loguru import logger
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from metrics import MetricsRegistry  # noqa: E402
+from tools import BUILTIN_TOOLS, ToolRuntime  # noqa: E402
+
+
+def build_calls(opts, offset: int = 0) -> list:
+    calls = []
+    for i in range(opts.io_calls):
+        calls.append({"name": "wait", "args": {"seconds": opts.seconds}, "id": f"io{i}"})
+    for i in range(opts.blocking_calls):
+        calls.append({"name": "blocking_wait", "args": {"seconds": opts.seconds}, "id": f"block{i}"})
+    for i in range(opts.cpu_calls):
+        # Distinct limits, so the calls are not shared with each other
+        calls.append({"name": "count_primes", "args": {"limit": opts.limit + offset + i}, "id": f"cpu{i}"})
+    return calls
+
+
+async def timed(coroutine) -> tuple:
+    """(seconds, worst event-loop stall in seconds) while the coroutine runs"""
+    stall = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal stall
+        while not done:
+            before = time.perf_counter()
+            await asyncio.sleep(0.005)
+            stall = max(stall, time.perf_counter() - before - 0.005)
+
+    task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await coroutine
+    elapsed = time.perf_counter() - started
+    done = True
+    await task
+    return elapsed, stall
+
+
+async def bench(opts) -> dict:
+    metrics = MetricsRegistry()
+    runtime = ToolRuntime([factory() for factory in BUILTIN_TOOLS.values()], max_threads=opts.blocking_calls or 1,
+                          max_processes=opts.processes, metrics=metrics)
+    try:
+        # Start the worker processes outside the measurement
+        await runtime.run([{"name": "count_primes", "args": {"limit": 10}, "id": "warmup"}] * opts.processes)
+
+        async def sequential(calls):
+            for call in calls:
+                await runtime.run([call])
+
+        sequential_s, sequential_stall = await timed(sequential(build_calls(opts, 100)))
+        calls = build_calls(opts)
+        concurrent_s, concurrent_stall = await timed(runtime.run(calls))
+        cached_s, _ = await timed(runtime.run(calls))
+        per_tool = {}
+        for labels, histogram in metrics.histograms["llm_tool_duration_seconds"].items():
+            label = dict(labels)
+            per_tool[f"{label['tool']}/{label['outcome']}"] = {"calls": histogram.count,
+                                                               "p50_s": histogram.quantile(0.5)}
+        return {
+            "calls_per_reply": len(calls),
+            "sequential_s": round(sequential_s, 3),
+            "concurrent_s": round(concurrent_s, 3),
+            "speedup": round(sequential_s / concurrent_s, 2),
+            "cached_repeat_s": round(cached_s, 3),
+            "sequential_loop_stall_ms": round(sequential_stall * 1000, 1),
+            "concurrent_loop_stall_ms": round(concurrent_stall * 1000, 1),
+            "per_tool": per_tool,
+            "stats": runtime.stats(),
+        }
+    finally:
+        runtime.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tool runtime benchmark")
+    parser.add_argument("--io-calls", type=int, default=4, help="Async I/O stand-in calls per reply")
+    parser.add_argument("--blocking-calls", type=int, default=2, help="Blocking I/O stand-in calls per reply")
+    parser.add_argument("--cpu-calls", type=int, default=2, help="CPU-bound calls per reply")
+    parser.add_argument("--seconds", type=float, default=0.3, help="Duration of each I/O stand-in call")
+    parser.add_argument("--limit", type=int, default=3000000, help="count_primes limit (CPU work per call)")
+    parser.add_argument("--processes", type=int, default=2, help="Worker processes for CPU-bound tools")
+    parser.add_argument("-o", "--output", help="Write the JSON result to this file")
+    opts = parser.parse_args()
+    logger.remove()
+
+    result = asyncio.run(bench(opts))
+    print(json.dumps(result, indent=2))
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Benchmark: transcript archive write cost and query time over millions of rows
+
+Records synthetic turns through `TranscriptArchive` (spread over the last
+`--days` days, several providers and models, a few percent failures) and
+reports:
+
+- the cost of `record()` on the request path
+- background writer throughput and the on-disk size of the segments
+- the time `query_transcripts.aggregate` takes for p50/p95/p99 latency by
+  provider over the whole archive, by provider and model over the last 7
+  days, and by day
+
+Usage:
+    python scripts/bench_transcripts.py --rows 2000000
+    python scripts/bench_transcripts.py --rows 5000000 --path /tmp/archive -o transcripts.json
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from loguru import logger
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from transcripts import TranscriptArchive  # noqa: E402
+from query_transcripts import aggregate  # noqa: E402
+
+MODELS = {"openai": ["gpt-4o", "gpt-4o-mini"], "anthropic": ["claude-3-opus", "claude-3-haiku"],
+          "cohere": ["command-r-plus"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcript archive benchmark")
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--days", type=int, default=30, help="Days the synthetic turns are spread over")
+    parser.add_argument("--batch-rows", type=int, default=50000, help="Rows per segment")
+    parser.add_argument("--path", help="Archive directory (default: a temporary directory, removed afterwards)")
+    parser.add_argument("-o", "--output", help="Write the JSON result to this file")
+    opts = parser.parse_args()
+    logger.remove()
+
+    path = opts.path or tempfile.mkdtemp(prefix="transcripts-bench-")
+    rng = random.Random(0)
+    providers = list(MODELS)
+    archive = TranscriptArchive(path, batch_rows=opts.batch_rows, flush_interval=3600)
+    now = time.time()
+    result = {"rows": opts.rows}
+    try:
+        # Rows are generated oldest first, as a live archive receives them
+        record_seconds = 0.0
+        started = time.perf_counter()
+        for i in range(opts.rows):
+            provider = providers[i % len(providers)]
+            latency = rng.lognormvariate(0.5, 0.6)
+            row = (f"s{i % 5000}", provider, rng.choice(MODELS[provider]),
+                   "ok" if rng.random() > 0.03 else "error", rng.randint(50, 4000), rng.randint(0, 3000),
+                   rng.randint(20, 800), latency * 0.2, latency, f"question {i}", f"answer {i}")
+            archive_time = now - opts.days * 86400 * (1 - i / opts.rows)
+            t = time.perf_counter()
+            archive.record(*row, ts=archive_time)
+            record_seconds += time.perf_counter() - t
+        archive.close(timeout=3600)
+        elapsed = time.perf_counter() - started
+        result["record_us"] = round(record_seconds / opts.rows * 1e6, 2)
+        result["write_rows_per_s"] = round(opts.rows / elapsed)
+        result["segments"] = archive.segments_written
+        result["archive_mb"] = round(sum(os.path.getsize(os.path.join(root, name))
+                                         for root, _, names in os.walk(path) for name in names) / 2 ** 20, 1)
+
+        queries = {
+            "latency_by_provider_all": dict(group_by=["provider"], metric="latency_s"),
+            "latency_by_provider_model_7d": dict(group_by=["provider", "model"], metric="latency_s",
+                                                 since=datetime.now(timezone.utc) - timedelta(days=7)),
+            "ttft_by_day": dict(group_by=["day"], metric="ttft_s"),
+        }
+        for name, query in queries.items():
+            samples = []
+            for _ in range(3):
+                t = time.perf_counter()
+                rows = aggregate(path, **query)
+                samples.append(time.perf_counter() - t)
+            result[f"{name}_s"] = round(statistics.median(samples), 3)
+            result[f"{name}_groups"] = len(rows)
+        result["sample"] = aggregate(path, ["provider"], "latency_s")
+    finally:
+        if not opts.path:
+            shutil.rmtree(path, ignore_errors=True)
+
+    print(json.dumps(result, indent=2))
+    if opts.output:
+        with open(opts.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""Local stand-in for the OpenAI and Anthropic batch endpoints
+
+Implements just enough of both APIs for the native batch backend:
+
+    OpenAI:    POST /v1/files, POST /v1/batches, GET /v1/batches/{id},
+               POST /v1/batches/{id}/cancel, GET /v1/files/{id}/content
+    Anthropic: POST /v1/messages/batches, GET /v1/messages/batches/{id},
+               POST /v1/messages/batches/{id}/cancel,
+               GET /v1/messages/batches/{id}/results
+
+Batches finish `--delay` seconds after submission. Each request is answered
+with an echo of its last user message; requests whose message contains
+"FAIL" get a per-item error instead. `--flaky-polls N` answers the first N
+status polls of each batch with a 503 to exercise poll retries.
+
+Usage:
+    python scripts/mock_batch_server.py --port 8089 --delay 2
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 ANTHROPIC_BASE_URL=http://127.0.0.1:8089 \\
+        python src/chat.py batch prompts.jsonl --native
+"""
+import argparse
+import email.parser
+import email.policy
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockBatchServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, delay: float = 1.0, flaky_polls: int = 0):
+        super().__init__(("127.0.0.1", port), MockBatchHandler)
+        self.delay = delay
+        self.flaky_polls = flaky_polls
+        self.files = {}
+        self.batches = {}
+        self.polls = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def new_id(self, prefix: str) -> str:
+        with self.lock:
+            return f"{prefix}_{next(self.ids)}"
+
+    def finished(self, batch: dict) -> bool:
+        return batch["cancelled"] or time.time() - batch["created_at"] >= self.delay
+
+
+def _reply(messages: list) -> tuple:
+    """(text, error) for one request: echo the last user message unless it asks to fail"""
+    text = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    if "FAIL" in text:
+        return None, "Mock failure requested"
+    return f"echo: {text}", None
+
+
+class MockBatchHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body, content_type: str = "application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _poll_allowed(self, batch_id: str) -> bool:
+        server = self.server
+        with server.lock:
+            server.polls[batch_id] = server.polls.get(batch_id, 0) + 1
+            return server.polls[batch_id] > server.flaky_polls
+
+    def do_POST(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        if path == "/v1/files":
+            message = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + self._body())
+            content = next(part.get_payload(decode=True) for part in message.iter_parts()
+                           if part.get_filename())
+            file_id = server.new_id("file")
+            server.files[file_id] = content
+            self._send(200, {"id": file_id, "object": "file", "purpose": "batch", "bytes": len(content)})
+        elif path == "/v1/batches":
+            request = json.loads(self._body())
+            lines = [json.loads(line) for line in server.files[request["input_file_id"]].splitlines() if line.strip()]
+            batch_id = server.new_id("batch")
+            server.batches[batch_id] = {"kind": "openai", "lines": lines, "created_at": time.time(),
+                                        "cancelled": False}
+            self._send(200, self._openai_batch(batch_id))
+        elif path == "/v1/messages/batches":
+            requests = json.loads(self._body())["requests"]
+            batch_id = server.new_id("msgbatch")
+            server.batches[batch_id] = {"kind": "anthropic", "lines": requests, "created_at": time.time(),
+                                        "cancelled": False}
+            self._send(200, self._anthropic_batch(batch_id))
+        elif path.endswith("/cancel"):
+            batch_id = path.split("/")[-2]
+            server.batches[batch_id]["cancelled"] = True
+            batch = self._openai_batch(batch_id) if server.batches[batch_id]["kind"] == "openai" \
+                else self._anthropic_batch(batch_id)
+            self._send(200, batch)
+        else:
+            self._send(404, {"error": {"message": f"Unknown path {path}"}})
+
+    def do_GET(self):
+        server = self.server
+        path = self.path.split("?")[0]
+        parts = path.strip("/").split("/")
+        if path.startswith("/v1/batches/"):
+            if not self._poll_allowed(parts[2]):
+                self._send(503, {"error": {"message": "Mock overloaded"}})
+                return
+            self._send(200, self._openai_batch(parts[2]))
+        elif path.startswith("/v1/files/") and path.endswith("/content"):
+            self._send(200, server.files[parts[2]], "application/jsonl")
+        elif path.startswith("/v1/messages/batches/") and path.endswith("/results"):
+            self._send(200, self._anthropic_results(parts[3]), "application/jsonl")
+        elif path.startswith("/v1/messages/batches/"):
+            if not self._poll_allowed(parts[3]):
+                self._send(503, {"error": {"message": "Mock overloaded"}})
+                return
+            self._send(200, self._anthropic_batch(parts[3]))
+        else:
+            self._send(404, {"error": {"message": f"Unknown path {path}"}})
+
+    def _openai_batch(self, batch_id: str) -> dict:
+        server = self.server
+        batch = server.batches[batch_id]
+        total = len(batch["lines"])
+        body = {"id": batch_id, "object": "batch", "status": "in_progress",
+                "request_counts": {"total": total, "completed": 0, "failed": 0},
+                "output_file_id": None, "error_file_id": None}
+        if not server.finished(batch):
+            return body
+        if "output_file_id" not in batch:
+            outputs, errors = [], []
+            for line in batch["lines"]:
+                text, error = _reply(line["body"]["messages"])
+                if batch["cancelled"]:
+                    errors.append({"custom_id": line["custom_id"], "response": None,
+                                   "error": {"code": "batch_cancelled", "message": "Batch cancelled"}})
+                elif error:
+                    errors.append({"custom_id": line["custom_id"], "response": {
+                        "status_code": 400, "body": {"error": {"message": error}}}, "error": None})
+                else:
+                    outputs.append({"custom_id": line["custom_id"], "error": None, "response": {
+                        "status_code": 200, "body": {
+                            "choices": [{"message": {"role": "assistant", "content": text}}],
+                            "usage": {"prompt_tokens": len(json.dumps(line["body"]["messages"])) // 4,
+                                      "completion_tokens": len(text) // 4}}}})
+            for key, rows in (("output_file_id", outputs), ("error_file_id", errors)):
+                file_id = None
+                if rows:
+                    file_id = server.new_id("file")
+                    server.files[file_id] = "".join(json.dumps(row) + "\n" for row in rows).encode()
+                batch[key] = file_id
+            batch["counts"] = {"total": total, "completed": len(outputs), "failed": len(errors)}
+        body.update({"status": "cancelled" if batch["cancelled"] else "completed",
+                     "request_counts": batch["counts"],
+                     "output_file_id": batch["output_file_id"], "error_file_id": batch["error_file_id"]})
+        return body
+
+    def _anthropic_batch(self, batch_id: str) -> dict:
+        server = self.server
+        batch = server.batches[batch_id]
+        done = server.finished(batch)
+        return {
+            "id": batch_id, "type": "message_batch",
+            "processing_status": "ended" if done else "in_progress",
+            "request_counts": {"processing": 0 if done else len(batch["lines"])},
+            "results_url": f"http://127.0.0.1:{server.server_port}/v1/messages/batches/{batch_id}/results"
+            if done else None,
+        }
+
+    def _anthropic_results(self, batch_id: str) -> bytes:
+        batch = self.server.batches[batch_id]
+        rows = []
+        for request in batch["lines"]:
+            text, error = _reply(request["params"]["messages"])
+            if batch["cancelled"]:
+                result = {"type": "canceled"}
+            elif error:
+                result = {"type": "errored", "error": {"type": "error", "error": {
+                    "type": "invalid_request_error", "message": error}}}
+            else:
+                result = {"type": "succeeded", "message": {
+                    "type": "message", "role": "assistant", "content": [{"type": "text", "text": text}],
+                    "usage": {"input_tokens": len(json.dumps(request["params"]["messages"])) // 4,
+                              "output_tokens": len(text) // 4}}}
+            rows.append({"custom_id": request["custom_id"], "result": result})
+        return "".join(json.dumps(row) + "\n" for row in rows).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock provider batch API server")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--delay", type=float, default=2.0, help="Seconds until each batch finishes")
+    parser.add_argument("--flaky-polls", type=int, default=0,
+                        help="Status polls per batch answered with 503 before succeeding")
+    opts = parser.parse_args()
+    server = MockBatchServer(opts.port, opts.delay, opts.flaky_polls)
+    print(f"Mock batch API listening on http://127.0.0.1:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Aggregate the transcript archive: turns, latency percentiles, tokens and errors per group
+
+Opens the Parquet segments written by `TranscriptArchive` as one pyarrow
+dataset over a memory-mapped filesystem. Only the columns the query uses are
+read, and day partitions outside `--since`/`--until` are skipped without
+opening them, so the text columns cost nothing and millions of rows
+aggregate in seconds.
+
+Usage:
+    python scripts/query_transcripts.py --since 30d --group-by provider
+    python scripts/query_transcripts.py --since 2024-06-01 --group-by provider,model --metric ttft_s
+    python scripts/query_transcripts.py --group-by day --outcome ok --json
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+GROUPS = ("provider", "model", "outcome", "session_id", "day")
+METRICS = ("latency_s", "ttft_s")
+TOKEN_COLUMNS = ("prompt_tokens", "cached_tokens", "completion_tokens")
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def parse_time(value: str) -> datetime:
+    """An ISO date/time, or an age such as 30d, 12h or 15m"""
+    match = re.fullmatch(r"(\d+)([dhm])", value)
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)
+        delta = {"d": timedelta(days=amount), "h": timedelta(hours=amount), "m": timedelta(minutes=amount)}[unit]
+        return datetime.now(timezone.utc) - delta
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def build_filter(pa, ds, since, until, outcome):
+    conditions = []
+    timestamp = pa.timestamp("ms", tz="UTC")
+    if since is not None:
+        conditions.append(ds.field("date") >= since.strftime("%Y-%m-%d"))
+        conditions.append(ds.field("ts") >= pa.scalar(since, type=timestamp))
+    if until is not None:
+        conditions.append(ds.field("date") <= until.strftime("%Y-%m-%d"))
+        conditions.append(ds.field("ts") < pa.scalar(until, type=timestamp))
+    if outcome:
+        conditions.append(ds.field("outcome") == outcome)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def aggregate(path: str, group_by, metric: str, since=None, until=None, outcome=None) -> list:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    partitioning = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+    dataset = ds.dataset(path, format="parquet", partitioning=partitioning,
+                         filesystem=fs.LocalFileSystem(use_mmap=True))
+    keys = ["date" if key == "day" else key for key in group_by]
+    columns = sorted(set(keys + [metric, "outcome"] + list(TOKEN_COLUMNS)))
+    table = dataset.to_table(columns=columns, filter=build_filter(pa, ds, since, until, outcome))
+    table = table.append_column("failed", pc.cast(pc.not_equal(table["outcome"], "ok"), pa.int64()))
+    if not keys:
+        table = table.append_column("all", pa.array([""] * len(table), pa.string()))
+        keys = ["all"]
+    result = table.group_by(keys).aggregate(
+        [("failed", "count"), (metric, "mean"),
+         (metric, "tdigest", pc.TDigestOptions(q=list(QUANTILES))),
+         ("failed", "sum")] +
+        [(column, "sum") for column in TOKEN_COLUMNS]
+    )
+    rows = []
+    for row in result.to_pylist():
+        quantiles = row[f"{metric}_tdigest"] or [None] * len(QUANTILES)
+        entry = {("day" if key == "date" else key): row[key] for key in keys if key != "all"}
+        entry.update({
+            "turns": row["failed_count"],
+            "failed": row["failed_sum"],
+            **{f"p{int(q * 100)}": round(value, 3) if value is not None else None
+               for q, value in zip(QUANTILES, quantiles)},
+            "mean": round(row[f"{metric}_mean"], 3) if row[f"{metric}_mean"] is not None else None,
+            **{column: row[f"{column}_sum"] for column in TOKEN_COLUMNS},
+        })
+        rows.append(entry)
+    rows.sort(key=lambda entry: tuple(str(entry.get(key)) for key in group_by))
+    return rows
+
+
+def print_table(rows: list, metric: str):
+    if not rows:
+        print("No matching turns")
+        return
+    headers = list(rows[0].keys())
+    widths = {header: max(len(header), *(len(str(row[header])) for row in rows)) for header in headers}
+    print(f"{metric}:")
+    print("  ".join(header.ljust(widths[header]) for header in headers))
+    for row in rows:
+        print("  ".join(str(row[header]).ljust(widths[header]) for header in headers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the transcript archive")
+    parser.add_argument("--path", default=os.getenv("TRANSCRIPT_PATH", os.path.join("data", "transcripts")),
+                        help="Archive directory")
+    parser.add_argument("--since", type=parse_time, help="Start: ISO date/time or age such as 30d")
+    parser.add_argument("--until", type=parse_time, help="End (exclusive): ISO date/time or age")
+    parser.add_argument("--group-by", default="provider",
+                        help=f"Comma-separated keys from {', '.join(GROUPS)}, or 'none'")
+    parser.add_argument("--metric", choices=METRICS, default="latency_s", help="Column for the percentiles")
+    parser.add_argument("--outcome", help="Only turns with this outcome (ok, error, rate_limited, cancelled)")
+    parser.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+    opts = parser.parse_args()
+
+    group_by = [] if opts.group_by == "none" else [key.strip() for key in opts.group_by.split(",") if key.strip()]
+    unknown = [key for key in group_by if key not in GROUPS]
+    if unknown:
+        parser.error(f"Unknown group key: {', '.join(unknown)}")
+    if not os.path.isdir(opts.path):
+        print(f"No transcript archive at {opts.path}", file=sys.stderr)
+        sys.exit(1)
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print("pyarrow is required: pip install pyarrow", file=sys.stderr)
+        sys.exit(1)
+
+    started = time.perf_counter()
+    rows = aggregate(opts.path, group_by, opts.metric, opts.since, opts.until, opts.outcome)
+    elapsed = time.perf_counter() - started
+    if opts.json:
+        print(json.dumps({"metric": opts.metric, "rows": rows, "seconds": round(elapsed, 3)}, indent=2))
+    else:
+        print_table(rows, opts.metric)
+        print(f"\n{sum(row['turns'] for row in rows)} turns in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""Minimal HTTP/1.1 host for ASGI applications
+
+Used by `chat.py serve` when uvicorn is not installed. It supports what the
+chat server needs and nothing more:
+
+    - keep-alive connections with Content-Length request bodies
+    - chunked streaming responses
+    - flow control: every write waits for the socket buffer to drain, so a
+      slow client slows the producer instead of being buffered without bound
+    - disconnect detection through `receive()` once the body has been read
+    - graceful stop: the listener closes, idle keep-alive connections are
+      dropped, and in-flight requests get a deadline to finish
+
+Pipelined requests and chunked request bodies are not supported.
+"""
+import asyncio
+import socket
+from typing import Optional, Set
+from urllib.parse import unquote
+
+from loguru import logger
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+
+REASONS = {
+    200: "OK", 201: "Created", 204: "No Content", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 411: "Length Required", 413: "Payload Too Large",
+    429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+def listen_socket(host: str, port: int, reuse_port: bool = False) -> socket.socket:
+    """Bind a listening TCP socket; with `reuse_port` several processes can share the port"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.setblocking(False)
+    return sock
+
+
+class _Response:
+    """ASGI `send` for one request, writing HTTP/1.1 to the stream"""
+    def __init__(self, writer: asyncio.StreamWriter, keep_alive: bool):
+        self.writer = writer
+        self.keep_alive = keep_alive
+        self.started = False
+        self.finished = False
+        self.chunked = False
+
+    async def send(self, message: dict):
+        if message["type"] == "http.response.start":
+            headers = [(bytes(k).lower(), bytes(v)) for k, v in message.get("headers", [])]
+            names = {k for k, _ in headers}
+            self.chunked = b"content-length" not in names
+            if self.chunked:
+                headers.append((b"transfer-encoding", b"chunked"))
+            headers.append((b"connection", b"keep-alive" if self.keep_alive else b"close"))
+            status = message["status"]
+            head = f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}\r\n".encode()
+            head += b"".join(k + b": " + v + b"\r\n" for k, v in headers) + b"\r\n"
+            self.writer.write(head)
+            self.started = True
+        elif message["type"] == "http.response.body":
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if self.chunked:
+                if body:
+                    self.writer.write(f"{len(body):x}\r\n".encode() + body + b"\r\n")
+                if not more:
+                    self.writer.write(b"0\r\n\r\n")
+            elif body:
+                self.writer.write(body)
+            if not more:
+                self.finished = True
+            await self.writer.drain()
+
+
+class ASGIHost:
+    """Serve an ASGI application over HTTP/1.1 with asyncio streams
+
+    Args:
+        app: ASGI application
+        keepalive_timeout: Seconds an idle keep-alive connection is kept
+    """
+    def __init__(self, app, keepalive_timeout: float = 5.0):
+        self.app = app
+        self.keepalive_timeout = keepalive_timeout
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.connections: Set[asyncio.Task] = set()
+        self.busy: Set[asyncio.Task] = set()
+        self.draining = False
+
+    async def start(self, sock: socket.socket):
+        self.server = await asyncio.start_server(self._connection, sock=sock, limit=MAX_HEADER_BYTES)
+
+    async def stop(self, timeout: float):
+        """Stop accepting, let in-flight requests finish for up to `timeout` seconds"""
+        self.draining = True
+        if self.server is not None:
+            self.server.close()
+        for task in self.connections - self.busy:
+            task.cancel()
+        if self.busy:
+            done, pending = await asyncio.wait(set(self.busy), timeout=timeout)
+            for task in pending:
+                task.cancel()
+        await asyncio.gather(*list(self.connections), return_exceptions=True)
+
+    async def _connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while not self.draining:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keepalive_timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                        ConnectionError):
+                    break
+                self.busy.add(task)
+                try:
+                    if not await self._request(head, reader, writer):
+                        break
+                finally:
+                    self.busy.discard(task)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def _request(self, head: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Handle one request; returns whether the connection can be reused"""
+        try:
+            lines = head.decode("latin-1").split("\r\n")
+            method, target, version = lines[0].split(" ", 2)
+            headers = []
+            for line in lines[1:]:
+                if line:
+                    name, _, value = line.partition(":")
+                    headers.append((name.strip().lower(), value.strip()))
+        except ValueError:
+            await self._simple(writer, 400)
+            return False
+        fields = dict(headers)
+        if "chunked" in fields.get("transfer-encoding", "").lower():
+            await self._simple(writer, 411)
+            return False
+        try:
+            length = int(fields.get("content-length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            await self._simple(writer, 400)
+            return False
+        if length > MAX_BODY_BYTES:
+            await self._simple(writer, 413)
+            return False
+        body = await reader.readexactly(length) if length else b""
+        keep_alive = version == "HTTP/1.1" and fields.get("connection", "").lower() != "close"
+
+        path, _, query = target.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0", "spec_version": "2.3"},
+            "http_version": version.split("/")[-1],
+            "method": method.upper(),
+            "scheme": "http",
+            "path": unquote(path),
+            "raw_path": path.encode("latin-1"),
+            "query_string": query.encode("latin-1"),
+            "root_path": "",
+            "headers": [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+            "client": (writer.get_extra_info("peername") or (None, None))[:2],
+            "server": (writer.get_extra_info("sockname") or (None, None))[:2],
+        }
+        delivered = False
+        extra = bytearray()
+
+        async def receive() -> dict:
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            # After the body the only event is a disconnect
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    return {"type": "http.disconnect"}
+                extra.extend(data)
+
+        response = _Response(writer, keep_alive and not self.draining)
+        try:
+            await self.app(scope, receive, response.send)
+        except (ConnectionError, asyncio.CancelledError):
+            return False
+        except Exception as e:
+            logger.error(f"Unhandled error serving {method} {path}: {str(e)}")
+            if not response.started:
+                await self._simple(writer, 500)
+            return False
+        # Data sent while the response was in flight would be a pipelined request
+        return response.keep_alive and response.finished and not extra
+
+    @staticmethod
+    async def _simple(writer: asyncio.StreamWriter, status: int):
+        reason = REASONS.get(status, "Error")
+        body = reason.encode()
+        writer.write(f"HTTP/1.1 {status} {reason}\r\ncontent-type: text/plain\r\ncontent-length: {len(body)}\r\n"
+                     f"connection: close\r\n\r\n".encode() + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
@@ -0,0 +1,470 @@
+"""Non-interactive batch runs over a JSONL file of prompts
+
+Each input line is a JSON object with the prompt under "input" (or
+"prompt") and optionally "id", "provider" and "session". Lines are read
+lazily and handed to a pool of async workers that call `ChatEngine.astream`,
+so per-provider concurrency limits, rate limits, routing and retries all
+apply. Items without a session run in a throwaway session of their own; items
+sharing a session run in input order as one conversation.
+
+Memory stays bounded: at most `max_pending` items are read ahead of the
+oldest unwritten result. Results are written in input order or in
+completion order, and a checkpoint (low watermark, completed indices above
+it and the output size) is saved atomically as results are written so a
+crashed run can resume without duplicating or losing lines.
+
+`NativeBatchRunner` sends the same input through the providers' asynchronous
+batch APIs instead (see provider_batch.py) for jobs that can wait for results.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from langchain_core.messages import AIMessage, HumanMessage
+from loguru import logger
+
+from engine import SYSTEM_PROMPT, ChatEngine
+from provider_batch import BACKENDS, BatchRequest, PollBackoff, batch_backend
+from providers import Provider
+from summary import SUMMARY_PREFIX
+
+ORDER_INPUT = "input"
+ORDER_COMPLETION = "completion"
+
+
+class BatchCheckpoint:
+    """Progress of a batch run, saved next to the output file
+
+    Args:
+        path: Checkpoint file
+        input_path: Input file the progress refers to
+    """
+    def __init__(self, path: str, input_path: str):
+        self.path = path
+        self.input_path = os.path.abspath(input_path)
+        self.watermark = -1
+        self.done: Set[int] = set()
+        self.output_bytes = 0
+
+    def is_done(self, index: int) -> bool:
+        return index <= self.watermark or index in self.done
+
+    def mark(self, index: int):
+        self.done.add(index)
+        while self.watermark + 1 in self.done:
+            self.watermark += 1
+            self.done.remove(self.watermark)
+
+    def load(self) -> bool:
+        """Load saved progress; returns False if there is none for this input"""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if state.get("input") != self.input_path:
+            raise ValueError(f"Checkpoint {self.path} belongs to {state.get('input')}, not {self.input_path}")
+        self.watermark = state["watermark"]
+        self.done = set(state["done"])
+        self.output_bytes = state["output_bytes"]
+        return True
+
+    def save(self):
+        state = {
+            "input": self.input_path,
+            "watermark": self.watermark,
+            "done": sorted(self.done),
+            "output_bytes": self.output_bytes,
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BatchStats:
+    """Throughput counters for a batch run"""
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.tokens = 0
+
+    def report(self) -> Dict[str, float]:
+        elapsed = time.perf_counter() - self.started_at
+        processed = self.completed + self.failed
+        return {
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "elapsed": round(elapsed, 2),
+            "requests_per_second": round(processed / elapsed, 2) if elapsed > 0 else 0.0,
+            "tokens_per_second": round(self.tokens / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+
+
+class BatchRunner:
+    """Run every prompt in a JSONL file through the chat engine
+
+    Args:
+        engine: Engine serving the requests
+        workers: Concurrent requests in flight across all providers
+        order: Write results in "input" order or "completion" order
+        max_pending: Items read ahead of the oldest unwritten result,
+            defaulting to four per worker
+        checkpoint_every: Results written between checkpoint saves
+        provider: Provider tried first for items that do not name one, or
+            None to let the router rank providers by score
+    """
+    def __init__(self, engine: ChatEngine, workers: int = 8, order: str = ORDER_INPUT,
+                 max_pending: Optional[int] = None, checkpoint_every: int = 50,
+                 provider: Optional[Provider] = None):
+        if order not in (ORDER_INPUT, ORDER_COMPLETION):
+            raise ValueError(f"Unknown result order: {order}")
+        self.engine = engine
+        self.workers = workers
+        self.order = order
+        self.max_pending = max_pending or workers * 4
+        self.checkpoint_every = checkpoint_every
+        self.provider = provider
+        self.stats = BatchStats()
+
+    @staticmethod
+    def read_items(path: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+        """Yield (index, item, error) for each non-blank input line"""
+        with open(path) as f:
+            index = 0
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                    if not isinstance(item, dict) or not (item.get("input") or item.get("prompt")):
+                        raise ValueError("expected an object with an 'input' or 'prompt' field")
+                    yield index, item, None
+                except ValueError as e:
+                    yield index, None, f"Invalid input line: {str(e)}"
+                index += 1
+
+    async def _process(self, index: int, item: Optional[dict], error: Optional[str]) -> dict:
+        if error is not None:
+            return {"index": index, "error": error}
+        result = {"index": index}
+        if "id" in item:
+            result["id"] = item["id"]
+        session_id = item.get("session") or f"batch-{index}"
+        try:
+            provider = Provider(item["provider"]) if item.get("provider") else self.provider
+            result["output"] = await self.engine.ainvoke(session_id, item.get("input") or item["prompt"], provider)
+            stats = self.engine.turn_stats.get(session_id)
+            if stats is not None:
+                result["provider"] = stats.provider.value if stats.provider else None
+                result["tokens"] = stats.tokens
+                result["latency"] = round(stats.total_time, 3)
+                if stats.cached_tokens is not None:
+                    result["cached_tokens"] = stats.cached_tokens
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {str(e)}"
+        finally:
+            if not item.get("session"):
+                self.engine.close_session(session_id)
+        return result
+
+    async def run(self, input_path: str, output_path: str, checkpoint_path: Optional[str] = None,
+                  resume: bool = False) -> Dict[str, float]:
+        """Process the input file and write one JSON result per line
+
+        Args:
+            input_path: JSONL file of prompts
+            output_path: JSONL file receiving results
+            checkpoint_path: Progress file, defaulting to `<output>.checkpoint`
+            resume: Continue from the checkpoint instead of starting over
+
+        Returns:
+            Throughput report
+        """
+        checkpoint = BatchCheckpoint(checkpoint_path or f"{output_path}.checkpoint", input_path)
+        if resume and checkpoint.load():
+            logger.info(f"Resuming batch after {checkpoint.watermark + 1 + len(checkpoint.done)} completed items")
+            output = open(output_path, "a+")
+            # Drop any results written after the last checkpoint; they are redone
+            output.truncate(checkpoint.output_bytes)
+        else:
+            output = open(output_path, "w")
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers)
+        window = asyncio.Semaphore(self.max_pending)
+        ready: Dict[int, dict] = {}
+        next_index = [checkpoint.watermark + 1]
+        since_checkpoint = [0]
+
+        def write(result: dict):
+            output.write(json.dumps(result) + "\n")
+            checkpoint.mark(result["index"])
+            if "error" in result:
+                self.stats.failed += 1
+            else:
+                self.stats.completed += 1
+                self.stats.tokens += result.get("tokens", 0)
+            window.release()
+            since_checkpoint[0] += 1
+            if since_checkpoint[0] >= self.checkpoint_every:
+                save()
+
+        def save():
+            output.flush()
+            checkpoint.output_bytes = output.tell()
+            checkpoint.save()
+            since_checkpoint[0] = 0
+
+        def deliver(result: dict):
+            if self.order == ORDER_COMPLETION:
+                write(result)
+                return
+            ready[result["index"]] = result
+            while True:
+                while checkpoint.is_done(next_index[0]):
+                    next_index[0] += 1
+                pending = ready.pop(next_index[0], None)
+                if pending is None:
+                    break
+                write(pending)
+
+        async def worker():
+            while True:
+                entry = await queue.get()
+                if entry is None:
+                    return
+                deliver(await self._process(*entry))
+
+        async def produce():
+            for entry in self.read_items(input_path):
+                if checkpoint.is_done(entry[0]):
+                    self.stats.skipped += 1
+                    continue
+                await window.acquire()
+                await queue.put(entry)
+            for _ in range(self.workers):
+                await queue.put(None)
+
+        try:
+            tasks = [asyncio.ensure_future(worker()) for _ in range(self.workers)]
+            await produce()
+            await asyncio.gather(*tasks)
+            save()
+            checkpoint.remove()
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            save()
+            raise
+        finally:
+            output.close()
+
+        report = self.stats.report()
+        logger.info(f"Batch finished: {report}")
+        return report
+
+
+class NativeBatchRunner:
+    """Run a JSONL file of prompts through provider-native batch APIs
+
+    Every item is submitted up front (items naming a provider go to that
+    provider, the rest to the default one) and results are written as each
+    batch finishes, in completion order. Items with a "session" are sent with
+    that session's history and their exchange is appended to it once their
+    batch is written. Items naming an unknown provider, or one without a batch
+    API or configuration, get an error record instead. The checkpoint is
+    saved as each batch id is returned, so `resume` continues polling instead
+    of submitting (and paying) twice, and only submits what was never sent.
+
+    Args:
+        engine: Engine providing provider configuration, the HTTP pool and sessions
+        provider: Provider for items that do not name one
+        poll: Status polling schedule
+    """
+    def __init__(self, engine: ChatEngine, provider: Provider, poll: Optional[PollBackoff] = None):
+        self.engine = engine
+        self.provider = provider
+        self.poll = poll or PollBackoff.from_env()
+        self.stats = BatchStats()
+
+    def _backend(self, provider: Provider):
+        return batch_backend(provider, self.engine.providers[provider],
+                             self.engine.clients.async_http_client, self.poll)
+
+    def _system(self, session_id: Optional[str]) -> str:
+        """System message, followed by the session's summary of earlier turns if it has one"""
+        if session_id:
+            summary = self.engine.get_session_history(session_id).summary
+            if summary is not None and (summary.text or summary.pending):
+                return f"{SYSTEM_PROMPT}\n\n{SUMMARY_PREFIX}{summary.prompt_text()}"
+        return SYSTEM_PROMPT
+
+    def _messages(self, session_id: Optional[str], user_input: str) -> List[Dict[str, str]]:
+        messages = []
+        if session_id:
+            for message in self.engine.get_session_history(session_id).messages:
+                role = "assistant" if message.type == "ai" else "user"
+                messages.append({"role": role, "content": message.content})
+        messages.append({"role": "user", "content": user_input})
+        return messages
+
+    def _item_provider(self, item: dict) -> Tuple[Optional[Provider], Optional[str]]:
+        """(provider, None) for an item, or (None, error) if it cannot go through a batch API"""
+        name = item.get("provider")
+        if name:
+            try:
+                provider = Provider(name)
+            except ValueError:
+                return None, f"Unknown provider '{name}'"
+        else:
+            provider = self.provider
+        if provider not in BACKENDS:
+            return None, f"{provider.value} has no native batch API"
+        if not self.engine.is_configured(provider):
+            return None, f"Provider '{provider.value}' is not configured"
+        return provider, None
+
+    async def _submit(self, requests: Dict[Provider, List[BatchRequest]], state: dict, checkpoint_path: str,
+                      output):
+        """Submit requests not in a recorded batch, saving the checkpoint after each batch id"""
+        submitted = {custom_id for batch in state["batches"] for custom_id in batch.get("custom_ids", ())}
+        for provider, provider_requests in requests.items():
+            remaining = [request for request in provider_requests if request.custom_id not in submitted]
+            if not remaining:
+                continue
+
+            def record(batch_id: str, custom_ids: List[str], provider: Provider = provider):
+                state["batches"].append({"provider": provider.value, "id": batch_id, "done": False,
+                                         "custom_ids": custom_ids})
+                self._save(checkpoint_path, state, output)
+
+            await self._backend(provider).submit(remaining, record)
+        state["submitted"] = True
+        self._save(checkpoint_path, state, output)
+
+    @staticmethod
+    def _save(path: str, state: dict, output):
+        output.flush()
+        state["output_bytes"] = output.tell()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+
+    async def run(self, input_path: str, output_path: str, checkpoint_path: Optional[str] = None,
+                  resume: bool = False) -> Dict[str, float]:
+        """Submit the input file, wait for the batches and write one result per line
+
+        Args:
+            input_path: JSONL file of prompts
+            output_path: JSONL file receiving results
+            checkpoint_path: Progress file, defaulting to `<output>.checkpoint`
+            resume: Continue from the checkpoint: submit what was never sent and
+                poll the recorded batches
+
+        Returns:
+            Throughput report
+        """
+        checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+        state = None
+        if resume:
+            try:
+                with open(checkpoint_path) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = None
+            if state is not None and state.get("input") != os.path.abspath(input_path):
+                raise ValueError(f"Checkpoint {checkpoint_path} belongs to {state.get('input')}")
+
+        items: Dict[str, dict] = {}
+        requests: Dict[Provider, List[BatchRequest]] = {}
+        invalid = []
+        for index, item, error in BatchRunner.read_items(input_path):
+            provider = None
+            if error is None:
+                provider, error = self._item_provider(item)
+            if error is not None:
+                invalid.append({"index": index, "error": error})
+                continue
+            user_input = item.get("input") or item["prompt"]
+            custom_id = str(index)
+            items[custom_id] = {"index": index, "id": item.get("id"), "session": item.get("session"),
+                                "input": user_input}
+            if state is None or not state.get("submitted", True):
+                requests.setdefault(provider, []).append(
+                    BatchRequest(custom_id, self._messages(item.get("session"), user_input),
+                                 system=self._system(item.get("session"))))
+
+        written: Set[str] = set()
+        if state is None:
+            output = open(output_path, "w")
+            state = {"input": os.path.abspath(input_path), "batches": [], "submitted": False, "output_bytes": 0}
+            for result in invalid:
+                output.write(json.dumps(result) + "\n")
+                self.stats.failed += 1
+            self._save(checkpoint_path, state, output)
+        else:
+            # Drop results written after the last checkpoint; their batch is downloaded again
+            os.truncate(output_path, state["output_bytes"])
+            with open(output_path) as f:
+                for line in f:
+                    written.add(str(json.loads(line)["index"]))
+            self.stats.skipped = len(written)
+            output = open(output_path, "a")
+
+        try:
+            if not state.get("submitted", True):
+                await self._submit(requests, state, checkpoint_path, output)
+            for batch in state["batches"]:
+                if batch["done"]:
+                    continue
+                backend = self._backend(Provider(batch["provider"]))
+                exchanges = []
+                async for result in backend.results(batch["id"]):
+                    item = items.get(result.custom_id)
+                    if item is None or result.custom_id in written:
+                        continue
+                    written.add(result.custom_id)
+                    record = {"index": item["index"]}
+                    if item["id"] is not None:
+                        record["id"] = item["id"]
+                    record["provider"] = batch["provider"]
+                    if result.error is not None:
+                        record["error"] = result.error
+                        self.stats.failed += 1
+                    else:
+                        record["output"] = result.output
+                        record["tokens"] = result.usage.get("completion_tokens", 0)
+                        record["usage"] = result.usage
+                        self.stats.completed += 1
+                        self.stats.tokens += record["tokens"]
+                        if item["session"]:
+                            exchanges.append((item["session"], item["input"], result.output))
+                    output.write(json.dumps(record) + "\n")
+                for session_id, user_input, reply in exchanges:
+                    self.engine.get_session_history(session_id).add_messages(
+                        [HumanMessage(content=user_input), AIMessage(content=reply)])
+                batch["done"] = True
+                self._save(checkpoint_path, state, output)
+
+            for custom_id, item in items.items():
+                if custom_id not in written:
+                    output.write(json.dumps({"index": item["index"], "error": "No result returned"}) + "\n")
+                    self.stats.failed += 1
+            output.flush()
+            os.remove(checkpoint_path)
+        finally:
+            output.close()
+
+        report = self.stats.report()
+        logger.info(f"Native batch finished: {report}")
+        return report
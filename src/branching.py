@@ -0,0 +1,74 @@
+"""Copy-on-write conversation branches
+
+A session's messages form a tree of `TurnNode`s linked to their parent. A
+branch is just a pointer to its newest node: forking stores one reference,
+however long the conversation, and the branches share every message before
+the fork point. Appending to a branch adds a node without
+touching the others.
+
+Each node caches its depth (messages from the start of the session) and the
+token total of its whole path, so branch sizes are known without walking
+them. Walking happens only to rebuild a history window, and stops once the
+window's token budget is filled. The history unlinks a node from its parent
+once no branch needs the older messages; depths and totals stay as they
+were.
+"""
+from typing import Iterator, Optional
+
+from langchain_core.messages import BaseMessage
+
+MAIN_BRANCH = "main"
+
+
+class TurnNode:
+    """One message in the conversation tree
+
+    Args:
+        message: The message
+        tokens: Tokens the message contributes to a prompt
+        parent: Previous message on the branch, or None for the first one
+        root_depth: Messages before the first node (e.g. stored turns that
+            were not loaded), used when there is no parent
+    """
+    __slots__ = ("message", "tokens", "parent", "depth", "total_tokens")
+
+    def __init__(self, message: BaseMessage, tokens: int, parent: Optional["TurnNode"] = None,
+                 root_depth: int = 0):
+        self.message = message
+        self.tokens = tokens
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else root_depth + 1
+        self.total_tokens = tokens + (parent.total_tokens if parent is not None else 0)
+
+
+def walk(node: Optional[TurnNode]) -> Iterator[TurnNode]:
+    """Yield a node and its ancestors, newest first"""
+    while node is not None:
+        yield node
+        node = node.parent
+
+
+def turns_back(node: Optional[TurnNode], turns: int) -> Optional[TurnNode]:
+    """The node just before the `turns`-th newest user message on a branch
+
+    Raises:
+        ValueError: If the branch has fewer user messages in memory
+    """
+    if turns <= 0:
+        return node
+    for current in walk(node):
+        if current.message.type == "human":
+            turns -= 1
+            if turns == 0:
+                return current.parent
+    raise ValueError("Not that many turns in this branch")
+
+
+def fork_point(a: Optional[TurnNode], b: Optional[TurnNode]) -> Optional[TurnNode]:
+    """The newest node two branches share"""
+    while a is not None and b is not None and a is not b:
+        if a.depth >= b.depth:
+            a = a.parent
+        else:
+            b = b.parent
+    return a if a is b else None
@@ -1,11 +1,11 @@
 import os
+import re
 import sys
 import subprocess
 import logging
 import time
 import argparse
 from typing import Optional, Dict, List
-from enum import Enum
 
 def _check_environment(check_packages=False):
     """Verify virtual environment and optionally required packages
@@ -29,7 +29,7 @@ def _check_environment(check_packages=False):
         # Only check packages if explicitly requested
         if check_packages:
             required_packages = [
-                'langchain', 'langchain_openai', 'langchain_community',
+                'langchain', 'langchain_openai', 'langchain_anthropic', 'langchain_community',
                 'loguru', 'python-dotenv'
             ]
             missing_packages = []
@@ -46,251 +46,197 @@ def _check_environment(check_packages=False):
     except Exception as e:
         print(f"Environment validation failed: {str(e)}")
         sys.exit(1)
-                
-        if missing_packages:
-            print(f"Missing required packages: {', '.join(missing_packages)}")
-            print("Please re-run setup script: ./scripts/phase1_setup.sh")
-            sys.exit(1)
-            
-    except Exception as e:
-        print(f"Environment validation failed: {str(e)}")
-        sys.exit(1)
 
-# Run environment check before any imports
-_check_environment()
-
-# Now import required packages
+# Provider SDKs are imported lazily by ProviderClientRegistry when first selected
 from dotenv import load_dotenv
 from loguru import logger
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.memory import BaseMemory
-from langchain.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_community.chat_models import (
-    ChatAnthropic,
-    ChatCohere
-)
-from langchain.callbacks.base import BaseCallbackHandler
+from langchain_core.callbacks import BaseCallbackHandler
 import ssl
+from paths import DATA_DIR
+from providers import Provider, ProviderConfig
+from session_store import SQLiteSessionStore
+from response_cache import ResponseCache
+from clients import PoolLimits, ProviderClientRegistry
+from engine import ChatEngine, NoProviderAvailable, TurnStats
+from router import is_rate_limit
+from metrics import MetricsRegistry, start_exporters
+from request_log import DEFAULT_LOG_PATH, DebugCallbackHandler, add_request_sink, exclude_requests
+import asyncio
+import threading
+
+# Command line arguments; replaced by main() so importing this module has no side effects
+args = argparse.Namespace(debug=False, session='default', no_stream=False, command=None)
+
+
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description='AI Chat Assistant')
+    parser.add_argument('--debug', action='store_true', help='Enable comprehensive debug logging')
+    parser.add_argument('--session', default='default', help='Conversation session to start or resume')
+    parser.add_argument('--no-stream', action='store_true', help='Wait for the full reply instead of streaming tokens')
+    subparsers = parser.add_subparsers(dest='command')
+    batch = subparsers.add_parser('batch', help='Run every prompt in a JSONL file without the interactive prompt')
+    batch.add_argument('input', help='JSONL file with one {"input": ...} object per line')
+    batch.add_argument('-o', '--output', help='JSONL results file (default: <input>.results.jsonl)')
+    batch.add_argument('--workers', type=int, default=8, help='Concurrent requests across all providers')
+    # batch.ORDER_INPUT / ORDER_COMPLETION; batch.py is only imported for batch runs
+    batch.add_argument('--order', choices=['input', 'completion'], default='input',
+                       help='Write results in input order or as they complete')
+    batch.add_argument('--provider', choices=[p.value for p in Provider], help='Preferred provider')
+    batch.add_argument('--checkpoint', help='Progress file (default: <output>.checkpoint)')
+    batch.add_argument('--resume', action='store_true', help='Continue an interrupted run from its checkpoint')
+    batch.add_argument('--native', action='store_true',
+                       help="Submit through the provider's asynchronous batch API (OpenAI, Anthropic)")
+    batch.add_argument('--debug', action='store_true', default=argparse.SUPPRESS,
+                       help='Enable comprehensive debug logging')
+    serve = subparsers.add_parser('serve', help='Serve chat over HTTP with Server-Sent Events streaming')
+    serve.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    serve.add_argument('--port', type=int, default=8000, help='Port to listen on')
+    serve.add_argument('--workers', type=int, default=1,
+                       help='Worker processes sharing the port and the session store')
+    serve.add_argument('--provider', choices=[p.value for p in Provider], help='Default provider')
+    serve.add_argument('--drain-timeout', type=float,
+                       help='Seconds in-flight requests get to finish on shutdown (default: SERVER_DRAIN_TIMEOUT)')
+    serve.add_argument('--worker-index', type=int, help=argparse.SUPPRESS)
+    serve.add_argument('--debug', action='store_true', default=argparse.SUPPRESS,
+                       help='Enable comprehensive debug logging')
+    return parser.parse_args(argv)
+
+
+def _configure_logging(args: argparse.Namespace):
+    """Configure console and file logging"""
+    log_level = logging.DEBUG if args.debug else logging.WARNING
+    logging.basicConfig(level=log_level)
+    logger.remove()
+    logger.add(sys.stderr, level="DEBUG" if args.debug else "INFO", filter=exclude_requests)
+    logger.add("logs/chat.log", rotation="1 MB", retention="7 days", filter=exclude_requests, enqueue=True)
+
+    if args.debug:
+        request_log_path = os.getenv("DEBUG_LOG_PATH", DEFAULT_LOG_PATH)
+        add_request_sink(request_log_path)
+        logger.debug(f"Debug mode enabled; request records are written to {request_log_path}")
+
+
+def _load_environment(args: argparse.Namespace):
+    """Load environment variables from the project root .env file"""
+    env_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.env'))
+    if args.debug:
+        logger.debug(f"Loading environment variables from: {env_path}")
+
+    if not os.path.exists(env_path):
+        logger.error(f"Could not find .env file at {env_path}")
+        logger.info("Please create a .env file in the project root directory")
+        logger.info("Refer to design/phase1_environment_setup.md for the required format")
+        sys.exit(1)
 
-class Provider(Enum):
-    OPENAI = "openai"
-    ANTHROPIC = "anthropic"
-    COHERE = "cohere"
-
-class DebugCallbackHandler(BaseCallbackHandler):
-    """Callback handler for comprehensive debug logging
-    
-    This handler provides detailed logging of all LLM interactions when --debug flag is enabled.
-    Logs include provider-specific raw input/output and system details.
-    """
-    def __init__(self, args: argparse.Namespace):
-        """Initialize the debug callback handler
-        
-        Args:
-            args: Command line arguments containing debug flag
-        """
-        self.args = args
-        self.provider = None
-        
-    def set_provider(self, provider: Provider):
-        """Set the current provider for provider-specific logging"""
-        self.provider = provider
-        
-    def on_llm_start(self, serialized, prompts, **kwargs):
-        if self.args.debug:
-            start_time = time.time()
-            logger.debug("LLM Request:")
-            logger.debug(f"Provider: {self.provider.value if self.provider else 'unknown'}")
-            logger.debug(f"Model: {kwargs.get('invocation_params', {}).get('model_name', 'unknown')}")
-            logger.debug(f"Temperature: {kwargs.get('invocation_params', {}).get('temperature', 0.7)}")
-            logger.debug(f"Max Tokens: {kwargs.get('invocation_params', {}).get('max_tokens', 1000)}")
-            
-            # Provider-specific request details
-            if self.provider == Provider.OPENAI:
-                logger.debug("OpenAI Request Details:")
-                logger.debug(f"System Messages: {kwargs.get('messages', [])}")
-                logger.debug(f"Function Calls: {kwargs.get('functions', [])}")
-            elif self.provider == Provider.ANTHROPIC:
-                logger.debug("Anthropic Request Details:")
-                logger.debug(f"System Prompt: {kwargs.get('system', '')}")
-                logger.debug(f"Stop Sequences: {kwargs.get('stop_sequences', [])}")
-            elif self.provider == Provider.COHERE:
-                logger.debug("Cohere Request Details:")
-                logger.debug(f"Conversation ID: {kwargs.get('conversation_id', '')}")
-                logger.debug(f"Generation Parameters: {kwargs.get('generation_params', {})}")
-            
-            logger.debug("Prompts:")
-            for i, prompt in enumerate(prompts):
-                logger.debug(f"Prompt {i + 1}:\n{prompt}")
-            self.start_time = start_time
-
-    def on_llm_end(self, response, **kwargs):
-        if self.args.debug:
-            logger.debug("LLM Response:")
-            logger.debug(f"Provider: {self.provider.value if self.provider else 'unknown'}")
-            
-            # Provider-specific response details
-            if self.provider == Provider.OPENAI:
-                logger.debug("OpenAI Response Details:")
-                logger.debug(f"Completion Tokens: {response.llm_output.get('token_usage', {}).get('completion_tokens', 'unknown')}")
-                logger.debug(f"Function Calls: {response.additional_kwargs.get('function_call', {})}")
-            elif self.provider == Provider.ANTHROPIC:
-                logger.debug("Anthropic Response Details:")
-                logger.debug(f"Completion Reason: {response.additional_kwargs.get('stop_reason', 'unknown')}")
-                logger.debug(f"Stop Sequence: {response.additional_kwargs.get('stop_sequence', 'unknown')}")
-            elif self.provider == Provider.COHERE:
-                logger.debug("Cohere Response Details:")
-                logger.debug(f"Conversation ID: {response.additional_kwargs.get('conversation_id', 'unknown')}")
-                logger.debug(f"Response Tokens: {response.additional_kwargs.get('response_tokens', 'unknown')}")
-            
-            logger.debug(f"Raw Response: {str(response)}")
-            logger.debug(f"Response Time: {time.time() - self.start_time:.2f}s")
-
-    def on_llm_error(self, error, **kwargs):
-        logger.error(f"LLM Error: {str(error)}")
-        if self.args.debug:
-            logger.error("Error Details:")
-            logger.error(f"Provider: {self.provider.value if self.provider else 'unknown'}")
-            logger.error(f"Type: {type(error).__name__}")
-            logger.error(f"Message: {str(error)}")
-            
-            # Provider-specific error details
-            if self.provider == Provider.OPENAI:
-                logger.error("OpenAI Error Details:")
-                logger.error(f"API Version: {kwargs.get('api_version', 'unknown')}")
-                logger.error(f"Request ID: {kwargs.get('request_id', 'unknown')}")
-            elif self.provider == Provider.ANTHROPIC:
-                logger.error("Anthropic Error Details:")
-                logger.error(f"Error Type: {kwargs.get('error_type', 'unknown')}")
-                logger.error(f"Error Code: {kwargs.get('error_code', 'unknown')}")
-            elif self.provider == Provider.COHERE:
-                logger.error("Cohere Error Details:")
-                logger.error(f"Error Code: {kwargs.get('error_code', 'unknown')}")
-                logger.error(f"Error Type: {kwargs.get('error_type', 'unknown')}")
-            
-            if hasattr(error, 'response'):
-                logger.error(f"Response Status: {error.response.status_code}")
-                logger.error(f"Response Text: {error.response.text}")
-
-    def on_chain_end(self, outputs, **kwargs):
-        """Log memory updates after each chain execution"""
-        if self.args.debug:
-            logger.debug("Memory Update:")
-            logger.debug(f"Provider: {self.provider.value if self.provider else 'unknown'}")
-            logger.debug(f"New Memory Content: {outputs.get('response', '')}")
-            logger.debug(f"Current Memory State: {kwargs.get('memory', {}).get('history', '')}")
-            logger.debug("Memory Metadata:")
-            logger.debug(f"Input Tokens: {outputs.get('input_tokens', 'unknown')}")
-            logger.debug(f"Output Tokens: {outputs.get('output_tokens', 'unknown')}")
-            logger.debug(f"Total Tokens: {outputs.get('total_tokens', 'unknown')}")
-
-class Provider(Enum):
-    OPENAI = "openai"
-    ANTHROPIC = "anthropic"
-    COHERE = "cohere"
-
-class ProviderConfig:
-    def __init__(self, api_key: str, model: str, max_tokens: int = 1000):
-        self.api_key = api_key
-        self.model = model
-        self.max_tokens = max_tokens
-
-# Parse command line arguments
-parser = argparse.ArgumentParser(description='AI Chat Assistant')
-parser.add_argument('--debug', action='store_true', help='Enable comprehensive debug logging')
-args = parser.parse_args()
-
-# Configure logging
-log_level = logging.DEBUG if args.debug else logging.WARNING
-logging.basicConfig(level=log_level)
-logger.add("logs/chat.log", rotation="1 MB", retention="7 days")
-
-if args.debug:
-    logger.debug("Debug mode enabled")
-    logger.debug("Debug output includes:")
-    logger.debug("- System configuration")
-    logger.debug("- Environment variables")
-    logger.debug("- Provider initialization")
-    logger.debug("- API key validation details")
-    logger.debug("- Error stack traces")
-    logger.debug("- Performance metrics")
-    logger.debug("- Network request details")
-    logger.debug("- Conversation details")
-    logger.debug("- Memory updates")
-    logger.debug("- Provider-specific request/response details")
-
-# Load environment variables from project root
-env_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.env'))
-if args.debug:
-    logger.debug(f"Loading environment variables from: {env_path}")
-
-if not os.path.exists(env_path):
-    logger.error(f"Could not find .env file at {env_path}")
-    logger.info("Please create a .env file in the project root directory")
-    logger.info("Refer to design/phase1_environment_setup.md for the required format")
-    sys.exit(1)
-
-# Verify .env file is readable
-try:
-    with open(env_path, 'r') as f:
-        if args.debug:
-            logger.debug(f".env file contents:\n{f.read()}")
-except Exception as e:
-    logger.error(f"Failed to read .env file: {str(e)}")
-    sys.exit(1)
-
-# Load environment variables with manual parsing as fallback
-loaded = load_dotenv(env_path, verbose=True)
-if not loaded:
-    logger.warning("dotenv failed to load variables, attempting manual parsing")
-    
-    try:
-        with open(env_path, 'r') as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    try:
-                        key, value = line.split('=', 1)
-                        os.environ[key.strip()] = value.strip()
-                        if args.debug:
-                            logger.debug(f"Manually set {key.strip()}")
-                    except ValueError:
-                        continue
-    except Exception as e:
-        logger.error(f"Failed to manually parse .env file: {str(e)}")
+    # Verify .env file is readable
+    if not os.access(env_path, os.R_OK):
+        logger.error(f"Failed to read .env file: {env_path}")
         sys.exit(1)
 
-if args.debug:
-    logger.debug("Current environment variables:")
-    for k, v in os.environ.items():
-        logger.debug(f"{k}={v}")
+    # Load environment variables with manual parsing as fallback
+    loaded = load_dotenv(env_path, verbose=True)
+    if not loaded:
+        logger.warning("dotenv failed to load variables, attempting manual parsing")
 
-# Validate configured environment variables
-if args.debug:
-    logger.debug("Validating configured environment variables...")
-configured_vars = [var for var in ["OPENAI_API_KEY", "ANTHROPIC_API_KEY", "COHERE_API_KEY"]
-                  if os.getenv(var)]
+        try:
+            with open(env_path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        try:
+                            key, value = line.split('=', 1)
+                            os.environ[key.strip()] = value.strip()
+                            if args.debug:
+                                logger.debug(f"Manually set {key.strip()}")
+                        except ValueError:
+                            continue
+        except Exception as e:
+            logger.error(f"Failed to manually parse .env file: {str(e)}")
+            sys.exit(1)
 
-if not configured_vars:
-    logger.error("No LLM API keys configured")
-    logger.info("Please configure at least one API key in the .env file")
-    logger.info("Refer to design/phase1_environment_setup.md for the required format")
-    sys.exit(1)
 
-if args.debug:
-    logger.debug(f"Configured API keys: {', '.join(configured_vars)}")
+def _mock_enabled() -> bool:
+    """Whether the local mock provider is switched on (MOCK_PROVIDER=on)"""
+    return os.getenv("MOCK_PROVIDER", "off").strip().lower() in ("on", "1", "true", "yes")
+
+
+def _enabled(name: str, default: str) -> bool:
+    """Whether an on/off feature setting is not switched off"""
+    return os.getenv(name, default).strip().lower() not in ("off", "0", "false", "no")
+
+
+def _validate_api_keys(args: argparse.Namespace):
+    """Exit if no provider API key is configured"""
+    if args.debug:
+        logger.debug("Validating configured environment variables...")
+    configured_vars = [var for var in ["OPENAI_API_KEY", "ANTHROPIC_API_KEY", "COHERE_API_KEY"]
+                      if os.getenv(var)]
+    if _mock_enabled():
+        configured_vars.append("MOCK_PROVIDER")
+
+    if not configured_vars:
+        logger.error("No LLM API keys configured")
+        logger.info("Please configure at least one API key in the .env file")
+        logger.info("Refer to design/phase1_environment_setup.md for the required format")
+        sys.exit(1)
+
+    if args.debug:
+        logger.debug(f"Configured API keys: {', '.join(configured_vars)}")
+
+BRANCH_NAME = re.compile(r"^[\w.-]{1,64}$")
+
 
 class ChatApp:
-    def __init__(self):
+    def __init__(self, batch: bool = False, native_batch: bool = False, server: bool = False,
+                 shared_store: bool = False, worker_index: Optional[int] = None):
+        """Build the engine and, for interactive use, open the session
+
+        Args:
+            batch: Serve a batch run instead; batch items use in-memory
+                sessions so they are not written to the session store
+            native_batch: The batch goes through provider batch APIs, whose
+                results are appended to the stored sessions they name
+            server: Serve HTTP clients instead; sessions are opened per request
+            shared_store: Other server workers use the same session store
+            worker_index: Number of this server worker, which picks its own
+                metrics port and export file
+        """
         self.providers = self._initialize_providers()
         self.provider = None
+        # Set by `switch`: turns go to this provider first instead of the best-scoring one
+        self.pinned_provider: Optional[Provider] = None
         self.fallback_order = self._get_fallback_order()
+        self.clients = ProviderClientRegistry(self.providers, PoolLimits.from_env())
+        self.metrics = MetricsRegistry()
+        self.metrics_exporters = start_exporters(self.metrics, worker_index)
+        self.engine = ChatEngine(
+            self.providers,
+            self.fallback_order,
+            clients=self.clients,
+            session_store=None if batch and not native_batch else self._initialize_session_store(),
+            response_cache=ResponseCache.from_env(),
+            callback_factory=self._debug_callbacks,
+            max_concurrency=int(os.getenv("MAX_CONCURRENCY_PER_PROVIDER", "32")),
+            metrics=self.metrics,
+            recall=None if batch or shared_store else self._recall_store(),
+            shared_store=shared_store,
+            transcripts=self._transcript_archive(),
+            tools=self._tool_runtime()
+        )
+        if server and self.engine.recall is not None and self.engine.recall.scope == "all":
+            logger.warning("RECALL_SCOPE=all: every client's past turns can be recalled into other clients' prompts")
+        self.loop = asyncio.new_event_loop()
         self.llm = None
-        from langchain_community.chat_message_histories import ChatMessageHistory
-        self.memory = ChatMessageHistory()
-        self.memory.add_user_message("Hello! I'm your AI assistant.")
+        self.session_id = args.session
+        self.memory = None
+        if not batch and not server:
+            self.memory = self.engine.get_session_history(self.session_id)
+            if not self.memory.messages:
+                self.memory.add_user_message("Hello! I'm your AI assistant.")
         self.conversation = None
+        self.last_turn_stats = None
         self._check_openssl_version()
 
     def _initialize_providers(self) -> Dict[Provider, ProviderConfig]:
@@ -298,81 +244,88 @@ class ChatApp:
         providers = {
             Provider.OPENAI: ProviderConfig(
                 api_key=os.getenv("OPENAI_API_KEY", "").strip(),
-                model=os.getenv("OPENAI_MODEL", "gpt-4o")
+                model=os.getenv("OPENAI_MODEL", "gpt-4o"),
+                base_url=os.getenv("OPENAI_BASE_URL") or None,
+                history_tokens=int(os.getenv("OPENAI_HISTORY_TOKENS", os.getenv("HISTORY_TOKEN_BUDGET", "4000"))),
+                requests_per_minute=float(os.getenv("OPENAI_RPM", "0")) or None,
+                tokens_per_minute=float(os.getenv("OPENAI_TPM", "0")) or None
             ),
             Provider.ANTHROPIC: ProviderConfig(
                 api_key=os.getenv("ANTHROPIC_API_KEY", "").strip(),
-                model=os.getenv("ANTHROPIC_MODEL", "claude-3-opus")
+                model=os.getenv("ANTHROPIC_MODEL", "claude-3-opus"),
+                base_url=os.getenv("ANTHROPIC_BASE_URL") or None,
+                history_tokens=int(os.getenv("ANTHROPIC_HISTORY_TOKENS", os.getenv("HISTORY_TOKEN_BUDGET", "4000"))),
+                requests_per_minute=float(os.getenv("ANTHROPIC_RPM", "0")) or None,
+                tokens_per_minute=float(os.getenv("ANTHROPIC_TPM", "0")) or None
             ),
             Provider.COHERE: ProviderConfig(
                 api_key=os.getenv("COHERE_API_KEY", "").strip(),
-                model=os.getenv("COHERE_MODEL", "command-r-plus")
+                model=os.getenv("COHERE_MODEL", "command-r-plus"),
+                history_tokens=int(os.getenv("COHERE_HISTORY_TOKENS", os.getenv("HISTORY_TOKEN_BUDGET", "4000"))),
+                requests_per_minute=float(os.getenv("COHERE_RPM", "0")) or None,
+                tokens_per_minute=float(os.getenv("COHERE_TPM", "0")) or None
+            ),
+            Provider.MOCK: ProviderConfig(
+                api_key="mock" if _mock_enabled() else "",
+                model=os.getenv("MOCK_MODEL", "mock-model"),
+                history_tokens=int(os.getenv("MOCK_HISTORY_TOKENS", os.getenv("HISTORY_TOKEN_BUDGET", "4000")))
             ),
         }
         return providers
 
+    # Optional features import their modules only when they are switched on
+
+    @staticmethod
+    def _recall_store():
+        if not _enabled("RECALL", "on"):
+            return None
+        from recall import RecallStore
+        return RecallStore.from_env()
+
+    @staticmethod
+    def _transcript_archive():
+        if not _enabled("TRANSCRIPTS", "on"):
+            return None
+        from transcripts import TranscriptArchive
+        return TranscriptArchive.from_env()
+
+    def _tool_runtime(self):
+        if not _enabled("TOOLS", "off"):
+            return None
+        from tools import ToolRuntime
+        return ToolRuntime.from_env(self.metrics)
+
+    def _initialize_session_store(self) -> Optional[SQLiteSessionStore]:
+        """Open the configured session backend (SESSION_STORE=sqlite|memory)"""
+        backend = os.getenv("SESSION_STORE", "sqlite").strip().lower()
+        if backend == "memory":
+            return None
+        if backend != "sqlite":
+            logger.warning(f"Unknown SESSION_STORE '{backend}', using sqlite")
+        db_path = os.getenv("SESSION_DB_PATH", os.path.join(DATA_DIR, "sessions.db"))
+        return SQLiteSessionStore(db_path)
+
     def _get_fallback_order(self) -> List[Provider]:
         """Get the fallback order from environment variables"""
         fallback = os.getenv("FALLBACK_ORDER", "openai,anthropic,cohere")
         return [Provider(p.strip()) for p in fallback.split(",")]
 
     def _initialize_llm(self):
-        """Initialize the language model with fallback support"""
-        for provider in [self.provider] + self.fallback_order:
-            config = self.providers[provider]
-            
-            if not config.api_key or config.api_key.startswith("your-"):
-                continue
-                
-            try:
-                if provider == Provider.OPENAI:
-                    llm = ChatOpenAI(
-                        openai_api_key=config.api_key,
-                        model_name=config.model,
-                        temperature=0.7,
-                        max_tokens=config.max_tokens,
-                        streaming=True
-                    )
-                    # Test connection
-                    llm.invoke("Test connection")
-                    return llm
-                    
-                elif provider == Provider.ANTHROPIC:
-                    llm = ChatAnthropic(
-                        anthropic_api_key=config.api_key,
-                        model=config.model,
-                        temperature=0.7,
-                        max_tokens_to_sample=config.max_tokens
-                    )
-                    # Test connection
-                    llm.invoke("Test connection")
-                    return llm
-                    
-                elif provider == Provider.COHERE:
-                    llm = ChatCohere(
-                        cohere_api_key=config.api_key,
-                        model=config.model,
-                        temperature=0.7,
-                        max_tokens=config.max_tokens
-                    )
-                    # Test connection
-                    llm.invoke("Test connection")
-                    return llm
-                    
-            except Exception as e:
-                error_msg = f"Failed to initialize {provider.value}: {str(e)}"
-                if "401" in str(e):
-                    error_msg += "\nInvalid API key - please verify your credentials"
-                elif "404" in str(e):
-                    error_msg += "\nModel not found - please verify model name"
-                elif "429" in str(e):
-                    error_msg += "\nRate limit exceeded - please try again later"
-                if args.debug:
-                    logger.warning(error_msg)
-                continue
-                
-        logger.error("No working LLM provider found")
-        sys.exit(1)
+        """Initialize the language model with fallback support
+
+        Providers are chosen from the engine's cached health table; any
+        provider without a fresh entry is probed concurrently with the others.
+        """
+        try:
+            provider = self.loop.run_until_complete(self.engine.activate(self.provider))
+        except NoProviderAvailable as e:
+            logger.error(str(e))
+            sys.exit(1)
+
+        if provider != self.provider:
+            print(f"{self.provider.value.capitalize()} unavailable, falling back to {provider.value.capitalize()}")
+            self.provider = provider
+        return self.engine.get_llm(provider)
 
     def _check_openssl_version(self):
         """Check SSL library version for informational purposes"""
@@ -401,34 +354,15 @@ class ChatApp:
                 logger.info("LibreSSL detected - works for most use cases")
                 logger.info("Advanced cryptographic features may require OpenSSL")
 
+    def _debug_callbacks(self, provider: Provider) -> Optional[List[BaseCallbackHandler]]:
+        """Build the debug callbacks attached to a provider's model"""
+        if not args.debug:
+            return None
+        return [DebugCallbackHandler.from_env(provider)]
+
     def _initialize_conversation(self) -> RunnableWithMessageHistory:
         """Initialize the conversation chain with message history"""
-        prompt_template = PromptTemplate(
-            input_variables=["history", "input"],
-            template="""
-            You are a helpful AI assistant. Continue the conversation in a helpful and professional manner.
-
-            Previous conversation:
-            {history}
-
-            Current input:
-            {input}
-            """
-        )
-        
-        debug_handler = DebugCallbackHandler(args)
-        debug_handler.set_provider(self.provider)
-        
-        chain = prompt_template | self.llm
-        
-        return RunnableWithMessageHistory(
-            runnable=chain,
-            get_session_history=lambda session_id: self.memory,
-            input_messages_key="input",
-            history_messages_key="history",
-            callbacks=[debug_handler] if args.debug else None,
-            metadata={"memory": self.memory}
-        )
+        return self.engine.chain
 
     def get_available_providers(self) -> List[Provider]:
         """Get list of providers with valid API keys"""
@@ -437,7 +371,11 @@ class ChatApp:
             config = self.providers[provider]
             if args.debug:
                 logger.debug(f"Checking provider: {provider.value}")
-                logger.debug(f"API key: {config.api_key}")
+
+            if provider == Provider.MOCK:
+                if config.api_key:
+                    providers.append(provider)
+                continue
             
             # Check if API key exists and is valid
             if not config.api_key or len(config.api_key.strip()) < 30:
@@ -505,6 +443,82 @@ class ChatApp:
             except ValueError:
                 print("Please enter a number")
 
+    def _read_input(self, prompt: str) -> str:
+        """Read a line while the event loop keeps running background work
+
+        Summaries of trimmed history are computed while the user types. The
+        reader is a daemon thread so an interrupted prompt never blocks exit.
+        """
+        future = self.loop.create_future()
+
+        def read():
+            try:
+                result = input(prompt)
+            except BaseException as e:
+                self.loop.call_soon_threadsafe(future.set_exception, e)
+            else:
+                self.loop.call_soon_threadsafe(future.set_result, result)
+
+        threading.Thread(target=read, name="input", daemon=True).start()
+        return self.loop.run_until_complete(future)
+
+    def _branch_command(self, user_input: str) -> bool:
+        """Handle fork/branches/checkout; returns False if the input is not one of them"""
+        words = user_input.split()
+        command = words[0].lower() if words else ""
+        if command == "branches" and len(words) == 1:
+            for branch in self.memory.branch_info():
+                shared = f", shares {branch['shared']} with this one" if branch["shared"] is not None else ""
+                print(f"{'*' if branch['current'] else ' '} {branch['name']}: {branch['messages']} messages, "
+                      f"{branch['tokens']} tokens{shared}")
+            return True
+        if command == "fork" and len(words) in (2, 3) and BRANCH_NAME.match(words[1]) \
+                and (len(words) == 2 or words[2].isdigit()):
+            try:
+                self.memory.fork(words[1], int(words[2]) if len(words) == 3 else 0)
+            except ValueError as e:
+                print(str(e))
+                return True
+            print(f"Forked branch '{words[1]}' ({len(self.memory.messages)} messages in the window)")
+            return True
+        if command == "checkout" and len(words) == 2 and BRANCH_NAME.match(words[1]):
+            try:
+                self.memory.checkout(words[1])
+            except ValueError as e:
+                print(str(e))
+                return True
+            print(f"Switched to branch '{words[1]}'")
+            return True
+        return False
+
+    async def _stream_response(self, user_input: str) -> TurnStats:
+        """Stream the assistant reply to stdout as tokens arrive
+
+        The engine writes the assembled reply into the session history once
+        the stream completes.
+
+        Args:
+            user_input: The user's message for this turn
+
+        Returns:
+            TurnStats with time-to-first-token and tokens/sec for the turn
+        """
+        print("\nAssistant: ", end="", flush=True)
+        async for text in self.engine.astream(self.session_id, user_input, self.pinned_provider):
+            print(text, end="", flush=True)
+        print()
+
+        stats = self.engine.turn_stats[self.session_id]
+        if args.debug:
+            ttft = f"{stats.time_to_first_token:.2f}s" if stats.time_to_first_token is not None else "n/a"
+            logger.debug(f"Time to first token: {ttft}")
+            logger.debug(f"Streamed {stats.tokens} tokens in {stats.total_time:.2f}s "
+                         f"({stats.tokens_per_second:.1f} tokens/sec)")
+            if stats.prompt_tokens is not None:
+                logger.debug(f"Prompt: {stats.prompt_tokens} tokens, {stats.cached_tokens or 0} read from "
+                             f"the provider cache, {stats.cache_write_tokens or 0} written")
+        return stats
+
     def run(self):
         """Main chat loop"""
         try:
@@ -513,10 +527,11 @@ class ChatApp:
             self.llm = self._initialize_llm()
             self.conversation = self._initialize_conversation()
             print("Type 'exit' to quit or 'switch' to change provider")
+            print("Branch the conversation with 'fork NAME [TURNS_BACK]', 'branches' and 'checkout NAME'")
             
             while True:
                 try:
-                    user_input = input("\nYou: ")
+                    user_input = self._read_input("\nYou: ")
                     
                     if user_input.lower() in ["exit", "quit"]:
                         print("Goodbye!")
@@ -530,14 +545,36 @@ class ChatApp:
                         self.provider = self._select_provider()
                         self.llm = self._initialize_llm()
                         self.conversation = self._initialize_conversation()
+                        self.pinned_provider = self.provider
                         print(f"Switched to {self.provider.value.capitalize()} provider")
                         continue
+                    elif self._branch_command(user_input):
+                        continue
                         
-                    response = self.conversation.invoke(
-                        {"input": user_input},
-                        config={"configurable": {"session_id": "default"}}
-                    )
-                    print(f"\nAssistant: {response.content}")
+                    if args.no_stream:
+                        response = self.loop.run_until_complete(
+                            self.engine.ainvoke(self.session_id, user_input, self.pinned_provider)
+                        )
+                        print(f"\nAssistant: {response}")
+                    else:
+                        self.last_turn_stats = self.loop.run_until_complete(self._stream_response(user_input))
+                    if args.debug:
+                        logger.debug(f"History window: {self.memory.total_tokens} tokens, "
+                                     f"{self.memory.tokens_saved_last_turn} tokens saved by trimming")
+                        if self.memory.summary is not None:
+                            logger.debug(f"Summary: {len(self.memory.summary.text)} chars covering "
+                                         f"{self.memory.summary.covered} messages, "
+                                         f"{len(self.memory.summary.pending)} pending")
+                        logger.debug(f"Rate limiter: {self.engine.rate_limit_metrics()}")
+                        if self.engine.response_cache is not None:
+                            logger.debug(f"Response cache: {self.engine.response_cache.stats()}")
+                        if self.engine.single_flight is not None:
+                            logger.debug(f"Single-flight: {self.engine.single_flight.stats()}")
+                        if self.engine.transcripts is not None:
+                            logger.debug(f"Transcript archive: {self.engine.transcripts.stats()}")
+                        if self.engine.tools is not None:
+                            logger.debug(f"Tools: {self.engine.tools.stats()}")
+                        logger.debug(f"Request metrics: {self.metrics.summary()}")
                     
                 except KeyboardInterrupt:
                     print("\nGoodbye!")
@@ -545,33 +582,141 @@ class ChatApp:
                 except Exception as e:
                     if args.debug:
                         logger.error(f"Error during conversation: {str(e)}")
-                    print("An error occurred. Please try again.")
+                        logger.debug(f"Rate limiter: {self.engine.rate_limit_metrics()}")
+                    if is_rate_limit(e):
+                        print("\nRate limit exceeded after retries - please try again later.")
+                    else:
+                        print("An error occurred. Please try again.")
                     
         finally:
             # Cleanup resources
-            if hasattr(self, 'llm') and self.llm:
-                if hasattr(self.llm, 'close'):
-                    self.llm.close()
-                del self.llm
-                
             if hasattr(self, 'memory') and self.memory:
-                self.memory.clear()
+                if self.engine.session_store is None:
+                    self.memory.clear()
                 del self.memory
-                
+
+            if hasattr(self, 'llm') and self.llm:
+                del self.llm
+
             if hasattr(self, 'conversation') and self.conversation:
                 del self.conversation
-        
 
+            self._shutdown()
+
+    def run_batch(self, options: argparse.Namespace):
+        """Process a JSONL file of prompts and print the throughput report
+
+        Args:
+            options: Parsed `batch` subcommand arguments
+        """
+        output_path = options.output or f"{os.path.splitext(options.input)[0]}.results.jsonl"
+        if options.native:
+            self._run_native_batch(options, output_path)
+            return
+        try:
+            self.provider = Provider(options.provider) if options.provider else None
+            try:
+                self.loop.run_until_complete(self.engine.activate(self.provider))
+            except NoProviderAvailable as e:
+                logger.error(str(e))
+                sys.exit(1)
+            from batch import BatchRunner
+            runner = BatchRunner(self.engine, workers=options.workers, order=options.order,
+                                 provider=self.provider)
+            task = self.loop.create_task(runner.run(options.input, output_path, options.checkpoint, options.resume))
+            try:
+                report = self.loop.run_until_complete(task)
+            except KeyboardInterrupt:
+                # Let the runner save its checkpoint before exiting
+                task.cancel()
+                self.loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+                print("\nBatch interrupted; rerun with --resume to continue")
+                return
+            print(f"Processed {report['completed'] + report['failed']} prompts "
+                  f"({report['failed']} failed, {report['skipped']} already done) in {report['elapsed']}s: "
+                  f"{report['requests_per_second']} requests/sec, {report['tokens_per_second']} tokens/sec")
+            print(f"Results written to {output_path}")
+        finally:
+            self._shutdown()
+
+    def _run_native_batch(self, options: argparse.Namespace, output_path: str):
+        """Submit the batch through provider batch APIs and write the results"""
+        from batch import NativeBatchRunner
+        from provider_batch import BACKENDS
+        try:
+            if options.provider:
+                provider = Provider(options.provider)
+            else:
+                supported = [p for p in self.fallback_order if p in BACKENDS and self.engine.is_configured(p)]
+                if not supported:
+                    logger.error("No configured provider offers a batch API")
+                    sys.exit(1)
+                provider = supported[0]
+            if provider not in BACKENDS:
+                logger.error(f"{provider.value} has no native batch API")
+                sys.exit(1)
+            runner = NativeBatchRunner(self.engine, provider)
+            task = self.loop.create_task(runner.run(options.input, output_path, options.checkpoint, options.resume))
+            try:
+                report = self.loop.run_until_complete(task)
+            except KeyboardInterrupt:
+                task.cancel()
+                self.loop.run_until_complete(asyncio.gather(task, return_exceptions=True))
+                print("\nStopped waiting; submitted batches keep running. Rerun with --resume to collect them")
+                return
+            print(f"Collected {report['completed'] + report['failed']} results "
+                  f"({report['failed']} failed) from {provider.value} batches in {report['elapsed']}s")
+            print(f"Results written to {output_path}")
+        finally:
+            self._shutdown()
+
+    def serve(self, options: argparse.Namespace):
+        """Serve chat over HTTP until SIGINT/SIGTERM
 
-def main():
+        Args:
+            options: Parsed `serve` subcommand arguments
+        """
+        from server import run_server
+        try:
+            run_server(self, options)
+        finally:
+            self._shutdown()
+
+    def _shutdown(self):
+        """Close the engine, the event loop and the metrics exporters"""
+        self.loop.run_until_complete(self.engine.aclose())
+        self.loop.close()
+        for exporter in self.metrics_exporters:
+            exporter.close()
+
+
+def main(argv: Optional[List[str]] = None):
+    global args
+    args = _parse_args(argv)
     try:
         _check_environment()
-        app = ChatApp()
-        app.run()
+        _configure_logging(args)
+        _load_environment(args)
+        _validate_api_keys(args)
+        if args.command == 'batch':
+            ChatApp(batch=True, native_batch=args.native).run_batch(args)
+        elif args.command == 'serve':
+            if args.workers > 1 and args.worker_index is None:
+                from server import supervise
+                supervise(list(sys.argv[1:] if argv is None else argv), args.workers)
+            else:
+                ChatApp(server=True, shared_store=args.worker_index is not None,
+                        worker_index=args.worker_index).serve(args)
+        else:
+            app = ChatApp()
+            app.run()
     except Exception as e:
         if args.debug:
             logger.error(f"Application error: {str(e)}")
         sys.exit(1)
+    finally:
+        # Flush records still queued for the background log writers
+        logger.complete()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,214 @@
+"""Provider client registry with shared, pooled HTTP transports
+
+Each provider's chat model is built once and reused, so switching providers
+is a dictionary lookup and keep-alive connections (and their TLS sessions)
+survive across switches and fallbacks. Every provider SDK runs on the
+registry's pooled httpx clients, which negotiate HTTP/2 when the `h2`
+package is installed, with the SDK's own retries off: retries are scheduled
+by the engine. Anthropic SDKs built on `httpx2` reject httpx clients, so
+they get a pool of their own with the same limits. Cohere SDKs before 6
+have no client-wide retry setting and still retry 429 and 5xx responses
+twice themselves.
+
+Provider SDKs are imported only when a provider's client is first built, so
+startup does not pay for SDKs that are never selected.
+"""
+import importlib.util
+import inspect
+import os
+from typing import Dict, Optional, Tuple
+
+import httpx
+from loguru import logger
+
+from providers import Provider, ProviderConfig
+
+
+class PoolLimits:
+    """Connection pool settings shared by every provider client
+
+    Args:
+        max_connections: Maximum open connections across all hosts
+        max_keepalive: Maximum idle connections kept for reuse
+        keepalive_expiry: Seconds an idle connection is kept
+        http2: Negotiate HTTP/2 when the `h2` package is available
+        timeout: Request timeout in seconds
+    """
+    def __init__(self, max_connections: int = 100, max_keepalive: int = 20,
+                 keepalive_expiry: float = 30.0, http2: bool = True, timeout: float = 60.0):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.http2 = http2
+        self.timeout = timeout
+
+    @classmethod
+    def from_env(cls) -> "PoolLimits":
+        return cls(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive=int(os.getenv("HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+            http2=os.getenv("HTTP2", "on").strip().lower() not in ("off", "0", "false", "no"),
+            timeout=float(os.getenv("HTTP_TIMEOUT", "60"))
+        )
+
+    def httpx_kwargs(self, package=httpx) -> dict:
+        """Client arguments for `package`: httpx, or an httpx-compatible fork an SDK uses"""
+        http2 = self.http2 and importlib.util.find_spec("h2") is not None
+        return {
+            "limits": package.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry
+            ),
+            "http2": http2,
+            "timeout": self.timeout,
+        }
+
+
+class ProviderClientRegistry:
+    """Builds each provider's chat model once on shared connection pools
+
+    Args:
+        providers: Provider configurations keyed by provider
+        limits: Pool settings for the shared transports
+        temperature: Sampling temperature for every client
+    """
+    def __init__(self, providers: Dict[Provider, ProviderConfig],
+                 limits: Optional[PoolLimits] = None, temperature: float = 0.7):
+        self.providers = providers
+        self.limits = limits or PoolLimits()
+        self.temperature = temperature
+        self.clients: Dict[object, object] = {}
+        self._http_client: Optional[httpx.Client] = None
+        self._async_http_client: Optional[httpx.AsyncClient] = None
+        # (sync, async) pools of the Anthropic SDK's client classes when it does not use httpx
+        self._anthropic_http_clients: Optional[Tuple[object, object]] = None
+
+    @property
+    def http_client(self) -> httpx.Client:
+        """Shared synchronous connection pool"""
+        if self._http_client is None:
+            self._http_client = httpx.Client(**self.limits.httpx_kwargs())
+        return self._http_client
+
+    @property
+    def async_http_client(self) -> httpx.AsyncClient:
+        """Shared asynchronous connection pool"""
+        if self._async_http_client is None:
+            self._async_http_client = httpx.AsyncClient(**self.limits.httpx_kwargs())
+        return self._async_http_client
+
+    def anthropic_http_clients(self, anthropic) -> Tuple[object, object]:
+        """Shared (sync, async) pools for the Anthropic SDK module `anthropic`"""
+        package = anthropic.DefaultHttpxClient.__mro__[1].__module__.partition(".")[0]
+        if package == "httpx":
+            return self.http_client, self.async_http_client
+        if self._anthropic_http_clients is None:
+            kwargs = self.limits.httpx_kwargs(importlib.import_module(package))
+            self._anthropic_http_clients = (anthropic.DefaultHttpxClient(**kwargs),
+                                            anthropic.DefaultAsyncHttpxClient(**kwargs))
+        return self._anthropic_http_clients
+
+    def get(self, provider: Provider, model: Optional[str] = None):
+        """Return the chat model for a provider, building it on first use
+
+        Args:
+            provider: Provider to build the client for
+            model: Model to use instead of the configured one; each variant
+                is built once and shares the provider's connection pool
+        """
+        key = provider if model is None else (provider, model)
+        client = self.clients.get(key)
+        if client is None:
+            client = self.clients[key] = self._build(provider, model)
+            logger.debug(f"Built {provider.value} client" + (f" for {model}" if model else ""))
+        return client
+
+    def _build(self, provider: Provider, model: Optional[str] = None):
+        """Construct the chat model client for a provider"""
+        config = self.providers[provider]
+        if model:
+            config = ProviderConfig(config.api_key, model, config.max_tokens, config.history_tokens,
+                                    config.base_url)
+        if provider == Provider.OPENAI:
+            from langchain_openai import ChatOpenAI
+            kwargs = {"base_url": config.base_url} if config.base_url else {}
+            return ChatOpenAI(
+                openai_api_key=config.api_key,
+                model_name=config.model,
+                temperature=self.temperature,
+                max_tokens=config.max_tokens,
+                streaming=True,
+                # Ask for a final usage chunk so streamed requests report token counts
+                stream_usage=True,
+                # Retries are scheduled by the engine so they respect the rate limiter
+                max_retries=0,
+                http_client=self.http_client,
+                http_async_client=self.async_http_client,
+                **kwargs
+            )
+        elif provider == Provider.ANTHROPIC:
+            # Messages API client: takes content blocks, so cache_control
+            # breakpoints reach the API and cache usage comes back
+            import anthropic
+            from langchain_anthropic import ChatAnthropic
+            kwargs = {"anthropic_api_url": config.base_url} if config.base_url else {}
+            model = ChatAnthropic(
+                anthropic_api_key=config.api_key,
+                model=config.model,
+                temperature=self.temperature,
+                max_tokens=config.max_tokens,
+                streaming=True,
+                max_retries=0,
+                default_request_timeout=self.limits.timeout,
+                **kwargs
+            )
+            # ChatAnthropic builds a private transport per model on first use;
+            # fill its SDK clients in first, on the shared pools
+            http_client, async_http_client = self.anthropic_http_clients(anthropic)
+            params = model._client_params
+            model.__dict__["_client"] = anthropic.Client(**params, http_client=http_client)
+            model.__dict__["_async_client"] = anthropic.AsyncClient(**params, http_client=async_http_client)
+            return model
+        elif provider == Provider.COHERE:
+            import cohere
+            from langchain_community.chat_models import ChatCohere
+            model = ChatCohere(
+                cohere_api_key=config.api_key,
+                model=config.model,
+                temperature=self.temperature,
+                max_tokens=config.max_tokens
+            )
+            # Replace the SDK clients ChatCohere built with ones on the shared pools
+            sdk_kwargs = {"api_key": config.api_key, "client_name": model.user_agent, "timeout": self.limits.timeout}
+            if "max_retries" in inspect.signature(cohere.Client).parameters:
+                # Older SDKs only take retries per request, so they keep their own
+                sdk_kwargs["max_retries"] = 0
+            model.client = cohere.Client(**sdk_kwargs, httpx_client=self.http_client)
+            model.async_client = cohere.AsyncClient(**sdk_kwargs, httpx_client=self.async_http_client)
+            return model
+        elif provider == Provider.MOCK:
+            from mock_provider import MockChatModel, MockProfile
+            return MockChatModel(model=config.model, profile=MockProfile.from_env(),
+                                 temperature=self.temperature)
+        raise ValueError(f"Unsupported provider: {provider.value}")
+
+    async def aclose(self):
+        """Close the shared pools from inside the event loop that used them"""
+        if self._async_http_client is not None:
+            await self._async_http_client.aclose()
+            self._async_http_client = None
+        if self._anthropic_http_clients is not None:
+            await self._anthropic_http_clients[1].aclose()
+        self.close()
+
+    def close(self):
+        """Close the synchronous pool and forget built clients"""
+        if self._http_client is not None:
+            self._http_client.close()
+            self._http_client = None
+        if self._anthropic_http_clients is not None:
+            self._anthropic_http_clients[0].close()
+            self._anthropic_http_clients = None
+        self.clients.clear()
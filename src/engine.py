@@ -0,0 +1,727 @@
+"""Asyncio chat engine shared by all frontends
+
+The engine owns the provider clients, the conversation chain and the
+per-session histories. Any number of sessions can be served concurrently from
+one event loop:
+
+    - turns within a session run strictly in order (one lock per session)
+    - calls to each provider are bounded by a per-provider semaphore
+    - the provider for each request is picked by the AdaptiveRouter below the
+      history layer, so failover and hedged duplicates never touch history
+    - messages trimmed from a session's window are folded into its rolling
+      summary by a background task after the turn (see summary.py)
+    - each turn is looked up in, then added to, the long-term recall index
+      (see recall.py) off the event loop
+    - with tools enabled, the tool calls in a reply run concurrently (see
+      tools.py) and the model is called again with their results, inside the
+      routed model, so history keeps only the user's message and the answer
+
+`ChatApp.run` is one thin frontend over this engine; servers and batch jobs
+can drive it directly through `astream` / `ainvoke`.
+"""
+import asyncio
+import contextlib
+import os
+import time
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, Iterator, List, Optional, Set
+
+from langchain_core.messages import AIMessageChunk
+from langchain_core.prompt_values import ChatPromptValue
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableGenerator, RunnableLambda
+from langchain_core.runnables.history import RunnableWithMessageHistory
+from loguru import logger
+
+from clients import ProviderClientRegistry
+from health import ProviderHealthChecker
+from history import TokenBudgetHistory, trim_ratio_from_env
+from metrics import MetricsCallbackHandler, MetricsRegistry, cache_usage, load_price_table, outcome_of
+from providers import Provider, ProviderConfig
+from response_cache import ResponseCache
+from rate_limit import RetryScheduler, build_rate_limiters
+from router import AdaptiveRouter, NoProviderAvailable, is_rate_limit
+from session_store import PersistentHistory, SQLiteSessionStore
+from single_flight import SingleFlight
+from summary import RollingSummary, Summarizer
+from tokens import count_tokens, prompt_text
+
+if TYPE_CHECKING:
+    # Optional features; their modules are imported by whoever builds them
+    from recall import RecallStore
+    from tools import ToolRuntime
+    from transcripts import TranscriptArchive
+
+DEFAULT_MAX_CONCURRENCY = 32
+
+# Kept byte-identical across turns and sessions: it is the start of every
+# prompt, so providers' prefix caches can serve it
+SYSTEM_PROMPT = "You are a helpful AI assistant. Continue the conversation in a helpful and professional manner."
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def _with_cache_control(message):
+    content = message.content
+    blocks = [{"type": "text", "text": content}] if isinstance(content, str) else [dict(b) for b in content]
+    if not blocks:
+        return message
+    blocks[-1] = {**blocks[-1], "cache_control": CACHE_CONTROL}
+    return message.model_copy(update={"content": blocks})
+
+
+def add_cache_breakpoints(prompt):
+    """Mark Anthropic prompt-cache breakpoints on a chat prompt
+
+    One breakpoint after the system message and one on the last history
+    message, the one before the new message: the next turn's prompt repeats
+    that prefix unchanged, so everything up to the previous turn is read from
+    the cache. The new message itself is not marked, since it carries
+    recalled excerpts that the next turn will not repeat.
+
+    Content becomes a list of text blocks, which only the Messages API
+    client (`langchain_anthropic.ChatAnthropic`) accepts.
+    """
+    messages = prompt.to_messages() if hasattr(prompt, "to_messages") else list(prompt)
+    if not messages:
+        return prompt
+    marked = list(messages)
+    if marked[0].type == "system":
+        marked[0] = _with_cache_control(marked[0])
+    if len(marked) > 2:
+        # The last history message; marked[-1] is the new input
+        marked[-2] = _with_cache_control(marked[-2])
+    return ChatPromptValue(messages=marked)
+
+
+class TurnStats:
+    """Timing, throughput and prompt-cache figures for a single streamed turn
+
+    `prompt_tokens`, `cached_tokens` (read from the provider's prompt cache)
+    and `cache_write_tokens` are as reported by the provider, or None when it
+    reported no usage (e.g. a response cache hit).
+    """
+    def __init__(self, time_to_first_token: Optional[float], total_time: float, tokens: int,
+                 provider: Optional[Provider] = None, prompt_tokens: Optional[int] = None,
+                 cached_tokens: Optional[int] = None, cache_write_tokens: Optional[int] = None):
+        self.provider = provider
+        self.time_to_first_token = time_to_first_token
+        self.total_time = total_time
+        self.tokens = tokens
+        self.prompt_tokens = prompt_tokens
+        self.cached_tokens = cached_tokens
+        self.cache_write_tokens = cache_write_tokens
+
+    @property
+    def tokens_per_second(self) -> float:
+        """Generation rate measured from the first token to the last"""
+        generation_time = self.total_time - (self.time_to_first_token or 0.0)
+        if generation_time <= 0:
+            return 0.0
+        return self.tokens / generation_time
+
+    @property
+    def cached_ratio(self) -> Optional[float]:
+        """Fraction of the prompt served from the provider's prompt cache"""
+        if not self.prompt_tokens or self.cached_tokens is None:
+            return None
+        return self.cached_tokens / self.prompt_tokens
+
+
+def chunk_text(chunk) -> str:
+    """Extract the text from a streamed message chunk
+
+    Anthropic chunks may carry a list of content blocks instead of a string.
+    """
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(
+            block.get("text", "") if isinstance(block, dict) else str(block)
+            for block in content
+        )
+    return str(content)
+
+
+class ChatEngine:
+    """Multi-session async chat core
+
+    Args:
+        providers: Provider configurations keyed by provider
+        fallback_order: Providers to try, in order, when the preferred one is down
+        clients: Registry building (once) and pooling each provider's chat model
+        session_store: Persistent store for histories, or None to keep them in memory
+        response_cache: Optional response cache placed in front of each model
+        callback_factory: Optional function returning model callbacks for a provider
+        max_concurrency: Maximum in-flight requests per provider
+        router: Provider router, defaulting to one configured from ROUTING_* settings
+        metrics: Registry recording per-request latency, token and cost metrics
+        recall: Long-term recall index over past turns, or None to disable recall
+        shared_store: Other processes write to the same session store, so
+            histories are re-read when they changed before each turn
+        transcripts: Archive receiving a row per finished turn, or None
+        tools: Runtime executing the tools offered to the model, or None
+            for plain chat
+    """
+    def __init__(self, providers: Dict[Provider, ProviderConfig], fallback_order: List[Provider],
+                 clients: ProviderClientRegistry,
+                 session_store: Optional[SQLiteSessionStore] = None,
+                 response_cache: Optional[ResponseCache] = None,
+                 callback_factory: Optional[Callable[[Provider], Optional[list]]] = None,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 router: Optional[AdaptiveRouter] = None,
+                 metrics: Optional[MetricsRegistry] = None,
+                 recall: Optional["RecallStore"] = None,
+                 shared_store: bool = False,
+                 transcripts: Optional["TranscriptArchive"] = None,
+                 tools: Optional["ToolRuntime"] = None):
+        self.providers = providers
+        self.fallback_order = fallback_order
+        self.clients = clients
+        self.session_store = session_store
+        self.response_cache = response_cache
+        self.callback_factory = callback_factory
+        self.max_concurrency = max_concurrency
+        self.metrics = metrics
+        self.prices = load_price_table() if metrics is not None else {}
+        self.prompt_cache = os.getenv("PROMPT_CACHE", "on").strip().lower() in ("on", "1", "true", "yes")
+        self.trim_ratio = trim_ratio_from_env()
+        self.summarizer = Summarizer.from_env(self.complete)
+        self.recall = recall
+        self.recall_k = int(os.getenv("RECALL_TOP_K", "3"))
+        self.shared_store = shared_store
+        self.transcripts = transcripts
+        self.tools = tools
+        self.single_flight = SingleFlight.from_env(metrics)
+        self._background: Set[asyncio.Task] = set()
+        self.health_checker = ProviderHealthChecker(
+            providers,
+            ttl=float(os.getenv("HEALTH_CHECK_TTL", "60")),
+            timeout=float(os.getenv("HEALTH_CHECK_TIMEOUT", "3")),
+            client=clients.async_http_client
+        )
+        self.router = router or AdaptiveRouter(
+            fallback_order,
+            adaptive=os.getenv("ROUTING", "adaptive").strip().lower() == "adaptive",
+            hedge=os.getenv("HEDGE_REQUESTS", "off").strip().lower() in ("on", "1", "true", "yes"),
+            failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+            reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+        )
+        self.default_provider: Optional[Provider] = None
+        self.models: Dict[Provider, Runnable] = {}
+        self._chain: Optional[RunnableWithMessageHistory] = None
+        self.sessions: Dict[str, TokenBudgetHistory] = {}
+        self.turn_stats: Dict[str, TurnStats] = {}
+        self._session_locks: Dict[str, asyncio.Lock] = {}
+        # Turns running or waiting per session; a lock is only dropped at zero
+        self._session_turns: Dict[str, int] = {}
+        self._semaphores: Dict[Provider, asyncio.Semaphore] = {}
+        self.rate_limiters = build_rate_limiters(providers)
+        self.retry = RetryScheduler(
+            max_retries=int(os.getenv("RETRY_MAX_ATTEMPTS", "3")),
+            base_delay=float(os.getenv("RETRY_BASE_DELAY", "1")),
+            max_delay=float(os.getenv("RETRY_MAX_DELAY", "30"))
+        )
+
+    def is_configured(self, provider: Provider) -> bool:
+        """Whether a provider has an API key that is not a placeholder"""
+        config = self.providers.get(provider)
+        return bool(config and config.api_key and not config.api_key.startswith("your-"))
+
+    async def select_provider(self, preferred: Optional[Provider] = None) -> Provider:
+        """Pick a healthy provider, preferring `preferred` then the fallback order
+
+        Raises:
+            NoProviderAvailable: If no configured provider is healthy
+        """
+        order = []
+        for provider in [preferred] + self.fallback_order:
+            if provider is not None and provider not in order and self.is_configured(provider):
+                order.append(provider)
+        provider = await self.health_checker.select(order) if order else None
+        if provider is None:
+            raise NoProviderAvailable("No working LLM provider found")
+        return provider
+
+    async def activate(self, preferred: Optional[Provider] = None) -> Provider:
+        """Select a healthy provider and make it the default for new turns"""
+        self.default_provider = await self.select_provider(preferred)
+        self.get_model(self.default_provider)
+        return self.default_provider
+
+    def get_llm(self, provider: Provider):
+        """Return the pooled chat model for a provider"""
+        return self.clients.get(provider)
+
+    def get_session_history(self, session_id: str) -> TokenBudgetHistory:
+        """Return the history for a session, resuming it from the store if needed"""
+        if session_id not in self.sessions:
+            provider = self.default_provider
+            if provider is not None:
+                config = self.providers[provider]
+                token_budget, model = config.history_tokens, config.model
+            else:
+                token_budget, model = int(os.getenv("HISTORY_TOKEN_BUDGET", "4000")), None
+            if self.session_store is None:
+                history = TokenBudgetHistory(token_budget, model, self.trim_ratio)
+            else:
+                history = PersistentHistory(self.session_store, session_id, token_budget, model, self.trim_ratio)
+            if self.summarizer is not None:
+                history.attach_summary(RollingSummary(max_pending_tokens=token_budget))
+            self.sessions[session_id] = history
+        return self.sessions[session_id]
+
+    def get_model(self, provider: Provider, model_name: Optional[str] = None, tools: bool = False) -> Runnable:
+        """Return the model runnable for a provider (cache and callbacks applied)
+
+        Args:
+            provider: Provider to call
+            model_name: Model to use instead of the configured one (e.g. a
+                cheaper model for summaries)
+            tools: Bind the tool runtime's tools to the model
+        """
+        tools = tools and self.tools is not None
+        key = provider if model_name is None else (provider, model_name)
+        if tools:
+            key = (key, "tools")
+        if key not in self.models:
+            config = self.providers[provider]
+            model = self.clients.get(provider, model_name)
+            if tools:
+                try:
+                    model = model.bind_tools(self.tools.tools)
+                except NotImplementedError:
+                    logger.warning(f"{provider.value} models do not support tool calling, tools disabled")
+            if provider == Provider.ANTHROPIC and self.prompt_cache:
+                # Anthropic only caches up to explicit breakpoints; OpenAI caches
+                # byte-stable prefixes automatically
+                model = RunnableLambda(add_cache_breakpoints, name="CacheBreakpoints") | model
+            # Below the response cache, so cache hits never wait for rate limits or a slot
+            model = self._limited(provider, model)
+            if self.response_cache is not None:
+                model = self.response_cache.wrap(model, provider, model_name or config.model,
+                                                 self.clients.temperature)
+            callbacks = list(self.callback_factory(provider) or []) if self.callback_factory else []
+            if self.metrics is not None:
+                callbacks.append(MetricsCallbackHandler(self.metrics, provider, model_name or config.model,
+                                                        self.prices))
+            if callbacks:
+                model = model.with_config(callbacks=callbacks)
+            self.models[key] = model
+        return self.models[key]
+
+    def _limited(self, provider: Provider, model: Runnable) -> Runnable:
+        """Run a model under its provider's rate limiter and concurrency limit
+
+        The synchronous path has no event loop to wait on and calls the model directly.
+        """
+        limiter = self.rate_limiters[provider]
+        provider_config = self.providers[provider]
+
+        def transform(inputs: Iterator, config: RunnableConfig) -> Iterator:
+            yield from model.stream(self._last_input(inputs), config=config)
+
+        async def atransform(inputs: AsyncIterator, config: RunnableConfig) -> AsyncIterator:
+            prompt = None
+            async for prompt in inputs:
+                pass
+            estimate = count_tokens(prompt_text(prompt), provider_config.model) + provider_config.max_tokens
+            waited = await limiter.acquire(estimate)
+            if waited > 0.01:
+                logger.debug(f"Waited {waited:.2f}s for {provider.value} rate limit")
+            async with self._semaphore(provider):
+                async for chunk in model.astream(prompt, config=config):
+                    yield chunk
+
+        return RunnableGenerator(transform, atransform, name="ProviderLimits")
+
+    @property
+    def chain(self) -> RunnableWithMessageHistory:
+        """The conversation chain: prompt, then the routed model, wrapped with history
+
+        The prompt is a list of chat messages (fixed system message, then the
+        history window, then the new input) rather than one rendered string,
+        so consecutive turns share a prefix that providers can cache.
+        """
+        if self._chain is None:
+            prompt_template = ChatPromptTemplate.from_messages([
+                ("system", SYSTEM_PROMPT),
+                MessagesPlaceholder("summary", optional=True),
+                MessagesPlaceholder("history"),
+                ("human", "{recall}{input}"),
+            ]).partial(recall="")
+            routed_model = RunnableGenerator(self._route, self._aroute, name="ProviderRouter")
+            self._chain = RunnableWithMessageHistory(
+                runnable=prompt_template | routed_model,
+                get_session_history=self.get_session_history,
+                input_messages_key="input",
+                history_messages_key="history"
+            )
+        return self._chain
+
+    def candidates(self) -> List[Provider]:
+        """Configured providers not known to be unhealthy"""
+        candidates = []
+        for provider in self.fallback_order + [p for p in self.providers if p not in self.fallback_order]:
+            if provider in candidates or not self.is_configured(provider):
+                continue
+            status = self.health_checker.cached(provider)
+            if status is not None and not status.healthy:
+                continue
+            candidates.append(provider)
+        return candidates
+
+    def _ranked(self, config: RunnableConfig) -> List[Provider]:
+        preferred = config.get("configurable", {}).get("provider")
+        ranked = self.router.rank(self.candidates(), preferred)
+        if not ranked:
+            raise NoProviderAvailable("No working LLM provider found")
+        return ranked
+
+    @staticmethod
+    def _last_input(inputs: Iterator):
+        prompt = None
+        for prompt in inputs:
+            pass
+        return prompt
+
+    def _route(self, inputs: Iterator, config: RunnableConfig) -> Iterator:
+        """Synchronous routed model: ranked failover without hedging"""
+        prompt = self._last_input(inputs)
+        turn = config.get("configurable", {}).get("turn", {})
+        last_error = None
+        for provider in self._ranked(config):
+            if not self.router.breaker(provider).allow():
+                continue
+            start_time = time.perf_counter()
+            first_token_time = None
+            try:
+                for chunk in self.get_model(provider).stream(prompt, config=config):
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+                        turn["provider"] = provider
+                    yield chunk
+            except Exception as e:
+                self.router.record_failure(provider, e)
+                if first_token_time is not None:
+                    raise
+                last_error = e
+                continue
+            self.router.record_success(
+                provider, time.perf_counter() - start_time,
+                (first_token_time - start_time) if first_token_time else None
+            )
+            return
+        raise last_error or NoProviderAvailable("No working LLM provider found")
+
+    async def _aroute(self, inputs: AsyncIterator, config: RunnableConfig) -> AsyncIterator:
+        """Async routed model: ranked failover with optional hedging, then any tool rounds"""
+        prompt = None
+        async for prompt in inputs:
+            pass
+        if self.tools is None:
+            async for chunk in self._routed(prompt, config):
+                yield chunk
+            return
+
+        # Only text leaves this loop: history must not hold tool calls
+        # without the results that answer them
+        messages = prompt.to_messages()
+        for round_number in range(self.tools.max_rounds + 1):
+            reply = None
+            async for chunk in self._routed(messages, config, tools=True):
+                reply = chunk if reply is None else reply + chunk
+                text = chunk_text(chunk)
+                if text or chunk.usage_metadata:
+                    yield AIMessageChunk(content=text, usage_metadata=chunk.usage_metadata)
+            calls = reply.tool_calls if reply is not None else []
+            if not calls:
+                return
+            if round_number == self.tools.max_rounds:
+                logger.warning(f"Stopped after {self.tools.max_rounds} tool rounds; "
+                               f"{len(calls)} tool calls not run")
+                return
+            results = await self.tools.run(calls)
+            messages = messages + [reply] + results
+
+    async def _routed(self, prompt, config: RunnableConfig, tools: bool = False) -> AsyncIterator:
+        """One routed model call, with the tools bound when `tools` is set"""
+        turn = config.get("configurable", {}).get("turn", {})
+        # Providers whose stream joined another request's upstream call
+        joined = set()
+
+        async def open_stream(provider: Provider) -> AsyncIterator:
+            async for chunk in self._provider_stream(provider, prompt, config, tools=tools,
+                                                     on_join=lambda: joined.add(provider)):
+                yield chunk
+
+        def on_select(provider: Provider):
+            turn["provider"] = provider
+
+        async for chunk in self.router.astream(self._ranked(config), open_stream, on_select, joined.__contains__):
+            yield chunk
+
+    def _session_lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._session_locks.get(session_id)
+        if lock is None:
+            lock = self._session_locks[session_id] = asyncio.Lock()
+        return lock
+
+    @contextlib.asynccontextmanager
+    async def _session_turn(self, session_id: str):
+        """Hold the session's lock, counting the turn from the moment it starts waiting"""
+        self._session_turns[session_id] = self._session_turns.get(session_id, 0) + 1
+        try:
+            async with self._session_lock(session_id):
+                yield
+        finally:
+            self._session_turns[session_id] -= 1
+            if not self._session_turns[session_id]:
+                del self._session_turns[session_id]
+
+    def session_busy(self, session_id: str) -> bool:
+        """Whether a turn of the session is running or waiting for one"""
+        return session_id in self._session_turns
+
+    async def _provider_stream(self, provider: Provider, prompt, config: RunnableConfig,
+                               model_name: Optional[str] = None, tools: bool = False,
+                               on_join: Optional[Callable[[], None]] = None) -> AsyncIterator:
+        """Stream from one provider, sharing the call with identical requests in flight
+
+        `on_join` is called when the call joins another request's upstream call.
+        """
+        model = self.get_model(provider, model_name, tools)
+        if self.single_flight is None:
+            stream = self._provider_call(provider, prompt, config, model)
+        else:
+            model_name = model_name or self.providers[provider].model
+            tool_names = [tool.name for tool in self.tools.tools] if tools and self.tools is not None else []
+            key = self.single_flight.make_key(provider, model_name, self.clients.temperature, prompt, tool_names)
+            stream = self.single_flight.stream(key, provider, model_name,
+                                               lambda: self._provider_call(provider, prompt, config, model),
+                                               on_join)
+        async for chunk in stream:
+            yield chunk
+
+    async def _provider_call(self, provider: Provider, prompt, config: RunnableConfig,
+                             model: Runnable) -> AsyncIterator:
+        """Stream from one provider under its retry policy
+
+        The model itself waits for the rate limiter and a concurrency slot
+        (see `_limited`) on every attempt. Retries only happen before the
+        first chunk; a reply that has started streaming cannot be replayed.
+        """
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async for chunk in model.astream(prompt, config=config):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                if started or not self.retry.should_retry(attempt, e):
+                    raise
+                delay = self.retry.delay(attempt, e)
+                if is_rate_limit(e):
+                    self.rate_limiters[provider].pause(delay)
+                self.retry.retries += 1
+                attempt += 1
+                logger.debug(f"Retrying {provider.value} in {delay:.2f}s (attempt {attempt}): {str(e)}")
+                await asyncio.sleep(delay)
+
+    async def complete(self, provider: Provider, model_name: Optional[str], messages: list) -> str:
+        """Run one stateless completion (no session, no failover) under the provider's limits"""
+        parts = []
+        async for chunk in self._provider_stream(provider, messages, {}, model_name):
+            parts.append(chunk_text(chunk))
+        return "".join(parts)
+
+    def rate_limit_metrics(self) -> Dict[str, Dict[str, float]]:
+        """Queue depth and wait times per provider"""
+        return {provider.value: limiter.metrics() for provider, limiter in self.rate_limiters.items()}
+
+    def _semaphore(self, provider: Provider) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            semaphore = self._semaphores[provider] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def astream(self, session_id: str, user_input: str,
+                      provider: Optional[Provider] = None) -> AsyncIterator[str]:
+        """Stream the reply to one turn of a session
+
+        Turns for the same session are serialized; turns for different
+        sessions run concurrently up to the per-provider limit. The assembled
+        reply is written to the session history when the stream completes.
+
+        Args:
+            session_id: Session the turn belongs to
+            user_input: The user's message
+            provider: Provider explicitly chosen for this turn (e.g. with
+                `switch`), tried first while its breaker is closed; None
+                lets the router rank providers by score. Either way the
+                router fails over (or hedges) to others
+
+        Yields:
+            Reply text as it arrives
+        """
+        budget_provider = provider or self.default_provider or (self.candidates() or [None])[0]
+        turn = {}
+
+        async with self._session_turn(session_id):
+            history = self.get_session_history(session_id)
+            if self.shared_store:
+                history.refresh()
+            if budget_provider is not None:
+                config = self.providers[budget_provider]
+                history.set_token_budget(config.history_tokens, config.model)
+            start_time = time.perf_counter()
+            first_token_time = None
+            parts = []
+            usage = None
+            summary = history.summary.messages() if history.summary is not None else []
+            recalled = await self._recall(session_id, user_input, history)
+            try:
+                async for chunk in self.chain.astream(
+                    {"input": user_input, "summary": summary, "recall": recalled},
+                    config={"configurable": {"session_id": session_id, "provider": provider, "turn": turn,
+                                             "input": user_input}}
+                ):
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    text = chunk_text(chunk)
+                    if not text:
+                        continue
+                    if first_token_time is None:
+                        first_token_time = time.perf_counter()
+                    parts.append(text)
+                    yield text
+            except BaseException as e:
+                if self.transcripts is not None:
+                    stats = self._turn_stats(turn.get("provider", budget_provider), start_time, first_token_time,
+                                             parts, usage)
+                    self._archive(session_id, user_input, "".join(parts), stats, outcome_of(e))
+                raise
+            end_time = time.perf_counter()
+
+        served_by = turn.get("provider", budget_provider)
+        stats = self._turn_stats(served_by, start_time, first_token_time, parts, usage, end_time)
+        self.turn_stats[session_id] = stats
+        if self.transcripts is not None:
+            self._archive(session_id, user_input, "".join(parts), stats, "ok")
+        if self.summarizer is not None and history.summary is not None:
+            self.summarizer.schedule(session_id, history.summary, served_by)
+        if self.recall is not None and parts:
+            self._spawn(asyncio.to_thread(self.recall.add, session_id,
+                                          f"User: {user_input}\nAssistant: {''.join(parts)}"))
+        logger.debug(f"Session {session_id} turn on {served_by.value if served_by else 'unknown'}: "
+                     f"{stats.tokens} tokens in "
+                     f"{stats.total_time:.2f}s ({stats.tokens_per_second:.1f} tokens/sec), "
+                     f"prompt {stats.prompt_tokens} tokens, {stats.cached_tokens or 0} cached")
+
+    def _turn_stats(self, served_by: Optional[Provider], start_time: float, first_token_time: Optional[float],
+                    parts: List[str], usage: Optional[dict], end_time: Optional[float] = None) -> TurnStats:
+        model = self.providers[served_by].model if served_by else None
+        cached_tokens, cache_write_tokens = cache_usage(usage)
+        return TurnStats(
+            time_to_first_token=(first_token_time - start_time) if first_token_time else None,
+            total_time=(end_time or time.perf_counter()) - start_time,
+            tokens=count_tokens("".join(parts), model),
+            provider=served_by,
+            prompt_tokens=usage.get("input_tokens") if usage else None,
+            cached_tokens=cached_tokens,
+            cache_write_tokens=cache_write_tokens
+        )
+
+    def _archive(self, session_id: str, user_input: str, reply: str, stats: TurnStats, outcome: str):
+        """Queue a finished turn on the transcript archive"""
+        provider = stats.provider
+        self.transcripts.record(
+            session_id, provider.value if provider else None,
+            self.providers[provider].model if provider else None, outcome,
+            stats.prompt_tokens, stats.cached_tokens, stats.tokens,
+            stats.time_to_first_token, stats.total_time, user_input, reply
+        )
+
+    async def _recall(self, session_id: str, user_input: str, history: TokenBudgetHistory) -> str:
+        """Excerpts of relevant past turns to put ahead of the user's message
+
+        Turns still in the session's window are skipped. Failures only cost
+        the excerpts, never the turn.
+        """
+        if self.recall is None or not self.recall_k:
+            return ""
+        try:
+            snippets = await asyncio.to_thread(self.recall.search, user_input, self.recall_k, session_id,
+                                               len(history.messages) // 2)
+        except Exception as e:
+            logger.warning(f"Recall lookup failed: {str(e)}")
+            return ""
+        if snippets:
+            logger.debug(f"Recalled {len(snippets)} past turns for session {session_id} "
+                         f"(best score {snippets[0].score:.2f})")
+        return self.recall.format(snippets)
+
+    def _spawn(self, coroutine):
+        """Run work after a turn without holding up the caller"""
+        task = asyncio.get_running_loop().create_task(coroutine)
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Background task failed: {str(task.exception())}")
+
+    async def ainvoke(self, session_id: str, user_input: str,
+                      provider: Optional[Provider] = None) -> str:
+        """Run one turn of a session and return the complete reply"""
+        parts = []
+        async for text in self.astream(session_id, user_input, provider):
+            parts.append(text)
+        return "".join(parts)
+
+    def close_session(self, session_id: str) -> bool:
+        """Drop a session's in-memory state; stored history is kept
+
+        A busy session is left alone: its turns still use the history, and
+        its lock keeps them in order.
+
+        Returns:
+            Whether the session was closed
+        """
+        if self.session_busy(session_id):
+            return False
+        self.sessions.pop(session_id, None)
+        self._session_locks.pop(session_id, None)
+        self.turn_stats.pop(session_id, None)
+        return True
+
+    async def clear_session(self, session_id: str):
+        """Clear a session's history once the turns ahead of it have finished, then close it"""
+        async with self._session_turn(session_id):
+            self.get_session_history(session_id).clear()
+            self.turn_stats.pop(session_id, None)
+        self.close_session(session_id)
+
+    async def aclose(self):
+        """Release provider clients, connection pools and storage"""
+        if self.summarizer is not None:
+            await self.summarizer.aclose()
+        await asyncio.gather(*list(self._background), return_exceptions=True)
+        if self.single_flight is not None:
+            await self.single_flight.aclose()
+        if self.recall is not None:
+            self.recall.close()
+        if self.transcripts is not None:
+            await asyncio.to_thread(self.transcripts.close)
+        if self.tools is not None:
+            await self.tools.aclose()
+        await self.clients.aclose()
+        self.models.clear()
+        self._chain = None
+        self.sessions.clear()
+        if self.session_store is not None:
+            self.session_store.close()
+        if self.response_cache is not None:
+            self.response_cache.close()
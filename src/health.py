@@ -0,0 +1,179 @@
+"""Concurrent provider health checks with a TTL-cached health table
+
+Providers are probed with cheap model-listing requests instead of paid
+completions. All probes run concurrently, so selecting a provider costs the
+latency of the preferred healthy provider rather than the sum of every
+failing one. Results are cached so repeated selections (e.g. `switch`) are
+served from the health table.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import httpx
+from loguru import logger
+
+from providers import DEFAULT_BASE_URLS, Provider, ProviderConfig, auth_headers
+
+DEFAULT_TTL = 60.0
+DEFAULT_TIMEOUT = 3.0
+
+# Model-listing endpoints, relative to each provider's base URL
+PROBE_PATHS = {
+    Provider.OPENAI: "/models",
+    Provider.ANTHROPIC: "/v1/models",
+    Provider.COHERE: "/v1/models",
+}
+
+
+def probe_url(provider: Provider, config: ProviderConfig) -> Optional[str]:
+    """Model-listing URL under the provider's configured base URL, or None if it has none"""
+    if provider not in PROBE_PATHS:
+        return None
+    return (config.base_url or DEFAULT_BASE_URLS[provider]).rstrip("/") + PROBE_PATHS[provider]
+
+
+def describe_error(provider: Provider, error: str) -> str:
+    """Turn a provider failure into a user-facing message"""
+    error_msg = f"Failed to initialize {provider.value}: {error}"
+    if "401" in error:
+        error_msg += "\nInvalid API key - please verify your credentials"
+    elif "404" in error:
+        error_msg += "\nModel not found - please verify model name"
+    elif "429" in error:
+        error_msg += "\nRate limit exceeded - please try again later"
+    return error_msg
+
+
+class HealthStatus:
+    """Result of a single provider probe"""
+    def __init__(self, provider: Provider, healthy: bool, latency: float, error: Optional[str] = None):
+        self.provider = provider
+        self.healthy = healthy
+        self.latency = latency
+        self.error = error
+        self.checked_at = time.monotonic()
+
+    def is_fresh(self, ttl: float) -> bool:
+        """Whether this result is still within the cache TTL"""
+        return time.monotonic() - self.checked_at < ttl
+
+
+class ProviderHealthChecker:
+    """Probes providers concurrently and caches their health
+
+    Args:
+        providers: Provider configurations keyed by provider
+        ttl: Seconds a probe result stays valid
+        timeout: Deadline in seconds for a single probe
+        client: Shared connection pool to probe through, or None to open one per check
+    """
+    def __init__(self, providers: Dict[Provider, ProviderConfig],
+                 ttl: float = DEFAULT_TTL, timeout: float = DEFAULT_TIMEOUT,
+                 client: Optional[httpx.AsyncClient] = None):
+        self.providers = providers
+        self.ttl = ttl
+        self.timeout = timeout
+        self.client = client
+        self.health: Dict[Provider, HealthStatus] = {}
+
+    def cached(self, provider: Provider) -> Optional[HealthStatus]:
+        """Return the cached status for a provider if it is still fresh"""
+        status = self.health.get(provider)
+        if status is not None and status.is_fresh(self.ttl):
+            return status
+        return None
+
+    def invalidate(self, provider: Optional[Provider] = None):
+        """Drop cached results for one provider, or all of them"""
+        if provider is None:
+            self.health.clear()
+        else:
+            self.health.pop(provider, None)
+
+    @asynccontextmanager
+    async def _client(self):
+        """Yield the shared pool, or a temporary client if none was given"""
+        if self.client is not None:
+            yield self.client
+        else:
+            async with httpx.AsyncClient(timeout=self.timeout) as client:
+                yield client
+
+    async def _probe(self, client: httpx.AsyncClient, provider: Provider) -> HealthStatus:
+        """Probe one provider with a model-listing request"""
+        config = self.providers[provider]
+        start_time = time.perf_counter()
+        url = probe_url(provider, config)
+        if url is None:
+            # Local providers (the mock) have nothing to probe
+            status = self.health[provider] = HealthStatus(provider, True, 0.0)
+            return status
+        try:
+            response = await asyncio.wait_for(
+                client.get(url, headers=auth_headers(provider, config.api_key)),
+                timeout=self.timeout
+            )
+            latency = time.perf_counter() - start_time
+            if response.status_code == 200:
+                status = HealthStatus(provider, True, latency)
+            else:
+                status = HealthStatus(provider, False, latency, f"HTTP {response.status_code}")
+        except asyncio.TimeoutError:
+            status = HealthStatus(provider, False, time.perf_counter() - start_time,
+                                  f"timed out after {self.timeout:.1f}s")
+        except Exception as e:
+            status = HealthStatus(provider, False, time.perf_counter() - start_time, str(e))
+
+        self.health[provider] = status
+        if status.healthy:
+            logger.debug(f"Health check {provider.value}: ok in {status.latency:.2f}s")
+        else:
+            logger.debug(f"Health check {provider.value}: {status.error}")
+        return status
+
+    async def check_all(self, providers: Optional[List[Provider]] = None) -> Dict[Provider, HealthStatus]:
+        """Probe every given provider concurrently, reusing fresh cache entries"""
+        providers = providers if providers is not None else list(self.providers)
+        stale = [p for p in providers if self.cached(p) is None]
+        if stale:
+            async with self._client() as client:
+                await asyncio.gather(*(self._probe(client, p) for p in stale))
+        return {p: self.health[p] for p in providers if p in self.health}
+
+    async def select(self, order: List[Provider]) -> Optional[Provider]:
+        """Pick the first healthy provider in preference order
+
+        All uncached providers are probed at once. The answer is returned as
+        soon as the highest-priority healthy provider is known, without
+        waiting for slower, lower-priority probes to finish.
+
+        Args:
+            order: Providers in preference order
+
+        Returns:
+            The selected provider, or None if none are healthy
+        """
+        if all(self.cached(provider) is not None for provider in order):
+            return next((p for p in order if self.health[p].healthy), None)
+
+        async with self._client() as client:
+            tasks = {}
+            for provider in order:
+                if provider not in tasks and self.cached(provider) is None:
+                    tasks[provider] = asyncio.create_task(self._probe(client, provider))
+            try:
+                for provider in order:
+                    status = self.cached(provider)
+                    if provider in tasks:
+                        status = await tasks[provider]
+                    if status is not None and status.healthy:
+                        return provider
+                    if status is not None:
+                        logger.debug(describe_error(provider, status.error or "unhealthy"))
+                return None
+            finally:
+                for task in tasks.values():
+                    task.cancel()
+                await asyncio.gather(*tasks.values(), return_exceptions=True)
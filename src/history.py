@@ -0,0 +1,288 @@
+"""Token-budgeted conversation history
+
+Messages are tokenized once when they are added and the running total is kept
+alongside them, so fitting the window to a budget never re-tokenizes the
+transcript. The oldest messages are dropped once the budget is exceeded.
+
+Trimming goes below the budget, to `trim_ratio` of it, so that the start of
+the window (and with it the prompt prefix the providers cache) only moves
+once every few turns instead of on every turn after the budget is reached.
+Trimmed messages are handed to the session's RollingSummary, when one is
+attached, to be folded into its running summary.
+
+Every message is also linked into the session's branch tree (branching.py),
+so the conversation can be forked at any point in O(1) and the window
+rebuilt from another branch on checkout. Only the window and the last
+`fork_turns` user turns stay linked on the current branch; older messages
+are dropped from the tree unless another branch shares them.
+"""
+import os
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_chunk_to_message
+from loguru import logger
+
+from branching import MAIN_BRANCH, TurnNode, fork_point, turns_back, walk
+from summary import RollingSummary
+from tokens import count_tokens
+
+# Per-message framing overhead (role markers etc.) in chat-format prompts
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Fraction of the budget the window is trimmed down to once it overflows
+DEFAULT_TRIM_RATIO = 0.75
+
+# User turns back `fork` can reach after they have left the window
+DEFAULT_FORK_TURNS = 20
+
+
+def trim_ratio_from_env() -> float:
+    """HISTORY_TRIM_RATIO, clamped to (0, 1]; 1 trims a message at a time"""
+    ratio = float(os.getenv("HISTORY_TRIM_RATIO", str(DEFAULT_TRIM_RATIO)))
+    return min(1.0, max(0.05, ratio))
+
+
+def message_tokens(message: BaseMessage, model: Optional[str] = None) -> int:
+    """Count the tokens a message contributes to a prompt"""
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return count_tokens(content, model) + MESSAGE_OVERHEAD_TOKENS
+
+
+class TokenBudgetHistory(BaseChatMessageHistory):
+    """Chat history that keeps only the most recent messages within a token budget
+
+    Args:
+        token_budget: Maximum number of history tokens sent with each prompt
+        model: Model name used to pick the tokenizer
+        trim_ratio: Fraction of the budget kept when the window overflows
+        fork_turns: User turns back that stay forkable once out of the window
+    """
+    def __init__(self, token_budget: int, model: Optional[str] = None,
+                 trim_ratio: float = DEFAULT_TRIM_RATIO, fork_turns: int = DEFAULT_FORK_TURNS):
+        self.token_budget = token_budget
+        self.model = model
+        self.trim_ratio = trim_ratio
+        self.fork_turns = fork_turns
+        self._messages = deque()
+        self._token_counts = deque()
+        self.total_tokens = 0
+        self.trimmed_tokens = 0
+        self.tokens_saved_last_turn = 0
+        self.summary: Optional[RollingSummary] = None
+        self.head: Optional[TurnNode] = None
+        self.root_depth = 0
+        self.branch = MAIN_BRANCH
+        # Heads and summaries of the branches that are not checked out
+        self.branches: Dict[str, Tuple[Optional[TurnNode], Optional[RollingSummary]]] = {}
+        # Depth of the newest message the current branch shares with another one
+        self._shared_depth = 0
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return list(self._messages)
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.add_messages([message])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        # A streamed reply arrives as its merged chunk; keep it as a plain message
+        messages = [message_chunk_to_message(message) for message in messages]
+        entries = [(message, message_tokens(message, self.model)) for message in messages]
+        self._persist(entries)
+        trimmed_before = self.trimmed_tokens
+        for message, tokens in entries:
+            self._append(message, tokens)
+        self._trim()
+        self._prune()
+        self.tokens_saved_last_turn = self.trimmed_tokens - trimmed_before
+        if self.trimmed_tokens > trimmed_before:
+            logger.debug(f"History trimmed by {self.trimmed_tokens - trimmed_before} tokens "
+                         f"({self.total_tokens}/{self.token_budget} tokens in window)")
+
+    def _persist(self, entries: Sequence[Tuple[BaseMessage, int]]):
+        """Hook for writing new (message, tokens) pairs to durable storage"""
+
+    def _append(self, message: BaseMessage, tokens: int):
+        """Add a message whose token count is already known"""
+        self.head = TurnNode(message, tokens, self.head, self.root_depth)
+        self._messages.append(message)
+        self._token_counts.append(tokens)
+        self.total_tokens += tokens
+
+    def set_token_budget(self, token_budget: int, model: Optional[str] = None):
+        """Change the budget (e.g. after a provider switch) and re-fit the window"""
+        self.token_budget = token_budget
+        if model:
+            self.model = model
+        self._trim()
+
+    def _trim(self):
+        """Drop the oldest messages once the window exceeds the budget
+
+        Trims down to `trim_ratio` of the budget. The newest message is always
+        kept, even if it alone exceeds the budget.
+        """
+        if self.total_tokens <= self.token_budget:
+            return
+        target = self.token_budget * self.trim_ratio
+        while self.total_tokens > target and len(self._messages) > 1:
+            tokens = self._token_counts.popleft()
+            self._on_evict(self._messages.popleft(), tokens)
+            self.total_tokens -= tokens
+            self.trimmed_tokens += tokens
+
+    def _prune(self):
+        """Unlink the current branch's messages that nothing can reach any more
+
+        The branch keeps its window and the message before each of its last
+        `fork_turns` user messages (where `fork` would start). Older messages
+        go unless another branch shares them; a stored branch keeps what it
+        needed when it was checked out.
+        """
+        keep = len(self._messages)
+        turns = 0
+        child = None
+        for index, node in enumerate(walk(self.head)):
+            if index >= keep and turns >= self.fork_turns:
+                if child is not None and node.depth > self._shared_depth:
+                    child.parent = None
+                return
+            if node.message.type == "human":
+                turns += 1
+                keep = max(keep, index + 2)
+            child = node
+
+    def _update_shared_depth(self):
+        forks = (fork_point(self.head, head) for head, _ in self.branches.values())
+        self._shared_depth = max((node.depth for node in forks if node is not None), default=0)
+
+    def _on_evict(self, message: BaseMessage, tokens: int):
+        """Hook called with each message dropped from the window"""
+        if self.summary is not None:
+            self.summary.add(message, tokens)
+
+    def refresh(self) -> bool:
+        """Hook for re-reading a window other processes may have written to
+
+        Returns:
+            Whether the window changed
+        """
+        return False
+
+    def attach_summary(self, summary: RollingSummary):
+        """Fold messages trimmed from now on into `summary`"""
+        self.summary = summary
+
+    def fork(self, name: str, turns: int = 0):
+        """Start a branch at the current message, or `turns` user turns back, and check it out
+
+        Raises:
+            ValueError: If the name is taken or the branch is not that long
+        """
+        if name == self.branch or name in self.branches:
+            raise ValueError(f"Branch '{name}' already exists")
+        head = turns_back(self.head, turns)
+        summary = self.summary
+        if summary is not None:
+            # The summary can be shared only if it ends before the fork point
+            boundary = summary.covered + len(summary.pending)
+            if head is not None and head.depth >= boundary:
+                summary = summary.copy()
+            else:
+                summary = RollingSummary(max_pending_tokens=summary.max_pending_tokens)
+        self.branches[self.branch] = (self.head, self.summary)
+        self.branch = name
+        if head is self.head:
+            # Same window; only the summary needs its own copy
+            self.summary = summary
+        else:
+            self._load_branch(head, summary)
+        self._update_shared_depth()
+
+    def checkout(self, name: str):
+        """Switch the window to another branch
+
+        Raises:
+            ValueError: If there is no such branch
+        """
+        if name == self.branch:
+            return
+        if name not in self.branches:
+            raise ValueError(f"No branch named '{name}'")
+        head, summary = self.branches.pop(name)
+        self.branches[self.branch] = (self.head, self.summary)
+        self.branch = name
+        self._load_branch(head, summary)
+        self._update_shared_depth()
+
+    def branch_info(self) -> List[dict]:
+        """Name, length and token total of every branch, and what it shares with the current one"""
+        heads = dict(self.branches)
+        heads[self.branch] = (self.head, self.summary)
+        info = []
+        for name, (head, _) in sorted(heads.items()):
+            shared = fork_point(head, self.head) if name != self.branch else None
+            info.append({
+                "name": name,
+                "current": name == self.branch,
+                "messages": head.depth if head is not None else self.root_depth,
+                "tokens": head.total_tokens if head is not None else 0,
+                # Messages shared with the current branch, while it still links to the fork point
+                "shared": shared.depth if shared is not None else None,
+            })
+        return info
+
+    def _load_branch(self, head: Optional[TurnNode], summary: Optional[RollingSummary]):
+        """Rebuild the window from a branch head, newest messages first within the budget
+
+        Messages between what the summary covers and the window are queued on
+        the summary; older ones beyond its backlog cap are skipped.
+        """
+        self.head = head
+        self.summary = summary
+        self._messages.clear()
+        self._token_counts.clear()
+        self.total_tokens = 0
+        floor = summary.covered + len(summary.pending) if summary is not None else 0
+        window = []
+        nodes = walk(head)
+        node = next(nodes, None)
+        while node is not None and node.depth > floor:
+            if window and self.total_tokens + node.tokens > self.token_budget:
+                break
+            window.append(node)
+            self.total_tokens += node.tokens
+            node = next(nodes, None)
+        for kept in reversed(window):
+            self._messages.append(kept.message)
+            self._token_counts.append(kept.tokens)
+        if summary is None:
+            return
+        backlog = []
+        backlog_tokens = 0
+        room = summary.max_pending_tokens - summary.pending_tokens
+        while node is not None and node.depth > floor and backlog_tokens + node.tokens <= room:
+            backlog.append(node)
+            backlog_tokens += node.tokens
+            node = next(nodes, None)
+        oldest = backlog[-1] if backlog else (window[-1] if window else None)
+        if oldest is not None:
+            summary.covered += oldest.depth - 1 - floor
+        for queued in reversed(backlog):
+            summary.add(queued.message, queued.tokens)
+
+    def clear(self) -> None:
+        self._messages.clear()
+        self._token_counts.clear()
+        self.total_tokens = 0
+        self.trimmed_tokens = 0
+        self.tokens_saved_last_turn = 0
+        self.head = None
+        self.root_depth = 0
+        self.branch = MAIN_BRANCH
+        self.branches.clear()
+        self._shared_depth = 0
+        if self.summary is not None:
+            self.summary.clear()
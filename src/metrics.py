@@ -0,0 +1,468 @@
+"""Always-on request metrics: latency, token and cost histograms per provider
+
+`MetricsCallbackHandler` is attached to every provider model and records,
+labeled by provider, model and outcome:
+
+    - llm_time_to_first_token_seconds
+    - llm_request_duration_seconds
+    - llm_prompt_tokens / llm_completion_tokens
+    - llm_request_cost_usd (estimated from MODEL_PRICES)
+    - llm_requests_total
+
+plus single-flight counters (`llm_single_flight_calls_total`,
+`llm_coalesced_requests_total`) recorded by the engine.
+
+Histograms use fixed buckets, so recording is a lock and a few additions.
+The registry can be scraped in Prometheus text format from a local
+`/metrics` endpoint (`MetricsServer`) and/or appended periodically to a file
+as OTLP/JSON metric exports (`OTLPFileExporter`), which an OpenTelemetry
+collector's file receiver can ingest.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+from loguru import logger
+
+from providers import Provider
+from router import is_rate_limit
+from tokens import count_tokens, prompt_text
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536)
+COST_BUCKETS = (0.0001, 0.001, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+# USD per million (prompt, completion) tokens; the longest matching prefix wins
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4": (30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "claude-3-5-sonnet": (3.00, 15.00),
+    "claude-3-5-haiku": (0.80, 4.00),
+    "claude-3-opus": (15.00, 75.00),
+    "claude-3-sonnet": (3.00, 15.00),
+    "claude-3-haiku": (0.25, 1.25),
+    "command-r-plus": (2.50, 10.00),
+    "command-r": (0.15, 0.60),
+    "command": (1.00, 2.00),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def load_price_table(path: Optional[str] = None) -> Dict[str, Tuple[float, float]]:
+    """Built-in prices, overridden by a JSON file of {model: [prompt, completion]}
+
+    Args:
+        path: Price file, defaulting to MODEL_PRICES_PATH
+    """
+    prices = dict(MODEL_PRICES)
+    path = path or os.getenv("MODEL_PRICES_PATH")
+    if path:
+        try:
+            with open(path) as f:
+                prices.update({model: tuple(price) for model, price in json.load(f).items()})
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load model prices from {path}: {str(e)}")
+    return prices
+
+
+def estimate_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int,
+                  prices: Dict[str, Tuple[float, float]]) -> Optional[float]:
+    """Estimated USD cost of one request, or None for an unpriced model"""
+    if not model:
+        return None
+    matches = [prefix for prefix in prices if model.startswith(prefix)]
+    if not matches:
+        return None
+    prompt_price, completion_price = prices[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+class Histogram:
+    """Fixed-bucket histogram (bucket counts are per bucket, not cumulative)"""
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    """Thread-safe store of labeled histograms and counters"""
+    HISTOGRAMS = {
+        "llm_time_to_first_token_seconds": ("Time to first streamed token", "s", LATENCY_BUCKETS),
+        "llm_request_duration_seconds": ("Total request latency", "s", LATENCY_BUCKETS),
+        "llm_prompt_tokens": ("Prompt tokens per request", "{token}", TOKEN_BUCKETS),
+        "llm_completion_tokens": ("Completion tokens per request", "{token}", TOKEN_BUCKETS),
+        "llm_cached_prompt_tokens": ("Prompt tokens read from the provider's prompt cache", "{token}",
+                                     TOKEN_BUCKETS),
+        "llm_request_cost_usd": ("Estimated request cost", "USD", COST_BUCKETS),
+        "llm_tool_duration_seconds": ("Tool call latency", "s", LATENCY_BUCKETS),
+    }
+    COUNTERS = {
+        "llm_requests_total": "Requests by provider, model and outcome",
+        "llm_single_flight_calls_total": "Upstream calls started through single-flight coalescing",
+        "llm_coalesced_requests_total": "Requests that joined an identical in-flight call (upstream calls saved)",
+    }
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {name: {} for name in self.HISTOGRAMS}
+        self.counters: Dict[str, Dict[Labels, float]] = {name: {} for name in self.COUNTERS}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, labels: Labels):
+        with self._lock:
+            series = self.histograms[name]
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram(self.HISTOGRAMS[name][2])
+            histogram.observe(value)
+
+    def increment(self, name: str, labels: Labels, amount: float = 1.0):
+        with self._lock:
+            series = self.counters[name]
+            series[labels] = series.get(labels, 0.0) + amount
+
+    def summary(self) -> Dict[str, dict]:
+        """Request count, p50/p99 latency and spend per provider/model/outcome, for logging"""
+        with self._lock:
+            costs = self.histograms["llm_request_cost_usd"]
+            return {
+                ",".join(value for _, value in labels): {
+                    "requests": histogram.count,
+                    "p50": histogram.quantile(0.5),
+                    "p99": histogram.quantile(0.99),
+                    "cost_usd": round(costs[labels].sum, 6) if labels in costs else None,
+                }
+                for labels, histogram in self.histograms["llm_request_duration_seconds"].items()
+            }
+
+    def render_prometheus(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, (description, _, _) in self.HISTOGRAMS.items():
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in self.histograms[name].items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(float(bound))
+                        lines.append(f"{name}_bucket{_prometheus_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_prometheus_labels(labels)} {histogram.sum}")
+                    lines.append(f"{name}_count{_prometheus_labels(labels)} {histogram.count}")
+            for name, description in self.COUNTERS.items():
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in self.counters[name].items():
+                    lines.append(f"{name}{_prometheus_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_otlp(self) -> dict:
+        """OTLP/JSON ExportMetricsServiceRequest with cumulative temporality"""
+        start = str(int(self.started_at * 1e9))
+        now = str(time.time_ns())
+        metrics = []
+        with self._lock:
+            for name, (description, unit, _) in self.HISTOGRAMS.items():
+                points = [{
+                    "attributes": _otlp_attributes(labels),
+                    "startTimeUnixNano": start,
+                    "timeUnixNano": now,
+                    "count": str(histogram.count),
+                    "sum": histogram.sum,
+                    "bucketCounts": [str(count) for count in histogram.counts],
+                    "explicitBounds": list(histogram.bounds),
+                } for labels, histogram in self.histograms[name].items()]
+                if points:
+                    metrics.append({"name": name, "description": description, "unit": unit,
+                                    "histogram": {"aggregationTemporality": 2, "dataPoints": points}})
+            for name, description in self.COUNTERS.items():
+                points = [{
+                    "attributes": _otlp_attributes(labels),
+                    "startTimeUnixNano": start,
+                    "timeUnixNano": now,
+                    "asDouble": value,
+                } for labels, value in self.counters[name].items()]
+                if points:
+                    metrics.append({"name": name, "description": description,
+                                    "sum": {"aggregationTemporality": 2, "isMonotonic": True, "dataPoints": points}})
+        return {"resourceMetrics": [{
+            "resource": {"attributes": _otlp_attributes((("service.name", "aichatagent"),))},
+            "scopeMetrics": [{"scope": {"name": "aichatagent.metrics"}, "metrics": metrics}],
+        }]}
+
+
+def _prometheus_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _otlp_attributes(labels: Labels) -> List[dict]:
+    return [{"key": key, "value": {"stringValue": value}} for key, value in labels]
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Record latency, token and cost metrics for every request to one provider
+
+    Token counts come from the provider's usage report when present and are
+    estimated with the tokenizer otherwise.
+
+    Args:
+        registry: Registry receiving the observations
+        provider: Provider whose model this handler is attached to
+        model: Configured model name, used when the request does not report one
+        prices: Price table for cost estimates
+    """
+    # Recording is cheap; run in the caller rather than a thread pool executor
+    run_inline = True
+
+    def __init__(self, registry: MetricsRegistry, provider: Provider, model: Optional[str] = None,
+                 prices: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.registry = registry
+        self.provider = provider
+        self.model = model
+        self.prices = prices if prices is not None else MODEL_PRICES
+        self._runs: Dict[object, dict] = {}
+
+    def _start(self, run_id, prompt, kwargs: dict):
+        params = kwargs.get("invocation_params") or {}
+        self._runs[run_id] = {
+            "started": time.perf_counter(),
+            "first_token": None,
+            "prompt": prompt,
+            "model": params.get("model_name") or params.get("model") or self.model,
+        }
+
+    def on_llm_start(self, serialized, prompts, *, run_id=None, **kwargs):
+        self._start(run_id, prompts, kwargs)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id=None, **kwargs):
+        self._start(run_id, messages, kwargs)
+
+    def on_llm_new_token(self, token, *, run_id=None, **kwargs):
+        run = self._runs.get(run_id)
+        if run is not None and run["first_token"] is None:
+            run["first_token"] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id=None, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        ended = time.perf_counter()
+        labels = self._labels(run["model"], "ok")
+        prompt_tokens, completion_tokens = _usage(response)
+        if prompt_tokens is None:
+            prompt_tokens = sum(count_tokens(prompt_text(item), run["model"]) for item in run["prompt"])
+        if completion_tokens is None:
+            completion_tokens = count_tokens(
+                "".join(g.text for generations in response.generations for g in generations), run["model"])
+        self._record(run, ended, labels)
+        self.registry.observe("llm_prompt_tokens", prompt_tokens, labels)
+        cached_tokens, _ = _response_cache_usage(response)
+        if cached_tokens is not None:
+            self.registry.observe("llm_cached_prompt_tokens", cached_tokens, labels)
+        self.registry.observe("llm_completion_tokens", completion_tokens, labels)
+        cost = estimate_cost(run["model"], prompt_tokens, completion_tokens, self.prices)
+        if cost is not None:
+            self.registry.observe("llm_request_cost_usd", cost, labels)
+
+    def on_llm_error(self, error, *, run_id=None, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        self._record(run, time.perf_counter(), self._labels(run["model"], outcome_of(error)))
+
+    def _labels(self, model: Optional[str], outcome: str) -> Labels:
+        return (("provider", self.provider.value), ("model", model or "unknown"), ("outcome", outcome))
+
+    def _record(self, run: dict, ended: float, labels: Labels):
+        self.registry.increment("llm_requests_total", labels)
+        self.registry.observe("llm_request_duration_seconds", ended - run["started"], labels)
+        if run["first_token"] is not None:
+            self.registry.observe("llm_time_to_first_token_seconds", run["first_token"] - run["started"], labels)
+
+
+def outcome_of(error: BaseException) -> str:
+    """Outcome label for a failed request: cancelled, rate_limited or error"""
+    if isinstance(error, (KeyboardInterrupt, GeneratorExit)) or type(error).__name__ == "CancelledError":
+        return "cancelled"
+    if is_rate_limit(error):
+        return "rate_limited"
+    return "error"
+
+
+def _usage(response) -> Tuple[Optional[int], Optional[int]]:
+    """Prompt and completion tokens reported by the provider, if any"""
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage.get("prompt_tokens") is not None:
+        return usage.get("prompt_tokens"), usage.get("completion_tokens")
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return metadata.get("input_tokens"), metadata.get("output_tokens")
+    return None, None
+
+
+def cache_usage(usage: Optional[dict]) -> Tuple[Optional[int], Optional[int]]:
+    """Prompt tokens read from and written to the provider's prompt cache
+
+    Args:
+        usage: A message's `usage_metadata`
+
+    Returns:
+        (cache reads, cache writes), each None when not reported
+    """
+    details = (usage or {}).get("input_token_details") or {}
+    return details.get("cache_read"), details.get("cache_creation")
+
+
+def _response_cache_usage(response) -> Tuple[Optional[int], Optional[int]]:
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return cache_usage(metadata)
+    details = ((response.llm_output or {}).get("token_usage") or {}).get("prompt_tokens_details") or {}
+    return details.get("cached_tokens"), None
+
+
+class MetricsServer:
+    """Serve `GET /metrics` in Prometheus text format from a background thread
+
+    Args:
+        registry: Registry to expose
+        port: Port to listen on
+        host: Interface to bind, localhost by default
+    """
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = "127.0.0.1"):
+        registry_ref = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry_ref.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_port
+
+    def start(self) -> "MetricsServer":
+        self.thread.start()
+        logger.info(f"Serving metrics on http://{self.server.server_address[0]}:{self.port}/metrics")
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class OTLPFileExporter:
+    """Append an OTLP/JSON metrics export to a file every `interval` seconds
+
+    Args:
+        registry: Registry to export
+        path: JSON lines file, one export per line
+        interval: Seconds between exports
+    """
+    def __init__(self, registry: MetricsRegistry, path: str, interval: float = 60.0):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="otlp-file-exporter", daemon=True)
+
+    def start(self) -> "OTLPFileExporter":
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.thread.start()
+        return self
+
+    def export(self):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(self.registry.to_otlp()) + "\n")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.export()
+            except OSError as e:
+                logger.warning(f"OTLP metrics export failed: {str(e)}")
+
+    def close(self):
+        """Stop the exporter after writing a final export"""
+        self._stop.set()
+        self.thread.join()
+        self.export()
+
+
+def start_exporters(registry: MetricsRegistry, worker_index: Optional[int] = None) -> list:
+    """Start the exporters enabled by METRICS_PORT and METRICS_OTLP_PATH
+
+    Args:
+        registry: Registry to export
+        worker_index: Server worker number, when several workers run the same
+            configuration; worker N serves METRICS_PORT + N and writes
+            METRICS_OTLP_PATH with a `.workerN` suffix before the extension
+
+    Returns:
+        The started exporters, each with a close() method
+    """
+    exporters = []
+    port = os.getenv("METRICS_PORT")
+    if port:
+        port = int(port) + (worker_index or 0)
+        exporters.append(MetricsServer(registry, port, os.getenv("METRICS_HOST", "127.0.0.1")).start())
+    path = os.getenv("METRICS_OTLP_PATH")
+    if path:
+        if worker_index is not None:
+            root, extension = os.path.splitext(path)
+            path = f"{root}.worker{worker_index}{extension}"
+        interval = float(os.getenv("METRICS_EXPORT_INTERVAL", "60"))
+        exporters.append(OTLPFileExporter(registry, path, interval).start())
+    return exporters
@@ -0,0 +1,264 @@
+"""Local mock chat model for benchmarks, load tests and offline development
+
+`Provider.MOCK` is served by `MockChatModel`, which never leaves the process.
+Its behaviour follows a `MockProfile`: time to first token, streaming token
+rate, reply length and injected failures (server errors and 429s with a
+Retry-After), so the engine's routing, retry and rate-limit paths can be
+exercised and the framework's own overhead measured without network noise.
+
+Like the real providers' automatic prefix caching, the mock remembers the
+message prefixes it has seen and reports the longest previously seen prefix
+of each prompt as cache reads in `usage_metadata`.
+
+With tools bound, the mock calls the ones written as `name({"arg": ...})` in
+the newest user message, all in one reply, and starts its answer to the
+tool results with them, so the agent loop runs without a real model.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+# Sleeps shorter than this are accumulated rather than taken one per token
+MIN_SLEEP = 0.001
+
+# Message prefixes remembered for the simulated prompt cache
+PREFIX_CACHE_SIZE = 100000
+
+WORDS = ("the", "quick", "mock", "reply", "streams", "tokens", "at", "a", "steady", "rate")
+
+
+class MockProfile:
+    """Latency, throughput and failure behaviour of the mock provider
+
+    Args:
+        time_to_first_token: Seconds before the first token
+        tokens_per_second: Streaming rate after the first token (0 = instant)
+        reply_tokens: Tokens per reply
+        jitter: Relative random variation applied to both delays
+        error_rate: Fraction of requests failing with a 500 before streaming
+        rate_limit_rate: Fraction of requests failing with a 429
+        retry_after: Retry-After seconds sent with injected 429s
+    """
+    def __init__(self, time_to_first_token: float = 0.0, tokens_per_second: float = 0.0,
+                 reply_tokens: int = 50, jitter: float = 0.0, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_after: float = 1.0):
+        self.time_to_first_token = time_to_first_token
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+
+    @classmethod
+    def named(cls, name: str) -> "MockProfile":
+        if name not in PROFILES:
+            raise ValueError(f"Unknown mock profile '{name}' (choose from {', '.join(PROFILES)})")
+        return cls(**PROFILES[name])
+
+    @classmethod
+    def from_env(cls) -> "MockProfile":
+        """Start from MOCK_PROFILE and apply any MOCK_* overrides"""
+        profile = cls.named(os.getenv("MOCK_PROFILE", "instant"))
+        overrides = {
+            "time_to_first_token": "MOCK_TTFT",
+            "tokens_per_second": "MOCK_TOKEN_RATE",
+            "reply_tokens": "MOCK_REPLY_TOKENS",
+            "jitter": "MOCK_JITTER",
+            "error_rate": "MOCK_ERROR_RATE",
+            "rate_limit_rate": "MOCK_RATE_LIMIT_RATE",
+        }
+        for attribute, variable in overrides.items():
+            value = os.getenv(variable)
+            if value:
+                setattr(profile, attribute, type(getattr(profile, attribute))(float(value)))
+        return profile
+
+    def delay(self, seconds: float) -> float:
+        if self.jitter and seconds:
+            return max(0.0, seconds * random.uniform(1 - self.jitter, 1 + self.jitter))
+        return seconds
+
+
+PROFILES: Dict[str, Dict[str, float]] = {
+    # No simulated latency: every measured millisecond is framework overhead
+    "instant": {},
+    "typical": {"time_to_first_token": 0.4, "tokens_per_second": 60, "reply_tokens": 120, "jitter": 0.3},
+    "slow": {"time_to_first_token": 1.5, "tokens_per_second": 20, "reply_tokens": 200, "jitter": 0.5},
+    "flaky": {"time_to_first_token": 0.4, "tokens_per_second": 60, "reply_tokens": 120, "jitter": 0.3,
+              "error_rate": 0.05, "rate_limit_rate": 0.05},
+}
+
+
+class _MockResponse:
+    """Minimal HTTP response carried by injected errors (status and headers)"""
+    def __init__(self, status_code: int, headers: Optional[Dict[str, str]] = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class MockProviderError(Exception):
+    """Injected provider failure shaped like an SDK HTTP error"""
+    def __init__(self, status_code: int, message: str, headers: Optional[Dict[str, str]] = None):
+        super().__init__(f"Error code: {status_code} - {message}")
+        self.status_code = status_code
+        self.response = _MockResponse(status_code, headers)
+
+
+class _PrefixCache:
+    """LRU set of message-prefix hashes, shared by all mock models"""
+    def __init__(self, size: int = PREFIX_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def read(self, model: str, messages: List[BaseMessage]) -> Tuple[int, int]:
+        """(prompt tokens, tokens covered by the longest cached prefix); caches every prefix"""
+        digest = hash(model)
+        tokens = cached = 0
+        for message in messages:
+            digest = hash((digest, message.type, str(message.content)))
+            tokens += len(str(message.content)) // 4 + 4
+            if digest in self.entries:
+                self.entries.move_to_end(digest)
+                cached = tokens
+            else:
+                self.entries[digest] = None
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return tokens, cached
+
+
+_prefix_cache = _PrefixCache()
+
+
+def _requested_calls(messages: List[BaseMessage], tools: list) -> List[dict]:
+    """Tool calls written as name({...}) in the newest message, if it is the user's"""
+    if not messages or messages[-1].type != "human" or not isinstance(messages[-1].content, str):
+        return []
+    names = [tool["function"]["name"] for tool in tools]
+    pattern = re.compile(r"\b(" + "|".join(re.escape(name) for name in names) + r")\((.*?)\)")
+    calls = []
+    for match in pattern.finditer(messages[-1].content):
+        try:
+            args = json.loads(match.group(2)) if match.group(2).strip() else {}
+        except json.JSONDecodeError:
+            args = {}
+        calls.append({"name": match.group(1), "args": args if isinstance(args, dict) else {},
+                      "id": f"call_{random.getrandbits(48):012x}", "type": "tool_call"})
+    return calls
+
+
+class MockChatModel(BaseChatModel):
+    """Chat model that streams a synthetic reply according to a MockProfile"""
+    model: str = "mock-model"
+    profile: Any = None
+    temperature: float = 0.7
+
+    @property
+    def _llm_type(self) -> str:
+        return "mock"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model_name": self.model}
+
+    def _profile(self) -> MockProfile:
+        return self.profile or MockProfile()
+
+    def _maybe_fail(self, profile: MockProfile):
+        roll = random.random()
+        if roll < profile.rate_limit_rate:
+            raise MockProviderError(429, "Mock rate limit", {"retry-after": str(profile.retry_after)})
+        if roll < profile.rate_limit_rate + profile.error_rate:
+            raise MockProviderError(500, "Mock server error")
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs) -> Runnable:
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _plan(self, messages: List[BaseMessage], tools: Optional[list] = None):
+        """Failure check, then (delay before chunk, chunk text) pairs, usage and tool calls"""
+        profile = self._profile()
+        self._maybe_fail(profile)
+        calls = _requested_calls(messages, tools) if tools else []
+        if calls:
+            words = [""]
+        else:
+            # Answer to tool results: the results first, then filler words
+            results = []
+            for message in reversed(messages):
+                if message.type != "tool":
+                    break
+                results.insert(0, f"{message.name}: {message.content};")
+            words = results + [WORDS[i % len(WORDS)] for i in range(max(0, profile.reply_tokens - len(results)))]
+        interval = 1.0 / profile.tokens_per_second if profile.tokens_per_second else 0.0
+        steps = []
+        for i, word in enumerate(words):
+            delay = profile.delay(profile.time_to_first_token) if i == 0 else profile.delay(interval)
+            steps.append((delay, ("" if i == 0 else " ") + word))
+        output_tokens = 10 * len(calls) if calls else len(words)
+        prompt_tokens, cached_tokens = _prefix_cache.read(self.model, messages)
+        usage = {"input_tokens": prompt_tokens, "output_tokens": output_tokens,
+                 "total_tokens": prompt_tokens + output_tokens,
+                 "input_token_details": {"cache_read": cached_tokens}}
+        return steps, usage, calls
+
+    def _chunks(self, steps, usage, calls) -> Iterator[tuple]:
+        """Yield (sleep, chunk) with short sleeps batched to keep timer overhead low"""
+        pending = 0.0
+        for i, (delay, text) in enumerate(steps):
+            pending += delay
+            sleep = 0.0
+            if pending >= MIN_SLEEP or i == 0:
+                sleep, pending = pending, 0.0
+            if i < len(steps) - 1:
+                yield sleep, AIMessageChunk(content=text)
+            else:
+                yield sleep, AIMessageChunk(content=text, usage_metadata=usage, tool_call_chunks=[
+                    {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": index}
+                    for index, call in enumerate(calls)
+                ])
+
+    @staticmethod
+    def _message(steps, usage, calls) -> AIMessage:
+        return AIMessage(content="".join(text for _, text in steps), usage_metadata=usage, tool_calls=calls)
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        steps, usage, calls = self._plan(messages, kwargs.get("tools"))
+        time.sleep(sum(delay for delay, _ in steps))
+        return ChatResult(generations=[ChatGeneration(message=self._message(steps, usage, calls))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        steps, usage, calls = self._plan(messages, kwargs.get("tools"))
+        await asyncio.sleep(sum(delay for delay, _ in steps))
+        return ChatResult(generations=[ChatGeneration(message=self._message(steps, usage, calls))])
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None,
+                **kwargs) -> Iterator[ChatGenerationChunk]:
+        steps, usage, calls = self._plan(messages, kwargs.get("tools"))
+        for sleep, chunk in self._chunks(steps, usage, calls):
+            if sleep:
+                time.sleep(sleep)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.content)
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages: List[BaseMessage], stop=None, run_manager=None,
+                       **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        steps, usage, calls = self._plan(messages, kwargs.get("tools"))
+        for sleep, chunk in self._chunks(steps, usage, calls):
+            if sleep:
+                await asyncio.sleep(sleep)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.content)
+            yield ChatGenerationChunk(message=chunk)
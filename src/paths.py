@@ -0,0 +1,5 @@
+"""Default locations of the assistant's local state"""
+import os
+
+# <project>/data, whatever the working directory
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data"))
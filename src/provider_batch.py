@@ -0,0 +1,362 @@
+"""Provider-native asynchronous batch APIs
+
+Offline jobs can go through the providers' batch endpoints instead of one
+chat call per prompt; batch requests are billed at a discount and do not
+count against the interactive rate limits.
+
+    - OpenAI: requests are packed into a JSONL file, uploaded to /files and
+      submitted to /batches; results are downloaded from the output and
+      error files once the batch completes.
+    - Anthropic: requests are posted to /messages/batches; results are
+      streamed from the batch's results URL once processing has ended.
+
+Cohere has no equivalent chat batch endpoint. Large submissions are split
+into several batches within each provider's size limits, status polling backs
+off exponentially, and every request gets its own result or error.
+"""
+import abc
+import asyncio
+import json
+import os
+import random
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional
+
+import httpx
+from loguru import logger
+
+from providers import DEFAULT_BASE_URLS, Provider, ProviderConfig, auth_headers
+from rate_limit import is_retryable
+
+
+class BatchRequest:
+    """One chat request in a provider batch
+
+    Args:
+        custom_id: Caller's identifier, echoed back with the result
+        messages: Chat messages as {"role": "user"|"assistant", "content": str}
+        max_tokens: Completion limit, defaulting to the provider's setting
+        system: System message sent ahead of the conversation
+    """
+    def __init__(self, custom_id: str, messages: List[Dict[str, str]], max_tokens: Optional[int] = None,
+                 system: Optional[str] = None):
+        self.custom_id = custom_id
+        self.messages = messages
+        self.max_tokens = max_tokens
+        self.system = system
+
+
+class BatchItemResult:
+    """Outcome of one request in a provider batch"""
+    def __init__(self, custom_id: str, output: Optional[str] = None, error: Optional[str] = None,
+                 usage: Optional[Dict[str, int]] = None):
+        self.custom_id = custom_id
+        self.output = output
+        self.error = error
+        self.usage = usage or {}
+
+
+class BatchFailed(RuntimeError):
+    """Raised when a whole batch is rejected or ends without results"""
+
+
+class PollBackoff:
+    """Exponential polling intervals with jitter
+
+    Args:
+        initial: First interval in seconds
+        maximum: Upper bound for any interval
+        factor: Growth per poll
+    """
+    def __init__(self, initial: float = 5.0, maximum: float = 120.0, factor: float = 1.5):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+
+    @classmethod
+    def from_env(cls) -> "PollBackoff":
+        return cls(
+            initial=float(os.getenv("NATIVE_BATCH_POLL_INTERVAL", "5")),
+            maximum=float(os.getenv("NATIVE_BATCH_POLL_MAX", "120"))
+        )
+
+    def intervals(self) -> Iterator[float]:
+        interval = self.initial
+        while True:
+            yield interval * random.uniform(0.9, 1.1)
+            interval = min(self.maximum, interval * self.factor)
+
+
+class NativeBatchBackend(abc.ABC):
+    """Shared submission, polling and splitting logic for a provider batch API
+
+    Args:
+        provider: Provider the backend talks to
+        config: Provider configuration (key, model, token limit, base URL)
+        client: HTTP client, normally the registry's shared async pool
+        poll: Polling schedule
+    """
+    max_requests = 50000
+    max_bytes = 100 * 1024 * 1024
+
+    def __init__(self, provider: Provider, config: ProviderConfig, client: httpx.AsyncClient,
+                 poll: Optional[PollBackoff] = None):
+        self.provider = provider
+        self.config = config
+        self.client = client
+        self.poll = poll or PollBackoff()
+        self.base_url = (config.base_url or DEFAULT_BASE_URLS[provider]).rstrip("/")
+        self.headers = auth_headers(provider, config.api_key)
+
+    @abc.abstractmethod
+    def pack(self, request: BatchRequest) -> dict:
+        """Provider-specific representation of one request"""
+
+    def _chunks(self, requests: Iterable[BatchRequest]) -> Iterator[List[dict]]:
+        """Split packed requests into batches within the provider's limits"""
+        chunk, size = [], 0
+        for request in requests:
+            packed = self.pack(request)
+            packed_size = len(json.dumps(packed)) + 1
+            if chunk and (len(chunk) >= self.max_requests or size + packed_size > self.max_bytes):
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(packed)
+            size += packed_size
+        if chunk:
+            yield chunk
+
+    async def submit(self, requests: Iterable[BatchRequest],
+                     on_submitted: Optional[Callable[[str, List[str]], None]] = None) -> List[str]:
+        """Submit requests as one or more batches
+
+        Args:
+            requests: Requests to submit
+            on_submitted: Called with each batch id and the custom ids it covers
+                as soon as the batch is created
+
+        Returns:
+            Batch ids in submission order
+        """
+        batch_ids = []
+        for chunk in self._chunks(requests):
+            batch_id = await self._create(chunk)
+            logger.info(f"Submitted {self.provider.value} batch {batch_id} with {len(chunk)} requests")
+            batch_ids.append(batch_id)
+            if on_submitted is not None:
+                on_submitted(batch_id, [line["custom_id"] for line in chunk])
+        return batch_ids
+
+    async def _request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        url = path if path.startswith("http") else f"{self.base_url}{path}"
+        response = await self.client.request(method, url, headers=self.headers, **kwargs)
+        response.raise_for_status()
+        return response
+
+    async def wait(self, batch_id: str) -> dict:
+        """Poll until the batch reaches a terminal state, backing off between polls
+
+        Transient errors (429, 5xx, timeouts) while polling are retried on the
+        same schedule.
+
+        Returns:
+            The final batch object
+        """
+        for interval in self.poll.intervals():
+            try:
+                batch = (await self._request("GET", self._status_path(batch_id))).json()
+                if self._finished(batch):
+                    return batch
+                logger.debug(f"{self.provider.value} batch {batch_id}: {self._progress(batch)}")
+            except httpx.HTTPError as e:
+                if not is_retryable(e):
+                    raise
+                logger.debug(f"Polling {self.provider.value} batch {batch_id} failed, retrying: {str(e)}")
+            await asyncio.sleep(interval)
+
+    async def results(self, batch_id: str) -> AsyncIterator[BatchItemResult]:
+        """Wait for a batch and stream its per-request results"""
+        batch = await self.wait(batch_id)
+        async for result in self._download(batch):
+            yield result
+
+    async def _stream_lines(self, path: str) -> AsyncIterator[dict]:
+        url = path if path.startswith("http") else f"{self.base_url}{path}"
+        async with self.client.stream("GET", url, headers=self.headers) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.strip():
+                    yield json.loads(line)
+
+    @abc.abstractmethod
+    async def cancel(self, batch_id: str):
+        """Ask the provider to stop processing a batch"""
+
+    @abc.abstractmethod
+    async def _create(self, chunk: List[dict]) -> str:
+        """Create one batch from packed requests and return its id"""
+
+    @abc.abstractmethod
+    def _status_path(self, batch_id: str) -> str:
+        """Path of the batch's status endpoint"""
+
+    @abc.abstractmethod
+    def _finished(self, batch: dict) -> bool:
+        """Whether the batch object is in a terminal state"""
+
+    @abc.abstractmethod
+    def _progress(self, batch: dict) -> str:
+        """Short progress summary for polling logs"""
+
+    @abc.abstractmethod
+    def _download(self, batch: dict) -> AsyncIterator[BatchItemResult]:
+        """Stream per-request results of a finished batch"""
+
+
+class OpenAIBatchBackend(NativeBatchBackend):
+    """OpenAI /files + /batches against the chat completions endpoint"""
+    max_requests = 50000
+    max_bytes = 200 * 1024 * 1024
+    endpoint = "/v1/chat/completions"
+
+    def pack(self, request: BatchRequest) -> dict:
+        system = [{"role": "system", "content": request.system}] if request.system else []
+        return {
+            "custom_id": request.custom_id,
+            "method": "POST",
+            "url": self.endpoint,
+            "body": {
+                "model": self.config.model,
+                "messages": system + request.messages,
+                "max_tokens": request.max_tokens or self.config.max_tokens,
+            },
+        }
+
+    async def _create(self, chunk: List[dict]) -> str:
+        payload = "".join(json.dumps(line) + "\n" for line in chunk).encode()
+        upload = await self._request(
+            "POST", "/files",
+            data={"purpose": "batch"},
+            files={"file": ("batch.jsonl", payload, "application/jsonl")}
+        )
+        batch = await self._request("POST", "/batches", json={
+            "input_file_id": upload.json()["id"],
+            "endpoint": self.endpoint,
+            "completion_window": "24h",
+        })
+        return batch.json()["id"]
+
+    async def cancel(self, batch_id: str):
+        await self._request("POST", f"/batches/{batch_id}/cancel")
+
+    def _status_path(self, batch_id: str) -> str:
+        return f"/batches/{batch_id}"
+
+    def _finished(self, batch: dict) -> bool:
+        return batch.get("status") in ("completed", "failed", "expired", "cancelled")
+
+    def _progress(self, batch: dict) -> str:
+        counts = batch.get("request_counts") or {}
+        return f"{batch.get('status')} ({counts.get('completed', 0)}/{counts.get('total', '?')})"
+
+    async def _download(self, batch: dict) -> AsyncIterator[BatchItemResult]:
+        if batch.get("status") == "failed" and not batch.get("output_file_id"):
+            errors = (batch.get("errors") or {}).get("data") or []
+            raise BatchFailed(f"Batch {batch['id']} failed: "
+                              + "; ".join(e.get("message", "") for e in errors))
+        for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+            if not file_id:
+                continue
+            async for line in self._stream_lines(f"/files/{file_id}/content"):
+                yield self._parse(line)
+
+    @staticmethod
+    def _parse(line: dict) -> BatchItemResult:
+        custom_id = line.get("custom_id")
+        if line.get("error"):
+            return BatchItemResult(custom_id, error=line["error"].get("message") or str(line["error"]))
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        if response.get("status_code") != 200:
+            message = (body.get("error") or {}).get("message") or f"HTTP {response.get('status_code')}"
+            return BatchItemResult(custom_id, error=message)
+        return BatchItemResult(
+            custom_id,
+            output=body["choices"][0]["message"]["content"],
+            usage={"prompt_tokens": (body.get("usage") or {}).get("prompt_tokens", 0),
+                   "completion_tokens": (body.get("usage") or {}).get("completion_tokens", 0)}
+        )
+
+
+class AnthropicBatchBackend(NativeBatchBackend):
+    """Anthropic Message Batches API"""
+    max_requests = 100000
+    max_bytes = 256 * 1024 * 1024
+
+    def pack(self, request: BatchRequest) -> dict:
+        params = {
+            "model": self.config.model,
+            "max_tokens": request.max_tokens or self.config.max_tokens,
+            "messages": request.messages,
+        }
+        if request.system:
+            # Batch requests can share a cached system prefix too
+            params["system"] = [{"type": "text", "text": request.system, "cache_control": {"type": "ephemeral"}}]
+        return {"custom_id": request.custom_id, "params": params}
+
+    async def _create(self, chunk: List[dict]) -> str:
+        batch = await self._request("POST", "/v1/messages/batches", json={"requests": chunk})
+        return batch.json()["id"]
+
+    async def cancel(self, batch_id: str):
+        await self._request("POST", f"/v1/messages/batches/{batch_id}/cancel")
+
+    def _status_path(self, batch_id: str) -> str:
+        return f"/v1/messages/batches/{batch_id}"
+
+    def _finished(self, batch: dict) -> bool:
+        return batch.get("processing_status") == "ended"
+
+    def _progress(self, batch: dict) -> str:
+        counts = batch.get("request_counts") or {}
+        return f"{batch.get('processing_status')} ({counts.get('processing', '?')} processing)"
+
+    async def _download(self, batch: dict) -> AsyncIterator[BatchItemResult]:
+        results_url = batch.get("results_url") or f"/v1/messages/batches/{batch['id']}/results"
+        async for line in self._stream_lines(results_url):
+            yield self._parse(line)
+
+    @staticmethod
+    def _parse(line: dict) -> BatchItemResult:
+        custom_id = line.get("custom_id")
+        result = line.get("result") or {}
+        if result.get("type") != "succeeded":
+            error = (result.get("error") or {}).get("error") or result.get("error") or {}
+            message = error.get("message") if isinstance(error, dict) else str(error)
+            return BatchItemResult(custom_id, error=message or f"Request {result.get('type', 'failed')}")
+        message = result["message"]
+        usage = message.get("usage") or {}
+        return BatchItemResult(
+            custom_id,
+            output="".join(block.get("text", "") for block in message.get("content", [])
+                           if block.get("type") == "text"),
+            usage={"prompt_tokens": usage.get("input_tokens", 0),
+                   "completion_tokens": usage.get("output_tokens", 0)}
+        )
+
+
+BACKENDS = {
+    Provider.OPENAI: OpenAIBatchBackend,
+    Provider.ANTHROPIC: AnthropicBatchBackend,
+}
+
+
+def batch_backend(provider: Provider, config: ProviderConfig, client: httpx.AsyncClient,
+                  poll: Optional[PollBackoff] = None) -> NativeBatchBackend:
+    """Create the batch backend for a provider
+
+    Raises:
+        ValueError: If the provider has no native batch API
+    """
+    if provider not in BACKENDS:
+        raise ValueError(f"{provider.value} has no native batch API")
+    return BACKENDS[provider](provider, config, client, poll)
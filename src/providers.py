@@ -0,0 +1,42 @@
+"""Provider identifiers and per-provider configuration"""
+from enum import Enum
+from typing import Dict, Optional
+
+ANTHROPIC_VERSION = "2023-06-01"
+
+
+class Provider(Enum):
+    OPENAI = "openai"
+    ANTHROPIC = "anthropic"
+    COHERE = "cohere"
+    # Local fake model for benchmarks and offline development (MOCK_PROVIDER=on)
+    MOCK = "mock"
+
+
+# Used when a provider has no base_url. Like the SDKs: OpenAI base URLs
+# include the version prefix, Anthropic's and Cohere's do not
+DEFAULT_BASE_URLS = {
+    Provider.OPENAI: "https://api.openai.com/v1",
+    Provider.ANTHROPIC: "https://api.anthropic.com",
+    Provider.COHERE: "https://api.cohere.com",
+}
+
+
+class ProviderConfig:
+    def __init__(self, api_key: str, model: str, max_tokens: int = 1000, history_tokens: int = 4000,
+                 base_url: Optional[str] = None, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None):
+        self.api_key = api_key
+        self.model = model
+        self.max_tokens = max_tokens
+        self.history_tokens = history_tokens
+        self.base_url = base_url
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+
+
+def auth_headers(provider: Provider, api_key: str) -> Dict[str, str]:
+    """Build the authentication headers for direct provider API calls"""
+    if provider == Provider.ANTHROPIC:
+        return {"x-api-key": api_key, "anthropic-version": ANTHROPIC_VERSION}
+    return {"Authorization": f"Bearer {api_key}"}
@@ -0,0 +1,204 @@
+"""Client-side rate limiting and retry scheduling per provider
+
+Each provider gets two token buckets (requests/min and tokens/min). Callers
+reserve capacity before sending, using a tiktoken estimate of the prompt plus
+the completion budget, and wait in FIFO order when the buckets are empty
+instead of overrunning the provider's quota. Retries use jittered
+exponential backoff and honour `Retry-After` on 429 responses, pausing the
+provider's limiter so queued requests wait too.
+"""
+import asyncio
+import email.utils
+import random
+import sys
+import time
+from typing import Dict, Optional
+
+import httpx
+
+from providers import Provider, ProviderConfig
+from router import is_rate_limit
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# SDK exceptions for failed connections and timeouts, checked once the SDK is loaded
+SDK_CONNECTION_ERRORS = (("openai", "APIConnectionError"), ("anthropic", "APIConnectionError"))
+
+
+class TokenBucket:
+    """Continuously refilling bucket
+
+    Args:
+        per_minute: Refill rate in units per minute
+        capacity: Maximum burst size, defaulting to one minute of refill
+    """
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self.available = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until `amount` units are available (requests above capacity wait for a full bucket)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+
+class ProviderRateLimiter:
+    """Requests/min and tokens/min limits for one provider with a fair FIFO queue
+
+    Args:
+        requests_per_minute: Request quota, or None for no request limit
+        tokens_per_minute: Token quota, or None for no token limit
+    """
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.paused_until = 0.0
+        self._queue = asyncio.Lock()
+        self.queue_depth = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def pause(self, seconds: float):
+        """Hold every queued request for `seconds` (e.g. after a Retry-After)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _delay(self, tokens: int) -> float:
+        delay = max(0.0, self.paused_until - time.monotonic())
+        if self.requests is not None:
+            delay = max(delay, self.requests.time_until(1))
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.time_until(tokens))
+        return delay
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """Wait for capacity for one request of `tokens` tokens
+
+        Waiters are served strictly in arrival order (asyncio.Lock is FIFO),
+        so a large request is never starved by a stream of small ones.
+
+        Returns:
+            Seconds spent waiting
+        """
+        start = time.monotonic()
+        self.queue_depth += 1
+        try:
+            async with self._queue:
+                delay = self._delay(tokens)
+                while delay > 0:
+                    await asyncio.sleep(delay)
+                    delay = self._delay(tokens)
+                if self.requests is not None:
+                    self.requests.consume(1)
+                if self.tokens is not None:
+                    self.tokens.consume(tokens)
+        finally:
+            self.queue_depth -= 1
+        waited = time.monotonic() - start
+        self.waits += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        return waited
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "queue_depth": self.queue_depth,
+            "requests": self.waits,
+            "avg_wait": self.total_wait / self.waits if self.waits else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Read a Retry-After (seconds or HTTP date) or retry-after-ms header from an error"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+def connection_errors() -> tuple:
+    """Exception types for failed connections and timeouts"""
+    errors = [httpx.TransportError, ConnectionError, TimeoutError, asyncio.TimeoutError]
+    for module_name, name in SDK_CONNECTION_ERRORS:
+        error = getattr(sys.modules.get(module_name), name, None)
+        if error is not None:
+            errors.append(error)
+    return tuple(errors)
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether an error is worth retrying (rate limits, timeouts, 5xx, connection errors)"""
+    if is_rate_limit(error):
+        return True
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(error, connection_errors())
+
+
+class RetryScheduler:
+    """Jittered exponential backoff that honours Retry-After
+
+    Args:
+        max_retries: Retries after the first attempt
+        base_delay: Backoff for the first retry in seconds
+        max_delay: Upper bound for any single backoff
+    """
+    def __init__(self, max_retries: int = 3, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+
+    def should_retry(self, attempt: int, error: Exception) -> bool:
+        return attempt < self.max_retries and is_retryable(error)
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        """Backoff before retry number `attempt + 1` (full jitter unless the server said when)"""
+        server_delay = retry_after(error)
+        if server_delay is not None:
+            return min(server_delay, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+def build_rate_limiters(providers: Dict[Provider, ProviderConfig]) -> Dict[Provider, ProviderRateLimiter]:
+    """Create a limiter for every provider (unlimited buckets when no quota is configured)"""
+    return {
+        provider: ProviderRateLimiter(config.requests_per_minute, config.tokens_per_minute)
+        for provider, config in providers.items()
+    }
@@ -0,0 +1,398 @@
+"""Long-term recall over past conversation turns
+
+Every completed turn (user message and reply) is embedded and appended to an
+on-disk index shared by all sessions. Before each turn the most similar past
+turns are looked up and sent to the model as reference excerpts, so material
+from weeks ago is available without keeping it in the prompt window. By
+default only the session's own turns are recalled; scope "all" shares every
+session's turns with every other session, which suits a single user only.
+
+Storage, under RECALL_PATH:
+
+    - vectors.f32: float32 rows, append-only and memory-mapped for search, so
+      the index is not loaded into RAM and opening it is instant
+    - snippets.db: SQLite table of (id, session_id, seq, text), where id is
+      the vector's row number
+    - index.faiss / index.hnsw: optional ANN graph (FAISS or hnswlib), kept
+      in sync incrementally with the vector file and rebuilt from it if lost
+
+Without FAISS or hnswlib, search is an exact brute-force scan of the
+memory-mapped vectors in chunks with numpy. Embeddings come from a local
+sentence-transformers model when RECALL_EMBEDDER names one, otherwise from
+hashed character n-grams, which need no model download or network access.
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from paths import DATA_DIR
+from response_cache import hashed_ngram_embedding
+
+RECALL_PREFIX = "Relevant excerpts from earlier conversations (for reference only):\n"
+
+# Rows scored per step of the brute-force scan
+SCAN_CHUNK_ROWS = 65536
+
+# Hashed n-gram cosine between unrelated English turns reaches ~0.4 (median
+# ~0.3), while a question about an earlier turn usually scores 0.45 or more
+DEFAULT_MIN_SCORE = 0.42
+
+
+class Snippet:
+    """One recalled past turn"""
+    def __init__(self, id: int, session_id: str, seq: int, text: str, score: float):
+        self.id = id
+        self.session_id = session_id
+        self.seq = seq
+        self.text = text
+        self.score = score
+
+
+def build_embedder(spec: str, dim: int) -> Tuple[Callable[[str], "object"], int]:
+    """Resolve RECALL_EMBEDDER to an embedding function and its dimension
+
+    Args:
+        spec: "ngram" or "sentence-transformers:<model name>"
+        dim: Dimension of hashed n-gram vectors
+
+    Returns:
+        (embed, dim), where embed maps text to an L2-normalized float32 vector
+    """
+    if spec.startswith("sentence-transformers:"):
+        try:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(spec.split(":", 1)[1])
+            return (lambda text: model.encode(text, normalize_embeddings=True).astype("float32"),
+                    model.get_sentence_embedding_dimension())
+        except ImportError:
+            logger.warning("sentence-transformers is not installed, using hashed n-gram embeddings")
+    return (lambda text: hashed_ngram_embedding(text, dim)), dim
+
+
+class NumpyIndex:
+    """Exact inner-product search over the memory-mapped vector file"""
+    name = "numpy"
+
+    def __init__(self, store: "RecallStore"):
+        self.store = store
+
+    def add(self, start: int, vectors):
+        pass
+
+    def search(self, query, k: int) -> Tuple[List[int], List[float]]:
+        import numpy as np
+        vectors = self.store.vectors()
+        if vectors is None or not len(vectors):
+            return [], []
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(vectors), SCAN_CHUNK_ROWS):
+            scores = vectors[start:start + SCAN_CHUNK_ROWS] @ query
+            top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+            best_ids = np.concatenate([best_ids, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_ids) > k:
+                keep = np.argpartition(-best_scores, k - 1)[:k]
+                best_ids, best_scores = best_ids[keep], best_scores[keep]
+        order = np.argsort(-best_scores)
+        return best_ids[order].tolist(), best_scores[order].tolist()
+
+    def save(self):
+        pass
+
+
+class HnswlibIndex:
+    """hnswlib HNSW graph over the vectors, grown incrementally"""
+    name = "hnswlib"
+
+    def __init__(self, store: "RecallStore", ef: int = 64, m: int = 16):
+        import hnswlib
+        self.store = store
+        self.path = os.path.join(store.path, "index.hnsw")
+        self.index = hnswlib.Index(space="ip", dim=store.dim)
+        capacity = max(1024, store.count * 2)
+        if os.path.exists(self.path):
+            self.index.load_index(self.path, max_elements=capacity)
+        else:
+            self.index.init_index(max_elements=capacity, ef_construction=200, M=m)
+        self.index.set_ef(ef)
+        indexed = self.index.get_current_count()
+        if indexed < store.count:
+            self.add(indexed, store.vectors()[indexed:])
+
+    def add(self, start: int, vectors):
+        import numpy as np
+        needed = start + len(vectors)
+        if needed > self.index.get_max_elements():
+            self.index.resize_index(max(needed, self.index.get_max_elements() * 2))
+        self.index.add_items(np.asarray(vectors), np.arange(start, needed))
+
+    def search(self, query, k: int) -> Tuple[List[int], List[float]]:
+        count = self.index.get_current_count()
+        if not count:
+            return [], []
+        labels, distances = self.index.knn_query(query.reshape(1, -1), k=min(k, count))
+        # Inner-product space reports 1 - similarity
+        return labels[0].tolist(), (1.0 - distances[0]).tolist()
+
+    def save(self):
+        self.index.save_index(self.path)
+
+
+class FaissIndex:
+    """FAISS HNSW graph over the vectors, grown incrementally"""
+    name = "faiss"
+
+    def __init__(self, store: "RecallStore", ef: int = 64, m: int = 32):
+        import faiss
+        self.faiss = faiss
+        self.store = store
+        self.path = os.path.join(store.path, "index.faiss")
+        if os.path.exists(self.path):
+            self.index = faiss.read_index(self.path)
+        else:
+            self.index = faiss.IndexHNSWFlat(store.dim, m, faiss.METRIC_INNER_PRODUCT)
+        self.index.hnsw.efSearch = ef
+        if self.index.ntotal < store.count:
+            self.add(self.index.ntotal, store.vectors()[self.index.ntotal:])
+
+    def add(self, start: int, vectors):
+        import numpy as np
+        self.index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+
+    def search(self, query, k: int) -> Tuple[List[int], List[float]]:
+        if not self.index.ntotal:
+            return [], []
+        scores, ids = self.index.search(query.reshape(1, -1), k)
+        return [i for i in ids[0].tolist() if i >= 0], scores[0].tolist()
+
+    def save(self):
+        self.faiss.write_index(self.index, self.path)
+
+
+INDEXES = {"faiss": FaissIndex, "hnswlib": HnswlibIndex, "numpy": NumpyIndex}
+
+
+class RecallStore:
+    """Append-only store of embedded past turns with nearest-neighbour search
+
+    Args:
+        path: Directory holding the vector file, snippet database and index
+        embed: Function mapping text to an L2-normalized float32 vector
+        dim: Vector dimension produced by `embed`
+        backend: "auto" (FAISS, then hnswlib, then numpy), or one of those
+        min_score: Similarity below which a neighbour is not recalled
+        scope: "session" to recall the current session's turns only, "all"
+            to recall across every session
+    """
+    def __init__(self, path: str, embed: Callable[[str], "object"], dim: int, backend: str = "auto",
+                 min_score: float = DEFAULT_MIN_SCORE, scope: str = "session"):
+        if scope not in ("session", "all"):
+            raise ValueError(f"Unknown recall scope '{scope}' (choose from session, all)")
+        import numpy  # noqa: F401 - fail early if numpy is missing
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.embed = embed
+        self.dim = dim
+        self.min_score = min_score
+        self.scope = scope
+        self.vector_path = os.path.join(path, "vectors.f32")
+        self.row_bytes = dim * 4
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(os.path.join(path, "snippets.db"), check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS snippets (id INTEGER PRIMARY KEY, session_id TEXT NOT NULL, "
+            "seq INTEGER NOT NULL, text TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS snippets_session ON snippets (session_id, seq)")
+        self.count = self._recover()
+        self._mapped = None
+        self._last_seq = {}
+        self.searches = 0
+        self.search_seconds = 0.0
+        self.index = self._open_index(backend)
+        logger.debug(f"Recall store at {path}: {self.count} turns, {self.index.name} index")
+
+    @classmethod
+    def from_env(cls) -> Optional["RecallStore"]:
+        """Build from RECALL_* settings, or None when RECALL is off or numpy is missing"""
+        if os.getenv("RECALL", "on").strip().lower() in ("off", "0", "false", "no"):
+            return None
+        embed, dim = build_embedder(os.getenv("RECALL_EMBEDDER", "ngram"), int(os.getenv("RECALL_DIM", "256")))
+        try:
+            return cls(
+                os.getenv("RECALL_PATH", os.path.join(DATA_DIR, "recall")),
+                embed, dim,
+                backend=os.getenv("RECALL_INDEX", "auto").strip().lower(),
+                min_score=float(os.getenv("RECALL_MIN_SCORE", str(DEFAULT_MIN_SCORE))),
+                scope=os.getenv("RECALL_SCOPE", "session").strip().lower()
+            )
+        except ImportError:
+            logger.warning("numpy is not installed, long-term recall disabled")
+            return None
+
+    def _recover(self) -> int:
+        """Make the vector file and the snippet table agree after a crash
+
+        Vectors are written before their rows, so the file can only be ahead.
+        """
+        rows = self._conn.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM snippets").fetchone()[0]
+        vectors = os.path.getsize(self.vector_path) // self.row_bytes if os.path.exists(self.vector_path) else 0
+        if vectors != rows:
+            logger.warning(f"Recall index has {vectors} vectors for {rows} snippets, repairing")
+            count = min(vectors, rows)
+            with open(self.vector_path, "ab"):
+                pass
+            os.truncate(self.vector_path, count * self.row_bytes)
+            self._conn.execute("DELETE FROM snippets WHERE id >= ?", (count,))
+            return count
+        return rows
+
+    def _open_index(self, backend: str):
+        names = ["faiss", "hnswlib", "numpy"] if backend == "auto" else [backend, "numpy"]
+        for name in names:
+            try:
+                return INDEXES[name](self)
+            except ImportError:
+                if backend != "auto":
+                    logger.warning(f"{name} is not installed, using exact numpy search")
+            except KeyError:
+                logger.warning(f"Unknown RECALL_INDEX '{name}', using exact numpy search")
+        return NumpyIndex(self)
+
+    def vectors(self):
+        """Memory-mapped view of every stored vector"""
+        import numpy as np
+        with self._lock:
+            if self._mapped is None or len(self._mapped) != self.count:
+                self._mapped = np.memmap(self.vector_path, dtype=np.float32, mode="r",
+                                         shape=(self.count, self.dim)) if self.count else None
+            return self._mapped
+
+    def last_seq(self, session_id: str) -> int:
+        seq = self._last_seq.get(session_id)
+        if seq is None:
+            with self._lock:
+                seq = self._conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM snippets WHERE session_id = ?", (session_id,)
+                ).fetchone()[0]
+            self._last_seq[session_id] = seq
+        return seq
+
+    def add(self, session_id: str, text: str) -> int:
+        """Embed and store one turn; returns its id"""
+        return self.add_vectors([(session_id, text)], self.embed(text).reshape(1, -1))[0]
+
+    def add_vectors(self, entries: Sequence[Tuple[str, str]], vectors) -> List[int]:
+        """Store pre-embedded turns in bulk
+
+        Args:
+            entries: (session_id, text) per row
+            vectors: Matching float32 array of shape (len(entries), dim)
+
+        Returns:
+            The new rows' ids
+        """
+        import numpy as np
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            start = self.count
+            with open(self.vector_path, "ab") as f:
+                f.write(vectors.tobytes())
+            rows = []
+            for offset, (session_id, text) in enumerate(entries):
+                seq = self.last_seq(session_id) + 1
+                self._last_seq[session_id] = seq
+                rows.append((start + offset, session_id, seq, text, now))
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT INTO snippets (id, session_id, seq, text, created_at) VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.execute("COMMIT")
+            self.count += len(rows)
+            self.index.add(start, vectors)
+        return [row[0] for row in rows]
+
+    def search(self, text: str, k: int = 3, session_id: Optional[str] = None, recent: int = 0) -> List[Snippet]:
+        """Find the stored turns most similar to `text`
+
+        Args:
+            text: Query, normally the user's new message
+            k: Maximum snippets to return
+            session_id: Session asking; its newest `recent` turns (still in
+                its prompt window) are skipped, and with scope "session" only
+                its own turns are searched
+            recent: Number of the session's newest turns to skip
+        """
+        if not self.count or k <= 0:
+            return []
+        started = time.perf_counter()
+        query = self.embed(text)
+        cutoff = self.last_seq(session_id) - recent if session_id else None
+        if self.scope == "session" and session_id is not None:
+            ids, scores = self._search_session(query, session_id, cutoff, k)
+        else:
+            # Over-fetch so filtered neighbours can be replaced
+            with self._lock:
+                ids, scores = self.index.search(query, k * 4 + recent)
+        results = []
+        if ids:
+            placeholders = ",".join("?" * len(ids))
+            with self._lock:
+                rows = {row[0]: row for row in self._conn.execute(
+                    f"SELECT id, session_id, seq, text FROM snippets WHERE id IN ({placeholders})", ids)}
+            for id, score in zip(ids, scores):
+                row = rows.get(id)
+                if row is None or score < self.min_score:
+                    continue
+                if session_id is not None:
+                    same_session = row[1] == session_id
+                    if (same_session and row[2] > cutoff) or (self.scope == "session" and not same_session):
+                        continue
+                results.append(Snippet(id, row[1], row[2], row[3], float(score)))
+                if len(results) >= k:
+                    break
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - started
+        return results
+
+    def _search_session(self, query, session_id: str, cutoff: int, k: int) -> Tuple[List[int], List[float]]:
+        """Exact search over one session's turns up to `cutoff`
+
+        A session holds few turns next to the whole index, so scoring its
+        rows directly is cheap and, unlike filtering a global top-k, never
+        misses them.
+        """
+        import numpy as np
+        vectors = self.vectors()
+        if vectors is None:
+            return [], []
+        with self._lock:
+            ids = np.array([row[0] for row in self._conn.execute(
+                "SELECT id FROM snippets WHERE session_id = ? AND seq <= ?", (session_id, cutoff))], dtype=np.int64)
+        ids = ids[ids < len(vectors)]
+        if not len(ids):
+            return [], []
+        scores = vectors[ids] @ query
+        top = np.argsort(-scores)[:k]
+        return ids[top].tolist(), scores[top].tolist()
+
+    @staticmethod
+    def format(snippets: Sequence[Snippet]) -> str:
+        """Render recalled snippets as a block to put ahead of the user's message"""
+        if not snippets:
+            return ""
+        return RECALL_PREFIX + "\n---\n".join(snippet.text for snippet in snippets) + "\n\n"
+
+    def close(self):
+        with self._lock:
+            self.index.save()
+            self._mapped = None
+            self._conn.close()
@@ -0,0 +1,204 @@
+"""Structured, low-overhead request logging for debug mode
+
+Each LLM request produces a single JSON record instead of dozens of log lines.
+Records are built lazily (only when a sink accepts the level), secrets are
+redacted, prompt and response payloads are truncated and can be sampled, and
+the file sink uses loguru's `enqueue=True` so serialization to disk happens on
+a background thread rather than in the request path.
+"""
+import json
+import os
+import random
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from loguru import logger
+
+from providers import Provider
+
+REQUEST_LOG_KEY = "request_log"
+DEFAULT_LOG_PATH = "logs/requests.jsonl"
+DEFAULT_PAYLOAD_CHARS = 2000
+REDACTED = "[REDACTED]"
+
+SECRET_PATTERNS = re.compile(
+    r"(sk-[A-Za-z0-9_\-]{8,}"
+    r"|Bearer\s+[A-Za-z0-9._\-]+"
+    r"|(?<=[\"'\s])(?:api[_-]?key|token|secret|password)[\"']?\s*[:=]\s*[\"']?[^\s\"',}]+)",
+    re.IGNORECASE
+)
+# Cheap substring checks that let most payloads skip the regex scan
+SECRET_HINTS = ("sk-", "bearer", "key", "token", "secret", "password")
+
+
+def configured_secrets(environ: Optional[Dict[str, str]] = None) -> List[str]:
+    """Values of environment variables that look like credentials"""
+    environ = os.environ if environ is None else environ
+    markers = ("KEY", "TOKEN", "SECRET", "PASSWORD")
+    return [value for name, value in environ.items()
+            if value and len(value) >= 8 and any(marker in name.upper() for marker in markers)]
+
+
+def redact(text: str, secrets: Iterable[str] = ()) -> str:
+    """Mask known secret values and anything shaped like an API key or bearer token"""
+    for secret in secrets:
+        if secret in text:
+            text = text.replace(secret, REDACTED)
+    lowered = text.lower()
+    if not any(hint in lowered for hint in SECRET_HINTS):
+        return text
+    return SECRET_PATTERNS.sub(REDACTED, text)
+
+
+def truncate(text: str, limit: int) -> str:
+    """Cut text to `limit` characters, noting how much was dropped"""
+    if limit <= 0 or len(text) <= limit:
+        return text
+    return f"{text[:limit]}...[{len(text) - limit} chars truncated]"
+
+
+def add_request_sink(path: str = DEFAULT_LOG_PATH, level: str = "DEBUG") -> int:
+    """Write request records as JSON lines through a background writer
+
+    Returns:
+        The loguru handler id
+    """
+    return logger.add(
+        path,
+        level=level,
+        format="{message}",
+        filter=lambda record: REQUEST_LOG_KEY in record["extra"],
+        enqueue=True,
+        rotation="10 MB",
+        retention="7 days"
+    )
+
+
+def exclude_requests(record) -> bool:
+    """Sink filter that keeps request records out of the human-readable logs"""
+    return REQUEST_LOG_KEY not in record["extra"]
+
+
+class DebugCallbackHandler(BaseCallbackHandler):
+    """Emit one structured record per LLM request
+
+    Start-of-request data is only captured by reference; the record is
+    assembled, serialized and redacted when the request finishes, and only if
+    a sink accepts DEBUG records.
+
+    Args:
+        provider: Provider whose model this handler is attached to
+        payload_chars: Maximum characters kept from prompts and responses
+        sample_rate: Fraction of requests whose payloads are recorded
+            (metadata such as latency and token usage is always recorded)
+        secrets: Secret values to redact, defaulting to credential-like
+            environment variables
+    """
+    def __init__(self, provider: Optional[Provider] = None,
+                 payload_chars: int = DEFAULT_PAYLOAD_CHARS, sample_rate: float = 1.0,
+                 secrets: Optional[Iterable[str]] = None):
+        self.provider = provider
+        self.payload_chars = payload_chars
+        self.sample_rate = sample_rate
+        self.secrets = list(configured_secrets() if secrets is None else secrets)
+        self._runs: Dict[Any, dict] = {}
+        self._log = logger.bind(**{REQUEST_LOG_KEY: True}).opt(lazy=True)
+
+    @classmethod
+    def from_env(cls, provider: Optional[Provider] = None) -> "DebugCallbackHandler":
+        """Build a handler from DEBUG_LOG_PAYLOAD_CHARS and DEBUG_LOG_SAMPLE_RATE"""
+        return cls(
+            provider,
+            payload_chars=int(os.getenv("DEBUG_LOG_PAYLOAD_CHARS", str(DEFAULT_PAYLOAD_CHARS))),
+            sample_rate=float(os.getenv("DEBUG_LOG_SAMPLE_RATE", "1.0"))
+        )
+
+    def set_provider(self, provider: Provider):
+        """Set the current provider for provider-specific logging"""
+        self.provider = provider
+
+    def _start(self, run_id, prompt, kwargs: dict):
+        self._runs[run_id] = {
+            "started": time.perf_counter(),
+            "prompt": prompt,
+            "params": kwargs.get("invocation_params") or {},
+            "sampled": random.random() < self.sample_rate,
+        }
+
+    def on_llm_start(self, serialized, prompts, *, run_id=None, **kwargs):
+        self._start(run_id, prompts, kwargs)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id=None, **kwargs):
+        self._start(run_id, messages, kwargs)
+
+    def on_llm_end(self, response, *, run_id=None, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            elapsed = time.perf_counter() - run["started"]
+            self._log.debug("{}", lambda: self._render(run, elapsed, response=response))
+
+    def on_llm_error(self, error, *, run_id=None, **kwargs):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            elapsed = time.perf_counter() - run["started"]
+            self._log.debug("{}", lambda: self._render(run, elapsed, error=error))
+
+    def _render(self, run: dict, elapsed: float, response=None, error: Optional[Exception] = None) -> str:
+        params = run["params"]
+        record = {
+            "event": "llm_request",
+            "provider": self.provider.value if self.provider else None,
+            "model": params.get("model_name") or params.get("model"),
+            "temperature": params.get("temperature"),
+            "max_tokens": params.get("max_tokens") or params.get("max_tokens_to_sample"),
+            "latency_ms": round(elapsed * 1000, 1),
+            "status": "error" if error is not None else "ok",
+        }
+        prompt = _payload_text(run["prompt"])
+        record["prompt_chars"] = len(prompt)
+        if response is not None:
+            output = _response_text(response)
+            record["output_chars"] = len(output)
+            record["usage"] = _usage(response)
+        if error is not None:
+            status = getattr(getattr(error, "response", None), "status_code", None)
+            record["error"] = {
+                "type": type(error).__name__,
+                "status": status,
+                "message": truncate(redact(str(error), self.secrets), self.payload_chars),
+            }
+        if run["sampled"]:
+            # Redact before truncating so a secret cut at the boundary cannot slip through
+            record["prompt"] = truncate(redact(prompt, self.secrets), self.payload_chars)
+            if response is not None:
+                record["output"] = truncate(redact(output, self.secrets), self.payload_chars)
+        return json.dumps(record, default=str)
+
+
+def _payload_text(prompt) -> str:
+    if isinstance(prompt, list):
+        parts = []
+        for item in prompt:
+            for message in (item if isinstance(item, list) else [item]):
+                content = getattr(message, "content", message)
+                parts.append(f"{getattr(message, 'type', 'text')}: {content}")
+        return "\n".join(parts)
+    return str(prompt)
+
+
+def _response_text(response) -> str:
+    return "".join(generation.text for generations in response.generations for generation in generations)
+
+
+def _usage(response) -> Optional[dict]:
+    usage = (response.llm_output or {}).get("token_usage") or (response.llm_output or {}).get("usage")
+    if usage:
+        return dict(usage)
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return dict(metadata)
+    return None
@@ -0,0 +1,398 @@
+"""Response cache in front of the conversation chain
+
+Replies are keyed on (provider, model, temperature, hash of the normalized
+rendered prompt). The rendered prompt already contains the history window, so
+the key covers both the input and the history it was asked in.
+
+Lookups go through three tiers:
+    1. An in-memory LRU with TTL and size limits
+    2. An on-disk SQLite tier with TTL and size-based eviction
+    3. An optional similarity tier over local embeddings (needs numpy)
+
+The similarity tier only embeds the new question. Everything sent ahead of
+it (system prompt, summary, history, recalled excerpts) must match exactly,
+so a reworded question can reuse an answer given in the same context, but a
+different question in the same conversation never matches on the shared
+history.
+
+The cache is inserted into the chain as a runnable wrapped around the chat
+model, so invoke, stream and their async variants all go through it.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.messages import AIMessageChunk
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableGenerator
+from loguru import logger
+
+from paths import DATA_DIR
+from providers import Provider
+from tokens import prompt_text
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(text: str) -> str:
+    """Collapse whitespace so formatting-only differences share a cache entry"""
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def split_prompt(prompt, question: Optional[str] = None) -> Tuple[str, str]:
+    """Split a prompt into (context, question), both normalized
+
+    Args:
+        prompt: Prompt value, message list or string
+        question: The user's raw input, when known; text the newest message
+            carries ahead of it (e.g. recalled excerpts) counts as context
+
+    Returns:
+        Everything sent ahead of the question, and the question
+    """
+    messages = prompt.to_messages() if hasattr(prompt, "to_messages") else prompt
+    if isinstance(messages, str) or not messages:
+        return "", normalize_prompt(str(messages or ""))
+    last = messages[-1]
+    text = last.content if isinstance(last.content, str) else str(last.content)
+    head = ""
+    if question and text.endswith(question):
+        head, text = text[:-len(question)], question
+    context = prompt_text(list(messages[:-1])) + f"\n{last.type}: {head}"
+    return normalize_prompt(context), normalize_prompt(text)
+
+
+class MemoryTier:
+    """LRU cache with per-entry TTL and entry/byte limits"""
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str, ttl: float):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.time() + ttl)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value.encode("utf-8"))
+
+
+class DiskTier:
+    """SQLite-backed cache tier evicting least recently used rows past a byte limit"""
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at, size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at, size = row
+            if expires_at < now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._bytes -= size
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            return value
+
+    def put(self, key: str, value: str, ttl: float):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._bytes -= row[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)", (key, value, size, now + ttl, now)
+            )
+            self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        """Drop expired rows, then least recently used rows, until under the limit"""
+        self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        while self._bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", [(k,) for k, _ in rows])
+            self._bytes -= sum(size for _, size in rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def hashed_ngram_embedding(text: str, dim: int = 512, n: int = 3):
+    """Embed text as an L2-normalized bag of hashed character n-grams
+
+    Needs no model download or network access.
+    """
+    import numpy as np
+    vector = np.zeros(dim, dtype=np.float32)
+    text = f" {text.lower()} "
+    for i in range(max(1, len(text) - n + 1)):
+        digest = hashlib.blake2b(text[i:i + n].encode("utf-8"), digest_size=8).digest()
+        vector[int.from_bytes(digest, "little") % dim] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class SemanticTier:
+    """Nearest-neighbour lookup over embeddings of previously answered questions
+
+    Entries are scoped by the caller, to the model settings and the exact
+    context the question was asked in, so a reply is only reused for the same
+    model and conversation state. `max_entries` bounds all scopes together;
+    the least recently used scope loses its oldest entries first.
+    """
+    def __init__(self, threshold: float, max_entries: int,
+                 embed: Callable[[str], "object"] = hashed_ngram_embedding):
+        import numpy  # noqa: F401 - fail early if numpy is missing
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.embed = embed
+        self._entries: "OrderedDict[str, List[Tuple[object, str, float]]]" = OrderedDict()
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def get(self, scope: str, text: str) -> Optional[str]:
+        if scope not in self._entries:
+            return None
+        query = self.embed(text)
+        now = time.time()
+        best_score, best_value = 0.0, None
+        with self._lock:
+            for vector, value, expires_at in self._entries.get(scope, ()):
+                if expires_at < now:
+                    continue
+                score = float(vector @ query)
+                if score > best_score:
+                    best_score, best_value = score, value
+        return best_value if best_score >= self.threshold else None
+
+    def put(self, scope: str, text: str, value: str, ttl: float):
+        vector = self.embed(text)
+        with self._lock:
+            entries = self._entries.setdefault(scope, [])
+            self._entries.move_to_end(scope)
+            entries.append((vector, value, time.time() + ttl))
+            self._count += 1
+            while self._count > self.max_entries:
+                oldest_scope, oldest = next(iter(self._entries.items()))
+                oldest.pop(0)
+                self._count -= 1
+                if not oldest:
+                    del self._entries[oldest_scope]
+
+
+class ResponseCache:
+    """Tiered response cache with hit/miss/bytes-saved counters
+
+    Args:
+        ttl: Seconds a cached reply stays valid
+        max_entries: Entry limit for the in-memory tier
+        max_memory_bytes: Byte limit for the in-memory tier
+        disk_path: SQLite file for the on-disk tier, or None to disable it
+        max_disk_bytes: Byte limit for the on-disk tier
+        semantic_threshold: Cosine similarity needed for a similarity hit,
+            or None to disable the similarity tier
+    """
+    def __init__(self, ttl: float = 3600.0, max_entries: int = 1000,
+                 max_memory_bytes: int = 16 * 1024 * 1024,
+                 disk_path: Optional[str] = None, max_disk_bytes: int = 64 * 1024 * 1024,
+                 semantic_threshold: Optional[float] = None):
+        self.ttl = ttl
+        self.memory = MemoryTier(max_entries, max_memory_bytes)
+        self.disk = DiskTier(disk_path, max_disk_bytes) if disk_path else None
+        self.semantic = None
+        if semantic_threshold is not None:
+            try:
+                self.semantic = SemanticTier(semantic_threshold, max_entries)
+            except ImportError:
+                logger.warning("numpy is not installed, semantic response cache disabled")
+        self.counters = {"hits": 0, "memory_hits": 0, "disk_hits": 0,
+                         "semantic_hits": 0, "misses": 0, "bytes_saved": 0}
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """Build a cache from RESPONSE_CACHE_* settings, or None if disabled"""
+        if os.getenv("RESPONSE_CACHE", "on").strip().lower() in ("off", "0", "false", "no"):
+            return None
+        disk_path = os.getenv("RESPONSE_CACHE_PATH", os.path.join(DATA_DIR, "response_cache.db"))
+        threshold = os.getenv("RESPONSE_CACHE_SEMANTIC_THRESHOLD")
+        return cls(
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+            disk_path=disk_path or None,
+            max_disk_bytes=int(float(os.getenv("RESPONSE_CACHE_DISK_MB", "64")) * 1024 * 1024),
+            semantic_threshold=float(threshold) if threshold else None
+        )
+
+    @staticmethod
+    def make_scope(provider: Provider, model: str, temperature: Optional[float]) -> str:
+        return json.dumps([provider.value, model, temperature])
+
+    @staticmethod
+    def make_key(scope: str, normalized_prompt: str) -> str:
+        return hashlib.sha256(f"{scope}\n{normalized_prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, scope: str, normalized_prompt: str, context: Optional[str] = None,
+               question: Optional[str] = None) -> Optional[str]:
+        """Find a cached reply, promoting disk and similarity hits to memory
+
+        Args:
+            scope: Model settings from `make_scope`
+            normalized_prompt: The whole prompt, for exact matches
+            context: Normalized text sent ahead of the question (from
+                `split_prompt`); similarity matches need it to be identical
+            question: Normalized question compared by similarity, or None to
+                skip the similarity tier
+        """
+        key = self.make_key(scope, normalized_prompt)
+        value = self.memory.get(key)
+        tier = "memory_hits"
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            tier = "disk_hits"
+        if value is None and self.semantic is not None and question:
+            value = self.semantic.get(self.make_key(scope, context or ""), question)
+            tier = "semantic_hits"
+        if value is None:
+            self.counters["misses"] += 1
+            return None
+        if tier != "memory_hits":
+            self.memory.put(key, value, self.ttl)
+        self.counters["hits"] += 1
+        self.counters[tier] += 1
+        self.counters["bytes_saved"] += len(value.encode("utf-8"))
+        return value
+
+    def update(self, scope: str, normalized_prompt: str, value: str, context: Optional[str] = None,
+               question: Optional[str] = None):
+        """Store a reply in every enabled tier (the similarity tier only when `question` is given)"""
+        if not value:
+            return
+        key = self.make_key(scope, normalized_prompt)
+        self.memory.put(key, value, self.ttl)
+        if self.disk is not None:
+            self.disk.put(key, value, self.ttl)
+        if self.semantic is not None and question:
+            self.semantic.put(self.make_key(scope, context or ""), question, value, self.ttl)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters)
+
+    def wrap(self, llm: Runnable, provider: Provider, model: str, temperature: Optional[float]) -> Runnable:
+        """Put the cache in front of a chat model
+
+        Args:
+            llm: Chat model (or runnable wrapping one) to call on a miss
+            provider: Provider the model belongs to
+            model: Model name used in the cache key
+            temperature: Sampling temperature used in the cache key
+
+        Returns:
+            A runnable taking a prompt and producing message chunks
+        """
+        scope = self.make_scope(provider, model, temperature)
+
+        def _keys(prompt, config: RunnableConfig) -> Tuple[str, str, str]:
+            """(normalized prompt, context, question); the engine passes the raw input as `input`"""
+            context, question = split_prompt(prompt, (config or {}).get("configurable", {}).get("input"))
+            return normalize_prompt(prompt_text(prompt)), context, question
+
+        # A reply asking for tool calls is not an answer to the prompt, so it is never stored
+        def transform(inputs: Iterator, config: RunnableConfig) -> Iterator[AIMessageChunk]:
+            prompt = None
+            for prompt in inputs:
+                pass
+            normalized, context, question = _keys(prompt, config)
+            cached = self.lookup(scope, normalized, context, question)
+            if cached is not None:
+                yield AIMessageChunk(content=cached)
+                return
+            parts = []
+            calls_tools = False
+            for chunk in llm.stream(prompt, config=config):
+                if isinstance(chunk.content, str):
+                    parts.append(chunk.content)
+                calls_tools = calls_tools or bool(getattr(chunk, "tool_call_chunks", None))
+                yield chunk
+            if not calls_tools:
+                self.update(scope, normalized, "".join(parts), context, question)
+
+        async def atransform(inputs: AsyncIterator, config: RunnableConfig) -> AsyncIterator[AIMessageChunk]:
+            prompt = None
+            async for prompt in inputs:
+                pass
+            normalized, context, question = _keys(prompt, config)
+            cached = self.lookup(scope, normalized, context, question)
+            if cached is not None:
+                yield AIMessageChunk(content=cached)
+                return
+            parts = []
+            calls_tools = False
+            async for chunk in llm.astream(prompt, config=config):
+                if isinstance(chunk.content, str):
+                    parts.append(chunk.content)
+                calls_tools = calls_tools or bool(getattr(chunk, "tool_call_chunks", None))
+                yield chunk
+            if not calls_tools:
+                self.update(scope, normalized, "".join(parts), context, question)
+
+        return RunnableGenerator(transform, atransform, name="ResponseCache")
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
@@ -0,0 +1,347 @@
+"""Latency-aware provider routing with circuit breakers and optional hedging
+
+The router keeps rolling statistics per provider (EWMA latency, EWMA error
+rate, recent 429s and a window of time-to-first-token samples) and ranks
+providers by score for every request. Each provider has a circuit breaker
+that opens after repeated failures and lets a single half-open probe through
+once its cool-down has passed.
+
+With hedging enabled, a request that has not produced its first token by the
+primary provider's p95 time-to-first-token is duplicated to the runner-up;
+whichever stream starts first is kept and the other is cancelled.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Dict, List, Optional
+
+from loguru import logger
+
+from providers import Provider
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Score penalties (in seconds of equivalent latency): errors scale the latency
+# and add a flat cost so providers that never succeeded still rank low; each
+# recent 429 adds half a second.
+ERROR_PENALTY = 4.0
+RATE_LIMIT_PENALTY = 0.5
+MIN_HEDGE_SAMPLES = 20
+
+
+def is_rate_limit(error: Exception) -> bool:
+    """Whether an exception is a provider 429 response"""
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == 429 or getattr(error, "status_code", None) == 429:
+        return True
+    return "429" in str(error)
+
+
+class NoProviderAvailable(RuntimeError):
+    """Raised when no configured provider can serve a request"""
+
+
+class CircuitBreaker:
+    """Per-provider breaker: closed -> open after repeated failures -> half-open probe
+
+    Args:
+        failure_threshold: Consecutive failures that open the breaker
+        reset_timeout: Seconds the breaker stays open before allowing a probe
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def available(self) -> bool:
+        """Whether a request could be sent now (does not claim the probe slot)"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_timeout
+        return not self._probe_in_flight
+
+    def allow(self) -> bool:
+        """Claim permission to send a request, moving open -> half-open when due"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Give back a probe slot for a request that was cancelled, not failed"""
+        self._probe_in_flight = False
+
+
+class ProviderStats:
+    """Rolling latency and error statistics for one provider"""
+    def __init__(self, alpha: float, window: int = 200):
+        self.alpha = alpha
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.rate_limited = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.rate_limit_count = 0
+        self.ttft_samples = deque(maxlen=window)
+
+    def record_success(self, latency: float, time_to_first_token: Optional[float]):
+        self.requests += 1
+        self.latency = latency if self.latency is None else \
+            self.alpha * latency + (1 - self.alpha) * self.latency
+        self.error_rate *= (1 - self.alpha)
+        self.rate_limited *= (1 - self.alpha)
+        if time_to_first_token is not None:
+            self.ttft_samples.append(time_to_first_token)
+
+    def record_failure(self, rate_limited: bool):
+        self.requests += 1
+        self.failures += 1
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+        if rate_limited:
+            self.rate_limit_count += 1
+            self.rate_limited = 1 + (1 - self.alpha) * self.rate_limited
+
+    def ttft_percentile(self, pct: float) -> Optional[float]:
+        if len(self.ttft_samples) < MIN_HEDGE_SAMPLES:
+            return None
+        ordered = sorted(self.ttft_samples)
+        return ordered[min(len(ordered) - 1, int(pct * (len(ordered) - 1)))]
+
+
+class AdaptiveRouter:
+    """Ranks providers per request and streams from the best one
+
+    Args:
+        priority: Static provider order, used as the tie-breaker and, when
+            adaptive is False, as the ranking itself
+        adaptive: Rank by observed score instead of static order
+        hedge: Duplicate slow requests to the runner-up
+        hedge_percentile: TTFT percentile used as the hedge deadline
+        alpha: EWMA smoothing factor
+        failure_threshold: Consecutive failures that open a breaker
+        reset_timeout: Seconds an open breaker waits before a half-open probe
+    """
+    def __init__(self, priority: List[Provider], adaptive: bool = True, hedge: bool = False,
+                 hedge_percentile: float = 0.95, alpha: float = 0.2,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.priority = priority
+        self.adaptive = adaptive
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.stats: Dict[Provider, ProviderStats] = {}
+        self.breakers: Dict[Provider, CircuitBreaker] = {}
+        self.hedges_started = 0
+        self.hedges_won = 0
+
+    def _stats(self, provider: Provider) -> ProviderStats:
+        if provider not in self.stats:
+            self.stats[provider] = ProviderStats(self.alpha)
+        return self.stats[provider]
+
+    def breaker(self, provider: Provider) -> CircuitBreaker:
+        if provider not in self.breakers:
+            self.breakers[provider] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return self.breakers[provider]
+
+    def score(self, provider: Provider) -> float:
+        """Lower is better; providers without samples score 0 so they get tried"""
+        stats = self._stats(provider)
+        latency = stats.latency if stats.latency is not None else 0.0
+        return (latency * (1 + ERROR_PENALTY * stats.error_rate)
+                + ERROR_PENALTY * stats.error_rate
+                + RATE_LIMIT_PENALTY * stats.rate_limited)
+
+    def rank(self, candidates: List[Provider], preferred: Optional[Provider] = None) -> List[Provider]:
+        """Order candidates for a request, skipping providers whose breaker is open
+
+        A preferred provider (e.g. one the user picked with `switch`) is kept
+        first while its breaker is closed.
+        """
+        def position(provider: Provider) -> int:
+            return self.priority.index(provider) if provider in self.priority else len(self.priority)
+
+        available = [p for p in candidates if self.breaker(p).available()]
+        if self.adaptive:
+            ranked = sorted(available, key=lambda p: (self.score(p), position(p)))
+        else:
+            ranked = sorted(available, key=position)
+        if preferred in ranked:
+            ranked.remove(preferred)
+            ranked.insert(0, preferred)
+        return ranked
+
+    def hedge_deadline(self, provider: Provider) -> Optional[float]:
+        """Seconds to wait for the first token before hedging, if enough samples exist"""
+        if not self.hedge:
+            return None
+        return self._stats(provider).ttft_percentile(self.hedge_percentile)
+
+    def record_success(self, provider: Provider, latency: float, time_to_first_token: Optional[float]):
+        self._stats(provider).record_success(latency, time_to_first_token)
+        self.breaker(provider).record_success()
+
+    def record_failure(self, provider: Provider, error: Exception):
+        rate_limited = is_rate_limit(error)
+        self._stats(provider).record_failure(rate_limited)
+        breaker = self.breaker(provider)
+        breaker.record_failure()
+        logger.debug(f"Provider {provider.value} failed ({'429' if rate_limited else type(error).__name__}); "
+                     f"breaker {breaker.state}")
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Current per-provider statistics, for logging and metrics"""
+        return {
+            provider.value: {
+                "latency_ewma": stats.latency,
+                "error_rate": round(stats.error_rate, 3),
+                "rate_limited": stats.rate_limit_count,
+                "requests": stats.requests,
+                "breaker": self.breaker(provider).state,
+            }
+            for provider, stats in self.stats.items()
+        }
+
+    async def _abandon(self, attempts: dict):
+        """Cancel unfinished attempts, give back their probe slots and close their streams"""
+        for task, (provider, _, _) in attempts.items():
+            task.cancel()
+            self.breaker(provider).release()
+        while attempts:
+            task, (_, iterator, _) = attempts.popitem()
+            await asyncio.gather(task, return_exceptions=True)
+            if hasattr(iterator, "aclose"):
+                await iterator.aclose()
+
+    async def astream(self, ranked: List[Provider],
+                      open_stream: Callable[[Provider], AsyncIterator],
+                      on_select: Optional[Callable[[Provider], None]] = None,
+                      coalesced: Optional[Callable[[Provider], bool]] = None) -> AsyncIterator:
+        """Stream from the first provider in `ranked` that starts producing output
+
+        Providers that fail before their first chunk are skipped (failover).
+        Errors after the first chunk are recorded and re-raised, since a
+        partially streamed reply cannot be moved to another provider.
+        Cancelling or closing the stream cancels every open attempt and
+        gives back any half-open probe slot it held.
+
+        Args:
+            ranked: Providers in the order to try them
+            open_stream: Returns an async iterator of chunks for a provider
+            on_select: Called with the provider whose stream was kept
+            coalesced: Whether a provider's stream joined another request's
+                upstream call; that request records the outcome, this one
+                does not
+        """
+        def record_failure(provider: Provider, error: Exception):
+            if coalesced is not None and coalesced(provider):
+                self.breaker(provider).release()
+            else:
+                self.record_failure(provider, error)
+
+        pending = list(ranked)
+        last_error: Optional[Exception] = None
+        while pending:
+            primary = pending.pop(0)
+            if not self.breaker(primary).allow():
+                continue
+            attempts = {}
+
+            def start(provider: Provider):
+                iterator = open_stream(provider).__aiter__()
+                task = asyncio.ensure_future(iterator.__anext__())
+                attempts[task] = (provider, iterator, time.perf_counter())
+
+            start(primary)
+            deadline = self.hedge_deadline(primary) if pending else None
+            started = time.perf_counter()
+            winner = None
+            try:
+                while attempts and winner is None:
+                    timeout = None
+                    if deadline is not None:
+                        timeout = max(0.0, deadline - (time.perf_counter() - started))
+                    done, _ = await asyncio.wait(list(attempts), timeout=timeout,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    if not done:
+                        deadline = None
+                        while pending and not self.breaker(pending[0]).allow():
+                            pending.pop(0)
+                        if pending:
+                            runner_up = pending.pop(0)
+                            self.hedges_started += 1
+                            logger.debug(f"Hedging {primary.value} with {runner_up.value}")
+                            start(runner_up)
+                        continue
+                    for task in done:
+                        provider, iterator, opened_at = attempts.pop(task)
+                        try:
+                            first = task.result()
+                        except StopAsyncIteration:
+                            first = None
+                        except Exception as e:
+                            record_failure(provider, e)
+                            last_error = e
+                            continue
+                        winner = (provider, iterator, opened_at, first)
+                        break
+            finally:
+                # Losing attempts, or all of them when the caller is cancelled mid-selection
+                await self._abandon(attempts)
+            if winner is None:
+                continue
+
+            provider, iterator, opened_at, first = winner
+            if provider != primary:
+                self.hedges_won += 1
+            if on_select is not None:
+                on_select(provider)
+            time_to_first_token = time.perf_counter() - opened_at
+            try:
+                if first is not None:
+                    yield first
+                    async for chunk in iterator:
+                        yield chunk
+            except Exception as e:
+                record_failure(provider, e)
+                raise
+            except BaseException:
+                # Cancelled or closed by the caller (client gone): not the
+                # provider's fault, but a half-open probe slot must come back
+                self.breaker(provider).release()
+                raise
+            finally:
+                if hasattr(iterator, "aclose"):
+                    await iterator.aclose()
+            if coalesced is not None and coalesced(provider):
+                self.breaker(provider).release()
+            else:
+                self.record_success(provider, time.perf_counter() - opened_at,
+                                    time_to_first_token if first is not None else None)
+            return
+
+        raise last_error or NoProviderAvailable("No working LLM provider found")
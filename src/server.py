@@ -0,0 +1,436 @@
+"""Async HTTP entry point: chat over Server-Sent Events
+
+`ChatServer` is an ASGI application over the same ChatEngine the interactive
+app uses, so one process holds thousands of open chats on a single event
+loop instead of a worker thread per in-flight LLM call.
+
+    POST   /chat                    {"message", "session_id"?, "provider"?, "stream"?}
+    GET    /sessions/{id}/messages  the session's history window
+    DELETE /sessions/{id}           clear a session (after its turn in flight)
+    GET    /health                  status, in-flight requests, draining flag
+    GET    /metrics                 Prometheus metrics of this process
+
+Streaming replies are `text/event-stream`: a `session` event with the
+session id, `data` events with text, then `done` (turn statistics) or
+`error`. Requests without a session id start a new session.
+
+Backpressure: the reply is passed to the writer through a bounded queue. A
+slow client first gets coalesced events (everything queued is sent as one
+event); once the queue is full the provider stream is no longer read until
+the client catches up, and a client that accepts nothing for
+SSE_SEND_TIMEOUT seconds is disconnected. A disconnect cancels the turn.
+
+Shutdown drains: new requests get 503, in-flight turns are given
+SERVER_DRAIN_TIMEOUT seconds to finish. With `--workers N` a supervisor
+starts N processes sharing the port (SO_REUSEPORT) and the SQLite session
+store; histories are re-read from the store when another worker has
+written to them.
+
+uvicorn is used when installed, otherwise the built-in host in asgi.py.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import signal
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Optional, Set
+
+from langchain_core.messages import AIMessage, HumanMessage
+from loguru import logger
+
+from asgi import MAX_BODY_BYTES, ASGIHost, listen_socket
+from providers import Provider
+from router import NoProviderAvailable, is_rate_limit
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+DONE = object()
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[List[tuple]] = None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or []
+
+
+class ChatServer:
+    """ASGI application serving chat turns from a ChatApp's engine
+
+    Args:
+        app: ChatApp whose engine, providers and metrics are served
+        provider: Default provider; requests may name another one
+        max_in_flight: Concurrent chat requests before answering 503
+        max_sessions: Idle sessions kept in memory before the least recently
+            used are released (their history stays in the session store)
+        drain_timeout: Seconds in-flight turns get to finish on shutdown
+        queue_chunks: Reply chunks buffered per stream before the provider
+            stream is paused
+        send_timeout: Seconds a client may accept nothing before it is dropped
+        ping_interval: Seconds between keep-alive comments while idle
+    """
+    def __init__(self, app, provider: Optional[Provider] = None, max_in_flight: int = 1000, max_sessions: int = 10000, drain_timeout: float = 30.0,
+                 queue_chunks: int = 64, send_timeout: float = 30.0, ping_interval: float = 15.0):
+        self.app = app
+        self.engine = app.engine
+        self.provider = provider
+        self.max_in_flight = max_in_flight
+        self.max_sessions = max_sessions
+        self.drain_timeout = drain_timeout
+        self.queue_chunks = queue_chunks
+        self.send_timeout = send_timeout
+        self.ping_interval = ping_interval
+        self.in_flight: Set[asyncio.Task] = set()
+        self.recent_sessions: "OrderedDict[str, float]" = OrderedDict()
+        self.draining = False
+        self.started = False
+
+    @classmethod
+    def from_env(cls, app, provider: Optional[Provider] = None) -> "ChatServer":
+        return cls(
+            app,
+            provider,
+            max_in_flight=int(os.getenv("SERVER_MAX_IN_FLIGHT", "1000")),
+            max_sessions=int(os.getenv("SERVER_MAX_SESSIONS", "10000")),
+            drain_timeout=float(os.getenv("SERVER_DRAIN_TIMEOUT", "30")),
+            queue_chunks=int(os.getenv("SSE_QUEUE_CHUNKS", "64")),
+            send_timeout=float(os.getenv("SSE_SEND_TIMEOUT", "30")),
+            ping_interval=float(os.getenv("SSE_PING_INTERVAL", "15"))
+        )
+
+    async def startup(self):
+        """Select the default provider (probing health once)"""
+        if self.started:
+            return
+        provider = await self.engine.activate(self.provider)
+        self.started = True
+        logger.info(f"Chat server ready, default provider {provider.value}")
+
+    async def drain(self):
+        """Refuse new requests and give in-flight turns time to finish"""
+        self.draining = True
+        if self.in_flight:
+            logger.info(f"Draining {len(self.in_flight)} in-flight requests")
+            done, pending = await asyncio.wait(set(self.in_flight), timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        try:
+            await self._route(scope, receive, send)
+        except HTTPError as e:
+            await self._json(send, e.status, {"error": str(e)}, e.headers)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.drain()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _route(self, scope, receive, send):
+        method, path = scope["method"], scope["path"].rstrip("/") or "/"
+        if path == "/health" and method == "GET":
+            await self._json(send, 200, {"status": "draining" if self.draining else "ok",
+                                         "in_flight": len(self.in_flight),
+                                         "sessions": len(self.engine.sessions)})
+        elif path == "/metrics" and method == "GET":
+            body = self.app.metrics.render_prometheus().encode()
+            await self._respond(send, 200, body, "text/plain; version=0.0.4")
+        elif path == "/chat":
+            if method != "POST":
+                raise HTTPError(405, "Use POST")
+            await self._chat(scope, receive, send)
+        elif path.startswith("/sessions/"):
+            parts = path.split("/")
+            session_id = self._session_id(parts[2])
+            if len(parts) == 4 and parts[3] == "messages" and method == "GET":
+                messages = self.engine.get_session_history(session_id).messages
+                self._touch(session_id)
+                await self._json(send, 200, {"session_id": session_id, "messages": [
+                    {"role": _role(message), "content": message.content} for message in messages]})
+            elif len(parts) == 3 and method == "DELETE":
+                await self.engine.clear_session(session_id)
+                self.recent_sessions.pop(session_id, None)
+                await self._respond(send, 204, b"")
+            else:
+                raise HTTPError(404, "Not found")
+        else:
+            raise HTTPError(404, "Not found")
+
+    @staticmethod
+    def _session_id(value: Optional[str]) -> str:
+        if value is None:
+            return uuid.uuid4().hex
+        if not isinstance(value, str) or not SESSION_ID_PATTERN.match(value):
+            raise HTTPError(400, "Invalid session_id")
+        return value
+
+    def _touch(self, session_id: str):
+        """Mark a session as used and release the least recently used idle ones"""
+        self.recent_sessions[session_id] = time.monotonic()
+        self.recent_sessions.move_to_end(session_id)
+        while len(self.recent_sessions) > self.max_sessions:
+            oldest, _ = self.recent_sessions.popitem(last=False)
+            if self.engine.session_busy(oldest):
+                self.recent_sessions[oldest] = time.monotonic()
+                break
+            self.engine.close_session(oldest)
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        """Read a request body that may arrive in several messages"""
+        parts = []
+        size = 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise HTTPError(400, "Request body incomplete")
+            body = message.get("body", b"")
+            size += len(body)
+            if size > MAX_BODY_BYTES:
+                raise HTTPError(413, "Request body too large")
+            parts.append(body)
+            if not message.get("more_body", False):
+                return b"".join(parts)
+
+    async def _chat(self, scope, receive, send):
+        if self.draining:
+            raise HTTPError(503, "Server is shutting down", [(b"retry-after", b"5")])
+        if len(self.in_flight) >= self.max_in_flight:
+            raise HTTPError(503, "Too many requests in flight", [(b"retry-after", b"1")])
+        body = await self._read_body(receive)
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "Body must be JSON")
+        if not isinstance(request, dict) or not isinstance(request.get("message"), str) or not request["message"]:
+            raise HTTPError(400, "'message' is required")
+        session_id = self._session_id(request.get("session_id"))
+        try:
+            provider = Provider(request["provider"]) if request.get("provider") else None
+        except ValueError:
+            raise HTTPError(400, f"Unknown provider '{request['provider']}'")
+        if provider is not None and not self.engine.is_configured(provider):
+            raise HTTPError(400, f"Provider '{provider.value}' is not configured")
+        self._touch(session_id)
+
+        task = asyncio.current_task()
+        self.in_flight.add(task)
+        try:
+            if request.get("stream", True):
+                await self._stream(send, receive, session_id, request["message"], provider)
+            else:
+                await self._complete(send, session_id, request["message"], provider)
+        finally:
+            self.in_flight.discard(task)
+            self._touch(session_id)
+
+    async def _complete(self, send, session_id: str, text: str, provider: Optional[Provider]):
+        try:
+            reply = await self.engine.ainvoke(session_id, text, provider)
+        except Exception as e:
+            status, error = self._error(e)
+            await self._json(send, status, {"session_id": session_id, "error": error})
+            return
+        await self._json(send, 200, {"session_id": session_id, "reply": reply,
+                                     **self._stats(session_id)})
+
+    async def _stream(self, send, receive, session_id: str, text: str, provider: Optional[Provider]):
+        queue: asyncio.Queue = asyncio.Queue(self.queue_chunks)
+
+        async def produce():
+            try:
+                async for chunk in self.engine.astream(session_id, text, provider):
+                    await queue.put(chunk)
+                await queue.put(DONE)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await queue.put(e)
+
+        async def watch():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        await send({"type": "http.response.start", "status": 200, "headers": [
+            (b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"), (b"x-session-id", session_id.encode())]})
+        producer = asyncio.ensure_future(produce())
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await self._send_event(send, "session", {"session_id": session_id})
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, watcher}, timeout=self.ping_interval,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if watcher in done:
+                    getter.cancel()
+                    logger.debug(f"Client of session {session_id} disconnected, cancelling the turn")
+                    return
+                if getter not in done:
+                    getter.cancel()
+                    await self._send(send, b": ping\n\n")
+                    continue
+                items = [getter.result()]
+                # Coalesce whatever else is queued into one event for clients that fall behind
+                while not queue.empty() and not isinstance(items[-1], Exception) and items[-1] is not DONE:
+                    items.append(queue.get_nowait())
+                end = items[-1] if items[-1] is DONE or isinstance(items[-1], Exception) else None
+                texts = [item for item in items if isinstance(item, str)]
+                if texts:
+                    await self._send_event(send, None, {"text": "".join(texts)})
+                if end is DONE:
+                    await self._send_event(send, "done", {"session_id": session_id, **self._stats(session_id)})
+                    break
+                if end is not None:
+                    status, error = self._error(end)
+                    await self._send_event(send, "error", {"status": status, "error": error})
+                    break
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        except (asyncio.TimeoutError, ConnectionError):
+            logger.debug(f"Dropping slow or closed client of session {session_id}")
+        finally:
+            watcher.cancel()
+            producer.cancel()
+            await asyncio.gather(producer, watcher, return_exceptions=True)
+
+    async def _send_event(self, send, event: Optional[str], data: dict):
+        frame = (f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n"
+        await self._send(send, frame.encode())
+
+    async def _send(self, send, body: bytes):
+        await asyncio.wait_for(send({"type": "http.response.body", "body": body, "more_body": True}),
+                               self.send_timeout)
+
+    def _stats(self, session_id: str) -> dict:
+        stats = self.engine.turn_stats.get(session_id)
+        if stats is None:
+            return {}
+        return {
+            "provider": stats.provider.value if stats.provider else None,
+            "tokens": stats.tokens,
+            "time_to_first_token": round(stats.time_to_first_token, 3) if stats.time_to_first_token else None,
+            "total_time": round(stats.total_time, 3),
+            "prompt_tokens": stats.prompt_tokens,
+            "cached_tokens": stats.cached_tokens,
+        }
+
+    @staticmethod
+    def _error(error: Exception):
+        if isinstance(error, NoProviderAvailable):
+            return 503, str(error)
+        if is_rate_limit(error):
+            return 429, "Rate limit exceeded after retries"
+        logger.error(f"Chat turn failed: {type(error).__name__}: {str(error)}")
+        return 500, "The provider request failed"
+
+    @staticmethod
+    async def _respond(send, status: int, body: bytes, content_type: str = "text/plain",
+                       headers: Optional[List[tuple]] = None):
+        await send({"type": "http.response.start", "status": status, "headers": [
+            (b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())
+        ] + (headers or [])})
+        await send({"type": "http.response.body", "body": body, "more_body": False})
+
+    async def _json(self, send, status: int, data: dict, headers: Optional[List[tuple]] = None):
+        await self._respond(send, status, json.dumps(data).encode(), "application/json", headers)
+
+
+def _role(message) -> str:
+    if isinstance(message, HumanMessage):
+        return "user"
+    if isinstance(message, AIMessage):
+        return "assistant"
+    return message.type
+
+
+async def serve(server: ChatServer, host: str, port: int, reuse_port: bool = False):
+    """Run the server until SIGINT/SIGTERM, then drain"""
+    sock = listen_socket(host, port, reuse_port)
+    try:
+        import uvicorn
+    except ImportError:
+        uvicorn = None
+    if uvicorn is not None and os.getenv("SERVER_IMPL", "auto") != "builtin":
+        config = uvicorn.Config(server, lifespan="on", log_config=None,
+                                timeout_graceful_shutdown=int(server.drain_timeout))
+        await uvicorn.Server(config).serve(sockets=[sock])
+        return
+
+    await server.startup()
+    host_impl = ASGIHost(server)
+    await host_impl.start(sock)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    logger.info(f"Listening on http://{host}:{sock.getsockname()[1]} (pid {os.getpid()})")
+    try:
+        await stop.wait()
+    finally:
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(signum)
+        await server.drain()
+        await host_impl.stop(server.drain_timeout)
+
+
+def run_server(app, options):
+    """Serve a ChatApp in this process (one worker)"""
+    server = ChatServer.from_env(app, Provider(options.provider) if options.provider else None)
+    if options.drain_timeout is not None:
+        server.drain_timeout = options.drain_timeout
+    app.loop.run_until_complete(serve(server, options.host, options.port, reuse_port=options.workers > 1))
+
+
+def _worker(argv: List[str]):
+    import chat
+    chat.main(argv)
+
+
+def supervise(argv: List[str], workers: int):
+    """Start `workers` server processes on one port and forward shutdown signals to them
+
+    Workers share the SQLite session store. Long-term recall is per-process
+    state and is switched off in the workers. Each worker keeps its own
+    metrics and exports them on its own port and file (see `start_exporters`).
+    """
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for index in range(workers):
+        process = context.Process(target=_worker, args=(argv + ["--worker-index", str(index)],),
+                                  name=f"chat-worker-{index}")
+        process.start()
+        processes.append(process)
+    logger.info(f"Started {workers} workers: {', '.join(str(p.pid) for p in processes)}")
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for process in processes:
+        process.join()
+    failed = [p for p in processes if p.exitcode not in (0, -signal.SIGTERM)]
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,286 @@
+"""Persistent session storage for conversation histories
+
+Sessions are stored append-only in SQLite (WAL mode) keyed by
+(session_id, turn). Resuming a session reads only the newest turns needed to
+fill the prompt window, walking the primary-key index backwards, so resume
+cost does not depend on how long the session is.
+
+Each session's rolling summary (see summary.py) is stored alongside its
+messages, with the number of oldest messages it covers.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+from loguru import logger
+
+from branching import MAIN_BRANCH
+from history import DEFAULT_TRIM_RATIO, TokenBudgetHistory
+from summary import RollingSummary
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    turn INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    message TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (session_id, turn)
+) WITHOUT ROWID
+"""
+
+SUMMARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS summaries (
+    session_id TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    covered INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class SQLiteSessionStore:
+    """Append-only message store shared by all sessions in a process
+
+    Args:
+        path: Path to the SQLite database file
+    """
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(SCHEMA)
+        self._conn.execute(SUMMARY_SCHEMA)
+        logger.debug(f"Session store opened at {path}")
+
+    def last_turn(self, session_id: str) -> int:
+        """Return the newest turn number for a session, or 0 if it is empty"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(turn) FROM messages WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] or 0
+
+    def append(self, session_id: str, entries: Sequence[Tuple[BaseMessage, int]]) -> int:
+        """Append messages with their token counts to a session
+
+        Args:
+            session_id: Session to append to
+            entries: (message, tokens) pairs in conversation order
+
+        Returns:
+            The turn number of the last appended message
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT MAX(turn) FROM messages WHERE session_id = ?", (session_id,)
+                ).fetchone()
+                turn = row[0] or 0
+                rows = []
+                for message, tokens in entries:
+                    turn += 1
+                    rows.append((session_id, turn, message.type,
+                                 json.dumps(message_to_dict(message)), tokens, now))
+                self._conn.executemany(
+                    "INSERT INTO messages (session_id, turn, role, message, tokens, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return turn
+
+    def iter_tail(self, session_id: str, batch_size: int = 64) -> Iterator[Tuple[BaseMessage, int]]:
+        """Yield (message, tokens) pairs from newest to oldest
+
+        Rows are fetched in small batches so callers that stop early never
+        read the rest of the transcript.
+        """
+        before = None
+        while True:
+            with self._lock:
+                if before is None:
+                    rows = self._conn.execute(
+                        "SELECT turn, message, tokens FROM messages WHERE session_id = ? "
+                        "ORDER BY turn DESC LIMIT ?", (session_id, batch_size)
+                    ).fetchall()
+                else:
+                    rows = self._conn.execute(
+                        "SELECT turn, message, tokens FROM messages WHERE session_id = ? AND turn < ? "
+                        "ORDER BY turn DESC LIMIT ?", (session_id, before, batch_size)
+                    ).fetchall()
+            if not rows:
+                return
+            for turn, data, tokens in rows:
+                yield messages_from_dict([json.loads(data)])[0], tokens
+            before = rows[-1][0]
+
+    def tail(self, session_id: str, token_budget: int) -> List[Tuple[BaseMessage, int]]:
+        """Load the newest messages that fit within a token budget, oldest first"""
+        entries = []
+        total = 0
+        for message, tokens in self.iter_tail(session_id):
+            if entries and total + tokens > token_budget:
+                break
+            entries.append((message, tokens))
+            total += tokens
+        entries.reverse()
+        return entries
+
+    def between(self, session_id: str, after_turn: int, before_turn: int,
+                token_limit: int) -> Tuple[List[Tuple[BaseMessage, int]], int]:
+        """Load the newest messages strictly between two turns within a token limit
+
+        Returns:
+            (message, tokens) pairs oldest first, and the turn before the
+            oldest one loaded
+        """
+        entries = []
+        total = 0
+        first = before_turn
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT turn, message, tokens FROM messages WHERE session_id = ? AND turn > ? AND turn < ? "
+                "ORDER BY turn DESC", (session_id, after_turn, before_turn)
+            )
+            for turn, data, tokens in rows:
+                if entries and total + tokens > token_limit:
+                    break
+                entries.append((messages_from_dict([json.loads(data)])[0], tokens))
+                total += tokens
+                first = turn
+        entries.reverse()
+        return entries, first - 1
+
+    def load_summary(self, session_id: str) -> Tuple[str, int]:
+        """Return a session's summary and the number of messages it covers"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, covered FROM summaries WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return (row[0], row[1]) if row else ("", 0)
+
+    def save_summary(self, session_id: str, summary: str, covered: int):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO summaries (session_id, summary, covered, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET summary = excluded.summary, "
+                "covered = excluded.covered, updated_at = excluded.updated_at",
+                (session_id, summary, covered, time.time())
+            )
+
+    def delete(self, session_id: str):
+        """Remove every stored message and the summary of a session"""
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+
+    def sessions(self) -> List[str]:
+        """List stored session ids"""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT session_id FROM messages").fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PersistentHistory(TokenBudgetHistory):
+    """Token-budgeted history window backed by a session store
+
+    Only the tail that fits the budget is loaded into memory; every new
+    message is appended to the store as well as the window. Branches forked
+    from the session are kept in memory only.
+
+    Args:
+        store: Session store to read from and append to
+        session_id: Session this history belongs to
+        token_budget: Maximum number of history tokens sent with each prompt
+        model: Model name used to pick the tokenizer
+        trim_ratio: Fraction of the budget kept when the window overflows
+    """
+    def __init__(self, store: SQLiteSessionStore, session_id: str,
+                 token_budget: int, model: Optional[str] = None,
+                 trim_ratio: float = DEFAULT_TRIM_RATIO):
+        super().__init__(token_budget, model, trim_ratio)
+        self.store = store
+        self.session_id = session_id
+        self.last_turn = 0
+        self._load_tail()
+
+    def _load_tail(self):
+        """Replace the window (and the main branch) with the newest stored messages that fit the budget"""
+        self._messages.clear()
+        self._token_counts.clear()
+        self.total_tokens = 0
+        self.last_turn = self.store.last_turn(self.session_id)
+        entries = self.store.tail(self.session_id, self.token_budget)
+        self.head = None
+        self.root_depth = self.last_turn - len(entries)
+        self._shared_depth = 0
+        for message, tokens in entries:
+            self._append(message, tokens)
+
+    def _persist(self, entries: Sequence[Tuple[BaseMessage, int]]):
+        # Forked branches live in memory; only the main branch is stored
+        if self.branch == MAIN_BRANCH:
+            self.last_turn = self.store.append(self.session_id, entries)
+
+    def refresh(self) -> bool:
+        """Reload the window and summary if another process appended to the session"""
+        if self.branch != MAIN_BRANCH or self.store.last_turn(self.session_id) == self.last_turn:
+            return False
+        self._load_tail()
+        if self.summary is not None:
+            self.summary.text, self.summary.covered = self.store.load_summary(self.session_id)
+            self._load_backlog()
+        logger.debug(f"Session {self.session_id} changed in another process, reloaded at turn {self.last_turn}")
+        return True
+
+    def set_token_budget(self, token_budget: int, model: Optional[str] = None):
+        grew = token_budget > self.token_budget
+        super().set_token_budget(token_budget, model)
+        if grew and self.branch == MAIN_BRANCH:
+            self._load_tail()
+            self._load_backlog()
+
+    def attach_summary(self, summary: RollingSummary):
+        """Attach a summary, resuming the stored one and its unsummarized backlog"""
+        summary.text, summary.covered = self.store.load_summary(self.session_id)
+        summary.save = lambda text, covered: self.store.save_summary(self.session_id, text, covered)
+        super().attach_summary(summary)
+        self._load_backlog()
+
+    def _load_backlog(self):
+        """Queue stored messages older than the window that the summary does not cover yet"""
+        if self.summary is None:
+            return
+        self.summary.pending.clear()
+        self.summary.pending_tokens = 0
+        window_start = self.store.last_turn(self.session_id) - len(self._messages) + 1
+        entries, skipped_to = self.store.between(self.session_id, self.summary.covered, window_start,
+                                                 self.summary.max_pending_tokens)
+        # Anything older than the backlog cap is left out of the summary
+        self.summary.covered = max(self.summary.covered, skipped_to)
+        for message, tokens in entries:
+            self.summary.add(message, tokens)
+
+    def clear(self) -> None:
+        self.store.delete(self.session_id)
+        super().clear()
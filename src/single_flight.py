@@ -0,0 +1,152 @@
+"""Single-flight coalescing of identical in-flight provider requests
+
+When several sessions send the same rendered prompt to the same provider,
+model and temperature while a request for it is still streaming, only the
+first one goes upstream. The others attach to that flight and receive its
+chunks as they arrive, starting with any already received. A flight ends
+with its upstream stream, so identical requests made afterwards are new
+calls (the response cache covers repeats over time).
+
+The upstream stream runs in its own task, so a caller that disconnects does
+not cut the reply short for the others; it is cancelled only once every
+caller has gone. The upstream call carries the first caller's retries; if
+it still fails, that same error is raised in every caller. Only the first
+caller's outcome is the provider's: callers that joined are reported through
+`on_join`, so routers do not count one failed call once per waiter.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence, Set
+
+from providers import Provider
+
+
+class _Flight:
+    """One upstream stream and the chunks it produced so far"""
+    def __init__(self):
+        self.chunks: List = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.callers = 0
+        self.waiters = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk=None):
+        if chunk is not None:
+            self.chunks.append(chunk)
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self):
+        await self._changed.wait()
+
+
+class SingleFlight:
+    """Share one upstream call between concurrent identical requests
+
+    Args:
+        metrics: Registry receiving upstream-call and coalesced-request
+            counters, or None
+    """
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.flights: Dict[str, _Flight] = {}
+        # Upstream tasks until they finish, including cancelled ones still unwinding
+        self._tasks: Set[asyncio.Task] = set()
+        self.counters = {"upstream_calls": 0, "coalesced": 0, "max_waiters": 0}
+
+    @classmethod
+    def from_env(cls, metrics=None) -> Optional["SingleFlight"]:
+        """Build the coalescing layer unless SINGLE_FLIGHT is off"""
+        if os.getenv("SINGLE_FLIGHT", "on").strip().lower() in ("off", "0", "false", "no"):
+            return None
+        return cls(metrics)
+
+    @staticmethod
+    def make_key(provider: Provider, model: str, temperature: Optional[float], prompt,
+                 tools: Sequence[str] = ()) -> str:
+        """Hash of the provider, model, temperature, bound tools and the exact rendered messages"""
+        messages = prompt.to_messages() if hasattr(prompt, "to_messages") else prompt
+        if isinstance(messages, str):
+            rendered = messages
+        else:
+            rendered = json.dumps([[message.type, message.content, getattr(message, "tool_calls", None)]
+                                   for message in messages], default=str)
+        scope = json.dumps([provider.value, model, temperature, list(tools)])
+        return hashlib.sha256(f"{scope}\n{rendered}".encode("utf-8")).hexdigest()
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.counters, "in_flight": len(self.flights)}
+
+    async def stream(self, key: str, provider: Provider, model: str,
+                     open_stream: Callable[[], AsyncIterator],
+                     on_join: Optional[Callable[[], None]] = None) -> AsyncIterator:
+        """Stream the reply for `key`, joining an identical request already in flight
+
+        Args:
+            key: Request key from `make_key`
+            provider: Provider, for metric labels
+            model: Model name, for metric labels
+            open_stream: Starts the upstream stream when no flight exists
+            on_join: Called when this caller joins another caller's flight
+
+        Yields:
+            The upstream stream's chunks
+        """
+        labels = (("provider", provider.value), ("model", model))
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = self.flights[key] = _Flight()
+            flight.task = asyncio.get_running_loop().create_task(self._run(key, flight, open_stream()))
+            self._tasks.add(flight.task)
+            flight.task.add_done_callback(self._tasks.discard)
+            self.counters["upstream_calls"] += 1
+            if self.metrics is not None:
+                self.metrics.increment("llm_single_flight_calls_total", labels)
+        else:
+            flight.waiters += 1
+            self.counters["coalesced"] += 1
+            self.counters["max_waiters"] = max(self.counters["max_waiters"], flight.waiters)
+            if self.metrics is not None:
+                self.metrics.increment("llm_coalesced_requests_total", labels)
+            if on_join is not None:
+                on_join()
+        flight.callers += 1
+        try:
+            index = 0
+            while True:
+                while index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.wait()
+        finally:
+            flight.callers -= 1
+            if flight.callers == 0 and not flight.done:
+                flight.task.cancel()
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+
+    async def _run(self, key: str, flight: _Flight, stream: AsyncIterator):
+        try:
+            async for chunk in stream:
+                flight.publish(chunk)
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            flight.publish()
+
+    async def aclose(self):
+        """Cancel the upstream calls still running and wait for them to unwind"""
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*list(self._tasks), return_exceptions=True)
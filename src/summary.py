@@ -0,0 +1,208 @@
+"""Rolling summary tier for long conversations
+
+The history window keeps recent turns verbatim. Messages trimmed out of the
+window are not lost: they are queued on the session's `RollingSummary` and
+folded into a running summary by a cheap model, incrementally (the previous
+summary plus the newly evicted lines). The summary is sent ahead of the
+window as a system message.
+
+Folding runs in a background task started after the turn's reply has been
+streamed, so it is never on the user's critical path. Until a fold finishes,
+the evicted messages are sent verbatim in place of their summary, so no
+context is missing in between.
+"""
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from loguru import logger
+
+from providers import Provider
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain the running summary of a conversation between a user and an AI assistant. "
+    "Merge the new lines into the current summary. Keep facts, names, numbers, decisions, "
+    "open questions and the user's preferences; drop greetings and small talk. "
+    "Reply with the updated summary only, in at most {words} words."
+)
+
+# Cheap default summarization model per provider (SUMMARY_MODEL overrides)
+DEFAULT_SUMMARY_MODELS = {
+    Provider.OPENAI: "gpt-4o-mini",
+    Provider.ANTHROPIC: "claude-3-haiku-20240307",
+    Provider.COHERE: "command-r",
+}
+
+
+class RollingSummary:
+    """Running summary of the messages evicted from one session's window
+
+    Args:
+        text: Current summary
+        covered: Number of the session's oldest messages the summary covers
+        max_pending_tokens: Cap on evicted-but-unsummarized tokens; the oldest
+            are dropped beyond it if folding keeps failing
+        save: Called with (text, covered) after each fold, for persistence
+    """
+    def __init__(self, text: str = "", covered: int = 0, max_pending_tokens: int = 8000,
+                 save: Optional[Callable[[str, int], None]] = None):
+        self.text = text
+        self.covered = covered
+        self.max_pending_tokens = max_pending_tokens
+        self.save = save
+        self.pending: List[Tuple[BaseMessage, int]] = []
+        self.pending_tokens = 0
+
+    def add(self, message: BaseMessage, tokens: int):
+        """Queue a message evicted from the window"""
+        self.pending.append((message, tokens))
+        self.pending_tokens += tokens
+        while self.pending_tokens > self.max_pending_tokens and len(self.pending) > 1:
+            _, dropped = self.pending.pop(0)
+            self.pending_tokens -= dropped
+            self.covered += 1
+            logger.warning("Summary backlog over its token cap; dropping the oldest unsummarized message")
+
+    def messages(self) -> List[BaseMessage]:
+        """Prompt messages standing in for everything before the window"""
+        messages = [SystemMessage(content=SUMMARY_PREFIX + self.text)] if self.text else []
+        return messages + [message for message, _ in self.pending]
+
+    def prompt_text(self) -> str:
+        """Summary and unsummarized lines as plain text (for system prompts)"""
+        lines = [self.text] if self.text else []
+        lines.extend(_transcript(message for message, _ in self.pending))
+        return "\n".join(lines)
+
+    def fold(self, text: str, count: int):
+        """Replace the summary after folding in the oldest `count` pending messages"""
+        folded = self.pending[:count]
+        self.pending = self.pending[count:]
+        self.pending_tokens -= sum(tokens for _, tokens in folded)
+        self.text = text
+        self.covered += count
+        if self.save is not None:
+            self.save(text, self.covered)
+
+    def copy(self) -> "RollingSummary":
+        """An unsaved copy, for a branch that forks off after the summarized part"""
+        summary = RollingSummary(self.text, self.covered, self.max_pending_tokens)
+        summary.pending = list(self.pending)
+        summary.pending_tokens = self.pending_tokens
+        return summary
+
+    def clear(self):
+        self.text = ""
+        self.covered = 0
+        self.pending.clear()
+        self.pending_tokens = 0
+
+
+def _transcript(messages) -> List[str]:
+    roles = {"human": "User", "ai": "Assistant", "system": "System"}
+    return [f"{roles.get(message.type, message.type)}: {message.content}" for message in messages]
+
+
+class Summarizer:
+    """Schedules background folds of each session's evicted messages
+
+    Args:
+        complete: Coroutine function running one completion as
+            (provider, model, messages) -> text, under the provider's limits
+        provider: Provider to summarize with, or None for the one that
+            served the turn
+        model: Summarization model, or None for the provider's cheap default
+        max_tokens: Target length of the summary in tokens
+    """
+    def __init__(self, complete: Callable[[Provider, Optional[str], List[BaseMessage]], Awaitable[str]],
+                 provider: Optional[Provider] = None, model: Optional[str] = None, max_tokens: int = 400):
+        self.complete = complete
+        self.provider = provider
+        self.model = model
+        self.max_tokens = max_tokens
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self._background: Set[asyncio.Task] = set()
+        self.runs = 0
+        self.failures = 0
+        self.last_duration: Optional[float] = None
+
+    @classmethod
+    def from_env(cls, complete) -> Optional["Summarizer"]:
+        """Build from SUMMARY_* settings, or None when SUMMARY_MEMORY is off"""
+        if os.getenv("SUMMARY_MEMORY", "on").strip().lower() in ("off", "0", "false", "no"):
+            return None
+        provider = os.getenv("SUMMARY_PROVIDER", "").strip()
+        return cls(
+            complete,
+            provider=Provider(provider) if provider else None,
+            model=os.getenv("SUMMARY_MODEL") or None,
+            max_tokens=int(os.getenv("SUMMARY_MAX_TOKENS", "400"))
+        )
+
+    def model_for(self, provider: Provider) -> Optional[str]:
+        return self.model or DEFAULT_SUMMARY_MODELS.get(provider)
+
+    def schedule(self, session_id: str, summary: RollingSummary, provider: Optional[Provider]):
+        """Start folding a session's pending messages unless a fold is already running
+
+        A running fold picks up messages evicted while it was in flight.
+        """
+        provider = self.provider or provider
+        if not summary.pending or provider is None:
+            return
+        task = self.tasks.get(session_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.get_running_loop().create_task(self._run(session_id, summary, provider))
+        self.tasks[session_id] = task
+        self._background.add(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        self._background.discard(task)
+        for session_id, running in list(self.tasks.items()):
+            if running is task:
+                del self.tasks[session_id]
+
+    async def _run(self, session_id: str, summary: RollingSummary, provider: Provider):
+        while summary.pending:
+            batch = list(summary.pending)
+            started = time.perf_counter()
+            try:
+                text = await self.complete(provider, self.model_for(provider), self._prompt(summary.text, batch))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Summarizing session {session_id} failed, will retry after the next turn: {str(e)}")
+                return
+            self.runs += 1
+            self.last_duration = time.perf_counter() - started
+            summary.fold(text.strip(), len(batch))
+            logger.debug(f"Folded {len(batch)} messages into the summary of session {session_id} "
+                         f"in {self.last_duration:.2f}s")
+
+    def _prompt(self, current: str, batch: List[Tuple[BaseMessage, int]]) -> List[BaseMessage]:
+        words = max(50, int(self.max_tokens * 0.75))
+        lines = "\n".join(_transcript(message for message, _ in batch))
+        return [
+            SystemMessage(content=SUMMARY_INSTRUCTIONS.format(words=words)),
+            HumanMessage(content=f"Current summary:\n{current or '(none)'}\n\nNew lines:\n{lines}"),
+        ]
+
+    async def wait(self):
+        """Wait for every running fold (e.g. before reading summaries in tests or scripts)"""
+        while self._background:
+            await asyncio.gather(*list(self._background), return_exceptions=True)
+
+    async def aclose(self):
+        """Cancel running folds; their messages stay pending in the store"""
+        for task in list(self._background):
+            task.cancel()
+        await asyncio.gather(*list(self._background), return_exceptions=True)
+        self._background.clear()
+        self.tasks.clear()
@@ -0,0 +1,62 @@
+"""Token counting helpers shared by the chat components
+
+Counts use tiktoken when its encoding files are available and fall back to a
+character-based estimate when they are not (e.g. offline machines).
+"""
+from functools import lru_cache
+from typing import Optional
+
+from loguru import logger
+
+DEFAULT_ENCODING = "cl100k_base"
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: Optional[str] = None):
+    """Load and cache the tiktoken encoding for a model
+
+    Args:
+        model: Model name used to pick the encoding, or None for the default
+
+    Returns:
+        A tiktoken Encoding, or None if tiktoken cannot be loaded
+    """
+    try:
+        import tiktoken
+        if model:
+            try:
+                return tiktoken.encoding_for_model(model)
+            except KeyError:
+                pass
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        logger.debug(f"tiktoken unavailable, using character estimate: {str(e)}")
+        return None
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Count the tokens in a piece of text
+
+    Args:
+        text: Text to count
+        model: Optional model name used to pick the tokenizer
+
+    Returns:
+        Number of tokens (estimated if tiktoken is unavailable)
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return max(1, len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def prompt_text(prompt) -> str:
+    """Render a prompt value, message list or string to plain text"""
+    if hasattr(prompt, "to_messages"):
+        return "\n".join(f"{m.type}: {m.content}" for m in prompt.to_messages())
+    if isinstance(prompt, list):
+        return "\n".join(f"{getattr(m, 'type', 'text')}: {getattr(m, 'content', m)}" for m in prompt)
+    return str(prompt)
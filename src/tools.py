@@ -0,0 +1,303 @@
+"""Concurrent tool execution for the agent loop
+
+When a reply asks for tool calls, `ToolRuntime.run` executes all of them at
+once and returns one ToolMessage per call, in the order the model asked for
+them, so a turn waits for its slowest tool rather than the sum of them.
+Each tool runs where it suits:
+
+    - "async": coroutine tools, on the event loop
+    - "thread": blocking (I/O-bound) tools, on a thread pool
+    - "process": CPU-bound tools, on a pool of spawned worker processes (the
+      function must be defined at module level so it can be pickled)
+
+Every call has a timeout. A failed or timed-out call is returned to the
+model as an error ToolMessage instead of failing the turn; the model can
+retry or answer without it. Python cannot interrupt a thread or process
+call, so one that times out keeps its worker until it returns.
+
+Results of idempotent tools are cached (LRU with a TTL) by tool name and
+arguments, and identical idempotent calls in flight at the same time share
+one execution, which keeps running for the others when the caller that
+started it is cancelled. Each call's latency is recorded in the metrics registry as
+`llm_tool_duration_seconds`, labeled by tool, kind and outcome.
+
+`BUILTIN_TOOLS` are local stand-ins (clock, sleeps, a prime counter) for
+exercising the runtime, one per kind; enable them with TOOLS.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Annotated, Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.messages import ToolMessage
+from langchain_core.tools import BaseTool, StructuredTool
+from loguru import logger
+from pydantic import Field
+
+KINDS = ("async", "thread", "process")
+
+# Largest count_primes limit a model may ask for; the sieve takes one byte per number
+MAX_PRIME_LIMIT = 10_000_000
+
+
+class ToolSpec:
+    """A tool and how the runtime executes it
+
+    Args:
+        tool: LangChain tool; its name, description and argument schema are
+            what the model sees
+        kind: "async", "thread" or "process"; defaults to "async" for tools
+            with a coroutine and "thread" otherwise
+        timeout: Seconds before the call is abandoned, or None for the
+            runtime's default
+        idempotent: Same arguments give the same result, so results may be
+            cached and shared between identical calls
+    """
+    def __init__(self, tool: BaseTool, kind: Optional[str] = None, timeout: Optional[float] = None,
+                 idempotent: bool = False):
+        if kind is None:
+            kind = "async" if getattr(tool, "coroutine", None) is not None else "thread"
+        if kind not in KINDS:
+            raise ValueError(f"Unknown tool kind '{kind}' (choose from {', '.join(KINDS)})")
+        if kind == "process" and getattr(tool, "func", None) is None:
+            raise ValueError(f"Tool '{tool.name}' has no function to run in a worker process")
+        self.tool = tool
+        self.kind = kind
+        self.timeout = timeout
+        self.idempotent = idempotent
+
+    @property
+    def name(self) -> str:
+        return self.tool.name
+
+
+class ToolRuntime:
+    """Run a reply's tool calls concurrently
+
+    Args:
+        specs: Tools the model may call
+        timeout: Default per-call timeout in seconds
+        max_threads: Thread pool size for blocking tools
+        max_processes: Worker processes for CPU-bound tools (started on
+            first use)
+        cache_size: Idempotent results kept (0 disables the cache)
+        cache_ttl: Seconds an idempotent result stays valid
+        max_rounds: Tool rounds allowed per turn before the engine stops
+            calling tools
+        metrics: Registry receiving per-call latency, or None
+    """
+    def __init__(self, specs: List[ToolSpec], timeout: float = 30.0, max_threads: int = 8,
+                 max_processes: int = 2, cache_size: int = 1024, cache_ttl: float = 300.0,
+                 max_rounds: int = 5, metrics=None):
+        self.specs: Dict[str, ToolSpec] = {spec.name: spec for spec in specs}
+        self.timeout = timeout
+        self.max_processes = max_processes
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.max_rounds = max_rounds
+        self.metrics = metrics
+        self.threads = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="tool")
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self._cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        self.counters = {"calls": 0, "cache_hits": 0, "shared": 0, "errors": 0, "timeouts": 0}
+
+    @classmethod
+    def from_env(cls, metrics=None) -> Optional["ToolRuntime"]:
+        """Build from TOOL_* settings with the built-in tools named in TOOLS
+
+        TOOLS is a comma-separated list of `BUILTIN_TOOLS` names, or "all";
+        tools are off by default.
+        """
+        names = os.getenv("TOOLS", "off").strip().lower()
+        if names in ("", "off", "0", "false", "no"):
+            return None
+        wanted = list(BUILTIN_TOOLS) if names == "all" else [name.strip() for name in names.split(",") if name.strip()]
+        unknown = [name for name in wanted if name not in BUILTIN_TOOLS]
+        if unknown:
+            logger.warning(f"Unknown tools ignored: {', '.join(unknown)}")
+        specs = [BUILTIN_TOOLS[name]() for name in wanted if name in BUILTIN_TOOLS]
+        if not specs:
+            return None
+        return cls(
+            specs,
+            timeout=float(os.getenv("TOOL_TIMEOUT", "30")),
+            max_threads=int(os.getenv("TOOL_MAX_THREADS", "8")),
+            max_processes=int(os.getenv("TOOL_MAX_PROCESSES", "2")),
+            cache_size=int(os.getenv("TOOL_CACHE_SIZE", "1024")),
+            cache_ttl=float(os.getenv("TOOL_CACHE_TTL", "300")),
+            max_rounds=int(os.getenv("TOOL_MAX_ROUNDS", "5")),
+            metrics=metrics
+        )
+
+    @property
+    def tools(self) -> List[BaseTool]:
+        """The tools to bind to chat models"""
+        return [spec.tool for spec in self.specs.values()]
+
+    @staticmethod
+    def cache_key(name: str, args: dict) -> str:
+        return f"{name}\n{json.dumps(args, sort_keys=True, default=str)}"
+
+    async def run(self, calls: List[dict]) -> List[ToolMessage]:
+        """Execute tool calls concurrently
+
+        Args:
+            calls: Tool calls from a reply (`AIMessage.tool_calls`)
+
+        Returns:
+            One ToolMessage per call, in the same order
+        """
+        return list(await asyncio.gather(*(self._call(call) for call in calls)))
+
+    async def _call(self, call: dict) -> ToolMessage:
+        name, args, call_id = call.get("name", ""), call.get("args") or {}, call.get("id") or ""
+        spec = self.specs.get(name)
+        if spec is None:
+            return ToolMessage(content=f"Error: unknown tool '{name}'", tool_call_id=call_id, name=name,
+                               status="error")
+        self.counters["calls"] += 1
+        started = time.perf_counter()
+        outcome, content = "ok", None
+        try:
+            if spec.idempotent and self.cache_size > 0:
+                content, outcome = await self._cached(spec, args)
+            else:
+                content = await self._execute(spec, args)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            outcome, content = "timeout", f"Error: {name} timed out"
+        except Exception as e:
+            self.counters["errors"] += 1
+            outcome, content = "error", f"Error: {type(e).__name__}: {str(e)}"
+        elapsed = time.perf_counter() - started
+        if self.metrics is not None:
+            self.metrics.observe("llm_tool_duration_seconds", elapsed,
+                                 (("tool", name), ("kind", spec.kind), ("outcome", outcome)))
+        logger.debug(f"Tool {name} ({spec.kind}) {outcome} in {elapsed * 1000:.1f}ms")
+        return ToolMessage(content=content, tool_call_id=call_id, name=name,
+                           status="error" if outcome in ("error", "timeout") else "success")
+
+    async def _cached(self, spec: ToolSpec, args: dict) -> Tuple[str, str]:
+        """Result of an idempotent call from the cache, a shared call in flight, or a new one"""
+        key = self.cache_key(spec.name, args)
+        entry = self._cache.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                self.counters["cache_hits"] += 1
+                return entry[1], "cached"
+            del self._cache[key]
+        task = self._pending.get(key)
+        if task is not None:
+            self.counters["shared"] += 1
+            return await asyncio.shield(task), "shared"
+        task = self._pending[key] = asyncio.ensure_future(self._shared_execute(spec, args, key))
+        # Retrieved here so a failure every caller has left is not logged as unhandled
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        return await asyncio.shield(task), "ok"
+
+    async def _shared_execute(self, spec: ToolSpec, args: dict, key: str) -> str:
+        """Run an idempotent call once for every caller waiting on it and cache the result
+
+        Runs in its own task, so the caller that started it leaving (its turn
+        was cancelled) does not cancel the others.
+        """
+        try:
+            content = await self._execute(spec, args)
+        finally:
+            del self._pending[key]
+        self._cache[key] = (time.monotonic() + self.cache_ttl, content)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return content
+
+    async def _execute(self, spec: ToolSpec, args: dict) -> str:
+        timeout = spec.timeout if spec.timeout is not None else self.timeout
+        tool = spec.tool
+        if spec.kind == "async":
+            result = await asyncio.wait_for(tool.ainvoke(args), timeout)
+        else:
+            loop = asyncio.get_running_loop()
+            if spec.kind == "thread":
+                future = loop.run_in_executor(self.threads, tool.invoke, args)
+            else:
+                # Validate here; the worker gets the bare module-level function
+                kwargs = dict(tool.get_input_schema().model_validate(args))
+                future = loop.run_in_executor(self._process_pool(), _call_function, tool.func, kwargs)
+            result = await asyncio.wait_for(future, timeout)
+        if isinstance(result, str):
+            return result
+        return json.dumps(result, default=str)
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        if self._processes is None:
+            # Spawned, not forked: the parent runs threads (loop, writers, pools)
+            self._processes = ProcessPoolExecutor(max_workers=self.max_processes,
+                                                  mp_context=multiprocessing.get_context("spawn"))
+        return self._processes
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.counters, "cached": len(self._cache), "in_flight": len(self._pending)}
+
+    async def aclose(self):
+        """Cancel shared calls still running, then stop the worker pools"""
+        tasks = list(self._pending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.close()
+
+    def close(self):
+        """Stop the worker pools without waiting for abandoned calls"""
+        self.threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+
+
+def _call_function(func: Callable, kwargs: dict) -> Any:
+    return func(**kwargs)
+
+
+async def current_time() -> str:
+    """The current date and time (UTC) in ISO 8601 format."""
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+async def wait(seconds: float) -> str:
+    """Wait for the given number of seconds, like a slow network call, and report how long it took."""
+    await asyncio.sleep(seconds)
+    return f"waited {seconds}s"
+
+
+def blocking_wait(seconds: float) -> str:
+    """Block for the given number of seconds, like a synchronous client call, and report how long it took."""
+    time.sleep(seconds)
+    return f"blocked {seconds}s"
+
+
+def count_primes(limit: Annotated[int, Field(ge=0, le=MAX_PRIME_LIMIT)]) -> int:
+    """Count the prime numbers below limit."""
+    if limit < 3:
+        return 0
+    sieve = bytearray([1]) * limit
+    sieve[0:2] = b"\x00\x00"
+    for i in range(2, int(limit ** 0.5) + 1):
+        if sieve[i]:
+            sieve[i * i::i] = bytearray(len(range(i * i, limit, i)))
+    return sum(sieve)
+
+
+# Name -> factory of a local stand-in tool
+BUILTIN_TOOLS: Dict[str, Callable[[], ToolSpec]] = {
+    "current_time": lambda: ToolSpec(StructuredTool.from_function(coroutine=current_time), "async"),
+    "wait": lambda: ToolSpec(StructuredTool.from_function(coroutine=wait), "async"),
+    "blocking_wait": lambda: ToolSpec(StructuredTool.from_function(func=blocking_wait), "thread"),
+    "count_primes": lambda: ToolSpec(StructuredTool.from_function(func=count_primes), "process",
+                                     idempotent=True),
+}
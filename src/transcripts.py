@@ -0,0 +1,207 @@
+"""Columnar transcript archive for analytics
+
+Every finished turn (including failed and cancelled ones) is recorded as one
+row: timestamp, session, provider, model, token counts, time to first token,
+latency, outcome and the redacted input and reply text. `record()` only
+appends to a queue; a background thread batches rows into column buffers
+and writes them as zstd-compressed Parquet segments:
+
+    <path>/date=YYYY-MM-DD/part-<first ms>-<pid>-<seq>.parquet
+
+A segment is written when `batch_rows` rows are buffered or `flush_interval`
+seconds have passed, and on close. Files are written under a temporary
+name and renamed, so readers never see a partial segment, and the pid in
+the name keeps server workers from colliding. Rows still buffered when the
+process is killed are lost.
+
+`scripts/query_transcripts.py` aggregates the archive through a memory-mapped
+pyarrow dataset, reading only the columns and days a query needs.
+
+Needs pyarrow; without it the archive is disabled.
+"""
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from loguru import logger
+
+from paths import DATA_DIR
+from request_log import configured_secrets, redact
+
+# Column name -> pyarrow type name, in file order
+COLUMNS = {
+    "ts": "timestamp[ms, tz=UTC]",
+    "session_id": "string",
+    "provider": "string",
+    "model": "string",
+    "outcome": "string",
+    "prompt_tokens": "int32",
+    "cached_tokens": "int32",
+    "completion_tokens": "int32",
+    "ttft_s": "float32",
+    "latency_s": "float32",
+    "input": "string",
+    "output": "string",
+}
+
+_STOP = object()
+
+
+def schema():
+    """The pyarrow schema of a segment"""
+    import pyarrow as pa
+    types = {
+        "timestamp[ms, tz=UTC]": pa.timestamp("ms", tz="UTC"),
+        "string": pa.string(),
+        "int32": pa.int32(),
+        "float32": pa.float32(),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in COLUMNS.items()])
+
+
+class TranscriptArchive:
+    """Append-only Parquet sink for finished turns
+
+    Args:
+        path: Archive directory
+        batch_rows: Rows per segment
+        flush_interval: Seconds after which a partial segment is written
+        text_chars: Characters of input and reply kept per row (0 drops text)
+        compression: Parquet codec
+    """
+    def __init__(self, path: str, batch_rows: int = 50000, flush_interval: float = 60.0,
+                 text_chars: int = 4000, compression: str = "zstd"):
+        import pyarrow  # noqa: F401  (fail at startup, not in the writer thread)
+        self.path = path
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.text_chars = text_chars
+        self.compression = compression
+        self.secrets = configured_secrets()
+        self.rows_written = 0
+        self.segments_written = 0
+        self.dropped = 0
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._columns: Dict[str, list] = {name: [] for name in COLUMNS}
+        self._first_ts: Optional[float] = None
+        self._sequence = 0
+        os.makedirs(path, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="transcript-writer", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_env(cls) -> Optional["TranscriptArchive"]:
+        """Build from TRANSCRIPT_* settings, or None when disabled or pyarrow is missing"""
+        if os.getenv("TRANSCRIPTS", "on").strip().lower() in ("off", "0", "false", "no"):
+            return None
+        try:
+            return cls(
+                os.getenv("TRANSCRIPT_PATH", os.path.join(DATA_DIR, "transcripts")),
+                batch_rows=int(os.getenv("TRANSCRIPT_BATCH_ROWS", "50000")),
+                flush_interval=float(os.getenv("TRANSCRIPT_FLUSH_INTERVAL", "60")),
+                text_chars=int(os.getenv("TRANSCRIPT_TEXT_CHARS", "4000"))
+            )
+        except ImportError:
+            logger.warning("pyarrow is not installed, transcript archive disabled")
+            return None
+
+    def record(self, session_id: str, provider: Optional[str], model: Optional[str], outcome: str,
+               prompt_tokens: Optional[int], cached_tokens: Optional[int], completion_tokens: Optional[int],
+               ttft: Optional[float], latency: float, user_input: str, output: str,
+               ts: Optional[float] = None):
+        """Queue one turn; never blocks on disk
+
+        Args:
+            ts: Unix time of the turn, defaulting to now; rows must arrive
+                in time order
+        """
+        self._queue.put((ts or time.time(), session_id, provider, model, outcome, prompt_tokens, cached_tokens,
+                         completion_tokens, ttft, latency, user_input, output))
+
+    def _run(self):
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                row = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                row = None
+            if row is _STOP:
+                self._flush()
+                return
+            if row is not None:
+                # Segments never span two days, so date partitions can be pruned by time
+                if self._first_ts is not None and int(row[0] // 86400) != int(self._first_ts // 86400):
+                    self._flush()
+                    deadline = None
+                self._buffer(row)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if len(self._columns["ts"]) >= self.batch_rows or \
+                    (deadline is not None and time.monotonic() >= deadline):
+                self._flush()
+                deadline = None
+
+    def _buffer(self, row: tuple):
+        ts, session_id, provider, model, outcome, prompt_tokens, cached_tokens, completion_tokens, \
+            ttft, latency, user_input, output = row
+        if self._first_ts is None:
+            self._first_ts = ts
+        columns = self._columns
+        columns["ts"].append(int(ts * 1000))
+        columns["session_id"].append(session_id)
+        columns["provider"].append(provider)
+        columns["model"].append(model)
+        columns["outcome"].append(outcome)
+        columns["prompt_tokens"].append(prompt_tokens)
+        columns["cached_tokens"].append(cached_tokens)
+        columns["completion_tokens"].append(completion_tokens)
+        columns["ttft_s"].append(ttft)
+        columns["latency_s"].append(latency)
+        columns["input"].append(self._text(user_input))
+        columns["output"].append(self._text(output))
+
+    def _text(self, text: str) -> Optional[str]:
+        if self.text_chars <= 0:
+            return None
+        return redact(text[:self.text_chars], self.secrets)
+
+    def _flush(self):
+        """Write the buffered rows as one segment"""
+        rows = len(self._columns["ts"])
+        if not rows:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        columns, self._columns = self._columns, {name: [] for name in COLUMNS}
+        first_ts, self._first_ts = self._first_ts, None
+        day = datetime.fromtimestamp(first_ts, timezone.utc).strftime("%Y-%m-%d")
+        directory = os.path.join(self.path, f"date={day}")
+        name = f"part-{int(first_ts * 1000)}-{os.getpid()}-{self._sequence}.parquet"
+        self._sequence += 1
+        try:
+            os.makedirs(directory, exist_ok=True)
+            table = pa.Table.from_pydict(columns, schema=schema())
+            temporary = os.path.join(directory, f".{name}.tmp")
+            pq.write_table(table, temporary, compression=self.compression)
+            os.replace(temporary, os.path.join(directory, name))
+        except Exception as e:
+            self.dropped += rows
+            logger.error(f"Failed to write transcript segment ({rows} rows): {str(e)}")
+            return
+        self.rows_written += rows
+        self.segments_written += 1
+        logger.debug(f"Wrote transcript segment {name} ({rows} rows)")
+
+    def stats(self) -> Dict[str, int]:
+        return {"rows_written": self.rows_written, "segments_written": self.segments_written,
+                "dropped": self.dropped, "queued": self._queue.qsize()}
+
+    def close(self, timeout: float = 30.0):
+        """Write everything still queued and stop the writer"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
@@ -0,0 +1,63 @@
+"""Shared fixtures: src/ on the import path, a clean environment and a mock-provider engine
+
+Tests drive the async code through their own event loop (like ChatApp does)
+instead of a pytest plugin, and never reach a real provider.
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from clients import ProviderClientRegistry  # noqa: E402
+from engine import ChatEngine  # noqa: E402
+from providers import Provider, ProviderConfig  # noqa: E402
+
+# Settings read by the application; cleared so a developer's .env or shell cannot change results
+SETTING_PREFIXES = (
+    "OPENAI_", "ANTHROPIC_", "COHERE_", "MOCK_", "CIRCUIT_", "DEBUG_LOG_", "FALLBACK_ORDER", "HEALTH_CHECK_",
+    "HEDGE_", "HISTORY_", "HTTP", "MAX_CONCURRENCY", "METRICS_", "MODEL_PRICES", "NATIVE_BATCH_", "PROMPT_CACHE",
+    "RECALL", "RESPONSE_CACHE", "RETRY_", "ROUTING", "SERVER_", "SESSION_", "SINGLE_FLIGHT", "SSE_", "SUMMARY_",
+    "TOOL", "TRANSCRIPT",
+)
+
+
+@pytest.fixture(autouse=True)
+def clean_env(monkeypatch):
+    for name in list(os.environ):
+        if name.startswith(SETTING_PREFIXES):
+            monkeypatch.delenv(name)
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture
+def make_engine(loop):
+    """Build ChatEngines on the mock provider; closed in the test's loop afterwards
+
+    Keyword arguments go to ChatEngine, except `providers`, which replaces the
+    default {Provider.MOCK: mock-model} configuration.
+    """
+    engines = []
+
+    def make(providers=None, **kwargs) -> ChatEngine:
+        providers = providers or {Provider.MOCK: ProviderConfig("mock", "mock-model")}
+        engine = ChatEngine(providers, list(providers), ProviderClientRegistry(providers), **kwargs)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        loop.run_until_complete(engine.aclose())
+
+
+@pytest.fixture
+def engine(make_engine):
+    return make_engine()
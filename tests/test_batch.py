@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from batch import ORDER_COMPLETION, BatchCheckpoint, BatchRunner
+
+
+class Crash(BaseException):
+    """Stands in for the process dying mid-run"""
+
+
+def write_input(path, count: int, extra=()):
+    lines = [json.dumps({"id": f"q{i}", "input": f"question {i}"}) for i in range(count)]
+    path.write_text("\n".join(lines + list(extra)) + "\n")
+    return str(path)
+
+
+def read_output(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_results_are_written_in_input_order(engine, loop, tmp_path):
+    input_path = write_input(tmp_path / "in.jsonl", 10, ["not json", json.dumps({"id": "empty"})])
+    output = tmp_path / "out.jsonl"
+
+    report = loop.run_until_complete(BatchRunner(engine, workers=4).run(input_path, str(output)))
+
+    results = read_output(output)
+    assert [r["index"] for r in results] == list(range(12))
+    assert all(r["output"] and r["provider"] == "mock" for r in results[:10])
+    assert "Invalid input line" in results[10]["error"] and "Invalid input line" in results[11]["error"]
+    assert (report["completed"], report["failed"]) == (10, 2)
+    assert not (tmp_path / "out.jsonl.checkpoint").exists()
+    # Throwaway sessions are closed once their item is done
+    assert engine.sessions == {}
+
+
+def test_completion_order_writes_every_result_once(engine, loop, tmp_path):
+    input_path = write_input(tmp_path / "in.jsonl", 20)
+    output = tmp_path / "out.jsonl"
+
+    loop.run_until_complete(BatchRunner(engine, workers=8, order=ORDER_COMPLETION).run(input_path, str(output)))
+
+    assert sorted(r["index"] for r in read_output(output)) == list(range(20))
+
+
+def test_items_sharing_a_session_run_as_one_conversation(engine, loop, tmp_path):
+    input_path = tmp_path / "in.jsonl"
+    input_path.write_text("".join(json.dumps({"session": "chat", "input": f"turn {i}"}) + "\n" for i in range(3)))
+
+    loop.run_until_complete(BatchRunner(engine, workers=3).run(str(input_path), str(tmp_path / "out.jsonl")))
+
+    assert [m.content for m in engine.get_session_history("chat").messages[::2]] == ["turn 0", "turn 1", "turn 2"]
+
+
+def test_resume_after_a_crash_neither_duplicates_nor_loses_results(make_engine, loop, tmp_path):
+    input_path = write_input(tmp_path / "in.jsonl", 20)
+    output = tmp_path / "out.jsonl"
+    engine = make_engine()
+    ainvoke = engine.ainvoke
+
+    async def crash_midway(session_id, user_input, provider=None):
+        if user_input == "question 12":
+            raise Crash()
+        return await ainvoke(session_id, user_input, provider)
+
+    engine.ainvoke = crash_midway
+    with pytest.raises(Crash):
+        loop.run_until_complete(BatchRunner(engine, workers=4, checkpoint_every=3).run(input_path, str(output)))
+    assert (tmp_path / "out.jsonl.checkpoint").exists()
+
+    runner = BatchRunner(make_engine(), workers=4)
+    report = loop.run_until_complete(runner.run(input_path, str(output), resume=True))
+
+    assert [r["index"] for r in read_output(output)] == list(range(20))
+    assert report["skipped"] > 0
+    assert report["skipped"] + report["completed"] == 20
+
+
+def test_checkpoints_only_resume_their_own_input(tmp_path):
+    checkpoint = BatchCheckpoint(str(tmp_path / "run.checkpoint"), str(tmp_path / "a.jsonl"))
+    for index in (0, 1, 3):
+        checkpoint.mark(index)
+    checkpoint.save()
+
+    resumed = BatchCheckpoint(checkpoint.path, str(tmp_path / "a.jsonl"))
+    assert resumed.load()
+    assert (resumed.watermark, resumed.done) == (1, {3})
+    with pytest.raises(ValueError):
+        BatchCheckpoint(checkpoint.path, str(tmp_path / "b.jsonl")).load()
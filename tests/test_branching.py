@@ -0,0 +1,135 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+import chat
+from branching import MAIN_BRANCH, walk
+from history import DEFAULT_FORK_TURNS, TokenBudgetHistory
+
+
+def turn(store: TokenBudgetHistory, i: int, label: str = ""):
+    store.add_messages([HumanMessage(content=f"{label}question {i}"), AIMessage(content=f"{label}answer {i}")])
+
+
+def contents(store: TokenBudgetHistory):
+    return [m.content for m in store.messages]
+
+
+def test_fork_shares_the_past_and_branches_grow_independently():
+    store = TokenBudgetHistory(token_budget=10_000)
+    for i in range(3):
+        turn(store, i)
+    fork_node = store.head
+
+    store.fork("alt")
+    turn(store, 3, "alt ")
+    assert store.branch == "alt"
+    assert contents(store)[-2:] == ["alt question 3", "alt answer 3"]
+    # The branch links to the main branch's nodes instead of copying them
+    assert list(walk(store.head))[2] is fork_node
+
+    store.checkout(MAIN_BRANCH)
+    assert contents(store)[-1] == "answer 2"
+    turn(store, 3, "main ")
+    assert contents(store)[-1] == "main answer 3"
+
+    store.checkout("alt")
+    assert contents(store)[-1] == "alt answer 3"
+    assert len(store.messages) == 8
+
+
+def test_fork_turns_back_starts_before_that_user_message():
+    store = TokenBudgetHistory(token_budget=10_000)
+    for i in range(5):
+        turn(store, i)
+
+    store.fork("retry", turns=2)
+
+    assert contents(store)[-1] == "answer 2"
+    assert len(store.messages) == 6
+    store.checkout(MAIN_BRANCH)
+    assert contents(store)[-1] == "answer 4"
+
+
+def test_branch_info_reports_sizes_and_the_shared_prefix():
+    store = TokenBudgetHistory(token_budget=10_000)
+    for i in range(4):
+        turn(store, i)
+    store.fork("alt", turns=1)
+    turn(store, 9, "alt ")
+
+    info = {branch["name"]: branch for branch in store.branch_info()}
+
+    assert info["alt"]["current"] and not info[MAIN_BRANCH]["current"]
+    assert info["alt"]["messages"] == 8
+    assert info[MAIN_BRANCH]["messages"] == 8
+    assert info[MAIN_BRANCH]["shared"] == 6
+    assert info["alt"]["shared"] is None
+    assert info["alt"]["tokens"] == store.head.total_tokens
+
+
+def test_bad_fork_and_checkout_requests_raise():
+    store = TokenBudgetHistory(token_budget=10_000)
+    for i in range(3):
+        turn(store, i)
+
+    with pytest.raises(ValueError):
+        store.fork("far", turns=4)
+    with pytest.raises(ValueError):
+        store.fork(MAIN_BRANCH)
+    with pytest.raises(ValueError):
+        store.checkout("missing")
+    # A failed fork leaves the current branch as it was
+    assert store.branch == MAIN_BRANCH and store.branches == {}
+
+
+def test_old_messages_are_unlinked_once_out_of_fork_reach():
+    store = TokenBudgetHistory(token_budget=200)
+    for i in range(500):
+        turn(store, i)
+
+    chain = list(walk(store.head))
+    # The window is shorter than fork reach: the last fork_turns turns and the message before them
+    assert len(store.messages) < 2 * DEFAULT_FORK_TURNS
+    assert len(chain) == 2 * DEFAULT_FORK_TURNS + 1
+    assert store.head.depth == 1000
+
+    store.fork("back", turns=DEFAULT_FORK_TURNS)
+    assert contents(store)[-1] == f"answer {499 - DEFAULT_FORK_TURNS}"
+    store.checkout(MAIN_BRANCH)
+    with pytest.raises(ValueError):
+        store.fork("too-far", turns=DEFAULT_FORK_TURNS + 5)
+
+
+def test_messages_another_branch_shares_are_not_pruned():
+    store = TokenBudgetHistory(token_budget=200, fork_turns=2)
+    for i in range(5):
+        turn(store, i)
+    store.fork("kept")
+    store.checkout(MAIN_BRANCH)
+    for i in range(5, 100):
+        turn(store, i)
+
+    store.checkout("kept")
+
+    assert contents(store)[-1] == "answer 4"
+    assert len(list(walk(store.head))) == 10
+
+
+def test_chat_branch_commands(engine, capsys):
+    app = chat.ChatApp.__new__(chat.ChatApp)
+    app.memory = engine.get_session_history("s1")
+    for i in range(2):
+        turn(app.memory, i)
+
+    assert app._branch_command("fork alt 1")
+    assert app._branch_command("branches")
+    assert app._branch_command("checkout main")
+    assert app._branch_command("fork main")
+    assert not app._branch_command("fork bad/name")
+    assert not app._branch_command("hello there")
+
+    out = capsys.readouterr().out
+    assert "Forked branch 'alt' (2 messages in the window)" in out
+    assert "* alt: 2 messages" in out and "  main: 4 messages" in out and "shares 2 with this one" in out
+    assert "Switched to branch 'main'" in out
+    assert "Branch 'main' already exists" in out
@@ -0,0 +1,102 @@
+import httpx
+import pytest
+
+from clients import PoolLimits, ProviderClientRegistry
+from providers import Provider, ProviderConfig
+
+PROVIDERS = {
+    Provider.OPENAI: ProviderConfig("key", "gpt-4o-mini", base_url="http://openai.test/v1"),
+    Provider.MOCK: ProviderConfig("mock", "mock-model"),
+}
+
+
+def test_clients_are_built_once_and_reused():
+    registry = ProviderClientRegistry(PROVIDERS)
+
+    mock = registry.get(Provider.MOCK)
+    openai = registry.get(Provider.OPENAI)
+
+    assert registry.get(Provider.MOCK) is mock
+    assert registry.get(Provider.OPENAI) is openai
+    assert registry.get(Provider.MOCK, "other-model") is not mock
+    assert registry.get(Provider.MOCK, "other-model").model == "other-model"
+    registry.close()
+
+
+def test_openai_clients_share_the_pooled_transports():
+    registry = ProviderClientRegistry(PROVIDERS)
+
+    default = registry.get(Provider.OPENAI)
+    variant = registry.get(Provider.OPENAI, "gpt-4o")
+
+    for client in (default, variant):
+        assert client.http_client is registry.http_client
+        assert client.http_async_client is registry.async_http_client
+    registry.close()
+
+
+def test_anthropic_clients_share_a_pool_without_sdk_retries(loop):
+    pytest.importorskip("langchain_anthropic")
+    registry = ProviderClientRegistry({Provider.ANTHROPIC: ProviderConfig("key", "claude-x")})
+
+    default = registry.get(Provider.ANTHROPIC)
+    variant = registry.get(Provider.ANTHROPIC, "claude-y")
+
+    import anthropic
+    sync_pool, async_pool = registry.anthropic_http_clients(anthropic)
+    for client in (default, variant):
+        assert client._client._client is sync_pool and client._async_client._client is async_pool
+        assert client._client.max_retries == 0 and client._async_client.max_retries == 0
+    loop.run_until_complete(registry.aclose())
+    assert async_pool.is_closed and sync_pool.is_closed
+
+
+def test_cohere_clients_share_the_pooled_transports():
+    chat_models = pytest.importorskip("langchain_community.chat_models")
+    pytest.importorskip("cohere")
+    try:
+        chat_models.ChatCohere
+    except (AttributeError, ImportError):
+        pytest.skip("this langchain-community has no ChatCohere")
+    registry = ProviderClientRegistry({Provider.COHERE: ProviderConfig("key", "command-r")})
+
+    client = registry.get(Provider.COHERE)
+
+    assert client.client._client_wrapper.httpx_client.httpx_client is registry.http_client
+    assert client.async_client._client_wrapper.httpx_client.httpx_client is registry.async_http_client
+    assert client.client._client_wrapper._max_retries == 0
+    registry.close()
+
+
+def test_close_forgets_clients_and_pools(loop):
+    registry = ProviderClientRegistry(PROVIDERS)
+    client = registry.get(Provider.MOCK)
+    pool = registry.async_http_client
+
+    loop.run_until_complete(registry.aclose())
+
+    assert pool.is_closed
+    assert registry.get(Provider.MOCK) is not client
+    assert registry.async_http_client is not pool
+    loop.run_until_complete(registry.aclose())
+
+
+def test_pool_limits_from_env(monkeypatch):
+    monkeypatch.setenv("HTTP_MAX_CONNECTIONS", "7")
+    monkeypatch.setenv("HTTP_MAX_KEEPALIVE", "3")
+    monkeypatch.setenv("HTTP2", "off")
+
+    kwargs = PoolLimits.from_env().httpx_kwargs()
+
+    assert kwargs["limits"] == httpx.Limits(max_connections=7, max_keepalive_connections=3, keepalive_expiry=30.0)
+    assert kwargs["http2"] is False
+
+
+def test_engine_switches_providers_without_rebuilding_clients(make_engine):
+    engine = make_engine({Provider.MOCK: ProviderConfig("mock", "mock-model"),
+                          Provider.OPENAI: ProviderConfig("key", "gpt-4o-mini")})
+    mock = engine.get_llm(Provider.MOCK)
+    engine.get_llm(Provider.OPENAI)
+
+    assert engine.get_llm(Provider.MOCK) is mock
+    assert len(engine.clients.clients) == 2
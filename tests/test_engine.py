@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+
+def run_turns(loop, engine, turns):
+    """Run (session_id, input) turns concurrently; returns the elapsed seconds"""
+    async def run():
+        await asyncio.gather(*(engine.ainvoke(session_id, text) for session_id, text in turns))
+
+    started = time.perf_counter()
+    loop.run_until_complete(run())
+    return time.perf_counter() - started
+
+
+def test_sessions_run_concurrently(make_engine, loop, monkeypatch):
+    monkeypatch.setenv("MOCK_TTFT", "0.2")
+    engine = make_engine()
+
+    elapsed = run_turns(loop, engine, [(f"s{i}", f"question {i}") for i in range(20)])
+
+    assert elapsed < 2
+    assert all(len(engine.get_session_history(f"s{i}").messages) == 2 for i in range(20))
+
+
+def test_provider_concurrency_is_bounded(make_engine, loop, monkeypatch):
+    monkeypatch.setenv("MOCK_TTFT", "0.1")
+    engine = make_engine(max_concurrency=2)
+
+    elapsed = run_turns(loop, engine, [(f"s{i}", f"question {i}") for i in range(6)])
+
+    assert elapsed >= 0.3
+
+
+def test_turns_within_a_session_run_in_order(make_engine, loop, monkeypatch):
+    monkeypatch.setenv("MOCK_TTFT", "0.05")
+    engine = make_engine()
+
+    run_turns(loop, engine, [("s1", f"question {i}") for i in range(5)])
+
+    messages = engine.get_session_history("s1").messages
+    assert [m.type for m in messages] == ["human", "ai"] * 5
+    assert [m.content for m in messages[::2]] == [f"question {i}" for i in range(5)]
+
+
+def test_close_session_keeps_other_sessions(engine, loop):
+    run_turns(loop, engine, [("s1", "one"), ("s2", "two")])
+
+    engine.close_session("s1")
+
+    assert "s1" not in engine.sessions and "s1" not in engine.turn_stats
+    assert len(engine.get_session_history("s2").messages) == 2
+
+
+def test_busy_sessions_are_not_closed(make_engine, loop, monkeypatch):
+    monkeypatch.setenv("MOCK_TTFT", "0.1")
+    engine = make_engine()
+
+    async def run():
+        turn = asyncio.ensure_future(engine.ainvoke("s1", "one"))
+        await asyncio.sleep(0.02)
+        closed = engine.close_session("s1")
+        await turn
+        return closed
+
+    assert loop.run_until_complete(run()) is False
+    assert len(engine.get_session_history("s1").messages) == 2
+    assert not engine.session_busy("s1") and engine.close_session("s1")
+
+
+def test_clearing_a_session_waits_for_the_turn_in_flight(make_engine, loop, monkeypatch):
+    monkeypatch.setenv("MOCK_TTFT", "0.1")
+    engine = make_engine()
+
+    async def run():
+        first = asyncio.ensure_future(engine.ainvoke("s1", "before"))
+        await asyncio.sleep(0.02)
+        clear = asyncio.ensure_future(engine.clear_session("s1"))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(engine.ainvoke("s1", "after"))
+        await asyncio.gather(first, clear, second)
+
+    loop.run_until_complete(run())
+
+    # The first turn finished before the clear; the second ran after it
+    messages = engine.get_session_history("s1").messages
+    assert [m.content for m in messages][:1] == ["after"] and len(messages) == 2
@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import httpx
+
+from health import ProviderHealthChecker, probe_url
+from providers import Provider, ProviderConfig
+
+PROVIDERS = {
+    Provider.OPENAI: ProviderConfig("key", "gpt", base_url="http://openai.test/v1"),
+    Provider.ANTHROPIC: ProviderConfig("key", "claude", base_url="http://anthropic.test"),
+    Provider.MOCK: ProviderConfig("mock", "mock-model"),
+}
+
+
+def checker(handler, **kwargs) -> ProviderHealthChecker:
+    async def respond(request: httpx.Request) -> httpx.Response:
+        return await handler(request)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(respond))
+    return ProviderHealthChecker(PROVIDERS, client=client, **kwargs)
+
+
+def test_probe_url_follows_the_configured_base_url():
+    assert probe_url(Provider.OPENAI, ProviderConfig("k", "m")) == "https://api.openai.com/v1/models"
+    assert probe_url(Provider.OPENAI, ProviderConfig("k", "m", base_url="http://proxy/v1/")) == \
+        "http://proxy/v1/models"
+    assert probe_url(Provider.ANTHROPIC, ProviderConfig("k", "m", base_url="http://proxy")) == \
+        "http://proxy/v1/models"
+    assert probe_url(Provider.MOCK, ProviderConfig("k", "m")) is None
+
+
+def test_select_returns_the_first_healthy_provider_without_waiting_for_slower_ones(loop):
+    seen = []
+
+    async def handler(request):
+        seen.append(request.url.host)
+        if request.url.host == "anthropic.test":
+            await asyncio.sleep(5)
+        return httpx.Response(200 if request.url.host == "openai.test" else 500)
+
+    health = checker(handler)
+    started = time.perf_counter()
+    selected = loop.run_until_complete(health.select([Provider.OPENAI, Provider.ANTHROPIC]))
+
+    assert selected == Provider.OPENAI
+    assert time.perf_counter() - started < 2
+    assert sorted(seen) == ["anthropic.test", "openai.test"]
+
+
+def test_unhealthy_providers_are_skipped_and_results_cached(loop):
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url.host)
+        return httpx.Response(401 if request.url.host == "openai.test" else 200)
+
+    health = checker(handler)
+    assert loop.run_until_complete(health.select([Provider.OPENAI, Provider.ANTHROPIC])) == Provider.ANTHROPIC
+    assert loop.run_until_complete(health.select([Provider.OPENAI, Provider.ANTHROPIC])) == Provider.ANTHROPIC
+    assert len(calls) == 2
+    assert health.health[Provider.OPENAI].error == "HTTP 401"
+
+    health.invalidate(Provider.OPENAI)
+    loop.run_until_complete(health.check_all([Provider.OPENAI]))
+    assert len(calls) == 3
+
+
+def test_probe_timeouts_mark_the_provider_unhealthy(loop):
+    async def handler(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200)
+
+    health = checker(handler, timeout=0.05)
+    status = loop.run_until_complete(health.check_all([Provider.OPENAI]))[Provider.OPENAI]
+
+    assert not status.healthy
+    assert "timed out" in status.error
+
+
+def test_local_providers_are_healthy_without_a_request(loop):
+    async def handler(request):
+        raise AssertionError("the mock provider is never probed")
+
+    assert loop.run_until_complete(checker(handler).select([Provider.MOCK])) == Provider.MOCK
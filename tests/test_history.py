@@ -0,0 +1,76 @@
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+
+import history
+from history import TokenBudgetHistory, message_tokens
+
+
+def fill(store: TokenBudgetHistory, turns: int):
+    for i in range(turns):
+        store.add_messages([HumanMessage(content=f"question {i} " * 5), AIMessage(content=f"answer {i} " * 5)])
+
+
+def test_window_is_trimmed_below_the_budget_once_it_overflows():
+    store = TokenBudgetHistory(token_budget=200, trim_ratio=0.5)
+    fill(store, 20)
+
+    assert store.total_tokens <= 200
+    assert store.total_tokens == sum(message_tokens(m) for m in store.messages)
+    assert store.trimmed_tokens > 0
+    assert store.messages[-1].content.startswith("answer 19")
+
+
+def test_window_start_only_moves_when_the_budget_overflows():
+    store = TokenBudgetHistory(token_budget=300, trim_ratio=0.5)
+    starts = []
+    for i in range(30):
+        fill(store, 1)
+        starts.append(id(store.messages[0]))
+
+    # Trimming to half the budget leaves room for several turns before the next trim
+    assert len(set(starts)) < 15
+
+
+def test_tokens_saved_last_turn_counts_only_that_turn():
+    store = TokenBudgetHistory(token_budget=300, trim_ratio=0.5)
+    saved = []
+    for i in range(30):
+        fill(store, 1)
+        saved.append(store.tokens_saved_last_turn)
+
+    # Turns that fit in the window save nothing; the per-turn savings add up to the running total
+    assert 0 in saved[1:] and sum(saved) == store.trimmed_tokens
+    assert max(saved) < store.trimmed_tokens
+
+def test_messages_are_tokenized_once(monkeypatch):
+    calls = []
+    real = history.count_tokens
+    monkeypatch.setattr(history, "count_tokens", lambda text, model=None: calls.append(text) or real(text, model))
+
+    store = TokenBudgetHistory(token_budget=100)
+    fill(store, 10)
+    store.set_token_budget(50)
+
+    assert len(calls) == 20
+
+
+def test_newest_message_is_kept_even_over_budget():
+    store = TokenBudgetHistory(token_budget=5)
+    store.add_message(HumanMessage(content="a long message " * 20))
+
+    assert len(store.messages) == 1
+
+
+def test_streamed_chunks_are_stored_as_plain_messages():
+    store = TokenBudgetHistory(token_budget=1000)
+    store.add_messages([HumanMessage(content="hi"), AIMessageChunk(content="hello") + AIMessageChunk(content=" there")])
+
+    reply = store.messages[-1]
+    assert type(reply) is AIMessage
+    assert reply.content == "hello there"
+
+
+def test_trim_ratio_from_env_is_clamped(monkeypatch):
+    monkeypatch.setenv("HISTORY_TRIM_RATIO", "3")
+    assert history.trim_ratio_from_env() == 1.0
+    monkeypatch.setenv("HISTORY_TRIM_RATIO", "0")
+    assert history.trim_ratio_from_env() == 0.05
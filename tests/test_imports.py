@@ -0,0 +1,28 @@
+import json
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+
+# Modules only some commands or settings need
+DEFERRED = ("batch", "provider_batch", "server", "asgi", "tools", "recall", "transcripts",
+            "langchain_openai", "langchain_anthropic", "langchain_community", "openai", "anthropic", "cohere",
+            "numpy", "pyarrow")
+
+
+def loaded_after(code: str, env=None):
+    """Run `code` in a fresh interpreter and return which DEFERRED modules it imported"""
+    script = f"import json, sys\n{code}\nprint(json.dumps([m for m in {DEFERRED!r} if m in sys.modules]))"
+    result = subprocess.run([sys.executable, "-c", script], cwd=SRC, capture_output=True, text=True,
+                            env={**os.environ, **(env or {})}, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_importing_chat_defers_optional_modules():
+    assert loaded_after("import chat") == []
+
+
+def test_disabled_features_are_never_imported():
+    code = "import chat\nchat.ChatApp._recall_store()\nchat.ChatApp._transcript_archive()"
+    assert loaded_after(code, {"RECALL": "off", "TRANSCRIPTS": "off"}) == []
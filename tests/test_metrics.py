@@ -0,0 +1,87 @@
+import json
+import socket
+
+import httpx
+
+from metrics import Histogram, MetricsRegistry, estimate_cost, load_price_table, start_exporters
+
+LABELS = (("provider", "mock"), ("model", "mock-model"), ("outcome", "ok"))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_histogram_quantiles_are_bucket_bounds():
+    histogram = Histogram((0.1, 1.0))
+    for value in (0.05, 0.05, 0.5, 5.0):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.75) == 1.0
+    assert histogram.quantile(0.99) == float("inf")
+    assert Histogram((1.0,)).quantile(0.5) is None
+
+
+def test_costs_use_the_longest_matching_price(tmp_path):
+    prices = load_price_table()
+    assert estimate_cost("gpt-4o-mini-2024-07-18", 1_000_000, 0, prices) == 0.15
+    assert estimate_cost("gpt-4o", 0, 1_000_000, prices) == 10.0
+    assert estimate_cost("mock-model", 10, 10, prices) is None
+
+    path = tmp_path / "prices.json"
+    path.write_text(json.dumps({"mock-model": [1.0, 2.0]}))
+    assert estimate_cost("mock-model", 1_000_000, 1_000_000, load_price_table(str(path))) == 3.0
+
+
+def test_prometheus_buckets_are_cumulative_and_labels_escaped():
+    registry = MetricsRegistry()
+    registry.observe("llm_request_duration_seconds", 0.07, LABELS)
+    registry.observe("llm_request_duration_seconds", 3.0, LABELS)
+    registry.increment("llm_requests_total", (("model", 'say "hi"'),))
+
+    text = registry.render_prometheus()
+
+    labels = 'provider="mock",model="mock-model",outcome="ok"'
+    assert f'llm_request_duration_seconds_bucket{{{labels},le="0.05"}} 0' in text
+    assert f'llm_request_duration_seconds_bucket{{{labels},le="0.1"}} 1' in text
+    assert f'llm_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f"llm_request_duration_seconds_count{{{labels}}} 2" in text
+    assert 'llm_requests_total{model="say \\"hi\\""} 1.0' in text
+
+
+def test_engine_records_every_request(make_engine, loop):
+    registry = MetricsRegistry()
+    engine = make_engine(metrics=registry)
+
+    loop.run_until_complete(engine.ainvoke("s1", "Hello"))
+    loop.run_until_complete(engine.ainvoke("s1", "Hello again"))
+
+    assert registry.counters["llm_requests_total"] == {LABELS: 2.0}
+    assert registry.histograms["llm_time_to_first_token_seconds"][LABELS].count == 2
+    assert registry.histograms["llm_completion_tokens"][LABELS].sum > 0
+    assert registry.summary()["mock,mock-model,ok"]["requests"] == 2
+
+
+def test_each_worker_exports_to_its_own_port_and_file(monkeypatch, tmp_path):
+    port = free_port()
+    monkeypatch.setenv("METRICS_PORT", str(port - 2))
+    monkeypatch.setenv("METRICS_OTLP_PATH", str(tmp_path / "metrics.json"))
+    registry = MetricsRegistry()
+    registry.increment("llm_requests_total", LABELS)
+
+    exporters = start_exporters(registry, worker_index=2)
+    try:
+        response = httpx.get(f"http://127.0.0.1:{port}/metrics")
+    finally:
+        for exporter in exporters:
+            exporter.close()
+
+    assert response.status_code == 200
+    assert "llm_requests_total" in response.text
+    export = json.loads((tmp_path / "metrics.worker2.json").read_text().splitlines()[-1])
+    names = [m["name"] for m in export["resourceMetrics"][0]["scopeMetrics"][0]["metrics"]]
+    assert names == ["llm_requests_total"]
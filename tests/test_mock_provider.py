@@ -0,0 +1,67 @@
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+
+import mock_provider
+from mock_provider import MockChatModel, MockProfile, MockProviderError
+from rate_limit import is_retryable, retry_after
+from router import is_rate_limit
+
+
+def test_profile_from_env_applies_overrides(monkeypatch):
+    monkeypatch.setenv("MOCK_PROFILE", "typical")
+    monkeypatch.setenv("MOCK_REPLY_TOKENS", "7")
+    monkeypatch.setenv("MOCK_ERROR_RATE", "0.25")
+
+    profile = MockProfile.from_env()
+
+    assert profile.time_to_first_token == 0.4
+    assert profile.reply_tokens == 7 and isinstance(profile.reply_tokens, int)
+    assert profile.error_rate == 0.25
+
+
+def test_unknown_profiles_are_rejected():
+    with pytest.raises(ValueError, match="instant"):
+        MockProfile.named("glacial")
+
+
+def test_replies_follow_the_profile(loop):
+    model = MockChatModel(profile=MockProfile(time_to_first_token=0.1, tokens_per_second=100, reply_tokens=11))
+
+    async def stream():
+        return [chunk async for chunk in model.astream([HumanMessage(content="hi")])]
+
+    started = time.perf_counter()
+    chunks = loop.run_until_complete(stream())
+
+    reply = sum(chunks[1:], chunks[0])
+    assert len(reply.content.split()) == 11
+    assert time.perf_counter() - started >= 0.19
+    assert reply.usage_metadata["output_tokens"] == 11
+    assert len(model.invoke("hi").content.split()) == 11
+
+
+def test_injected_failures_look_like_provider_errors(monkeypatch):
+    monkeypatch.setattr(mock_provider.random, "random", lambda: 0.0)
+    limited = MockChatModel(profile=MockProfile(rate_limit_rate=1.0, retry_after=2))
+    failing = MockChatModel(profile=MockProfile(error_rate=1.0))
+
+    with pytest.raises(MockProviderError) as rate_limited:
+        limited.invoke("hi")
+    with pytest.raises(MockProviderError) as server_error:
+        failing.invoke("hi")
+
+    assert is_rate_limit(rate_limited.value) and retry_after(rate_limited.value) == 2
+    assert server_error.value.status_code == 500 and is_retryable(server_error.value)
+
+
+def test_repeated_prefixes_are_reported_as_cache_reads():
+    model = MockChatModel(model="prefix-test")
+    system = SystemMessage(content="You are a helpful assistant. " * 20)
+
+    first = model.invoke([system, HumanMessage(content="one")]).usage_metadata
+    second = model.invoke([system, HumanMessage(content="two")]).usage_metadata
+
+    assert first["input_token_details"]["cache_read"] == 0
+    assert 0 < second["input_token_details"]["cache_read"] < second["input_tokens"]
@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+import provider_batch
+from batch import NativeBatchRunner
+from provider_batch import PollBackoff
+from providers import Provider, ProviderConfig
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from mock_batch_server import MockBatchServer  # noqa: E402
+
+FAST_POLL = PollBackoff(initial=0.05, maximum=0.1)
+
+
+class Crash(BaseException):
+    """Stands in for the process dying mid-run"""
+
+
+@pytest.fixture
+def batch_server():
+    server = MockBatchServer(delay=0.1, flaky_polls=1)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def batch_engine(make_engine, batch_server):
+    url = f"http://127.0.0.1:{batch_server.server_port}"
+    return make_engine({
+        Provider.OPENAI: ProviderConfig("key", "gpt-4o-mini", base_url=f"{url}/v1"),
+        Provider.ANTHROPIC: ProviderConfig("key", "claude-3-5-haiku", base_url=url),
+        Provider.COHERE: ProviderConfig("key", "command-r"),
+        Provider.MOCK: ProviderConfig("mock", "mock-model"),
+    })
+
+
+def write_input(path, items):
+    path.write_text("".join((item if isinstance(item, str) else json.dumps(item)) + "\n" for item in items))
+    return str(path)
+
+
+def read_output(path):
+    return sorted((json.loads(line) for line in path.read_text().splitlines()), key=lambda r: r["index"])
+
+
+def test_items_go_to_their_provider_and_bad_items_get_error_records(batch_engine, loop, tmp_path):
+    input_path = write_input(tmp_path / "in.jsonl", [
+        {"id": "a", "input": "first"},
+        {"id": "b", "input": "second", "provider": "anthropic", "session": "chat"},
+        {"id": "c", "input": "please FAIL"},
+        {"id": "d", "input": "x", "provider": "nope"},
+        {"id": "e", "input": "x", "provider": "cohere"},
+        {"id": "f", "input": "x", "provider": "mock"},
+        "not json",
+    ])
+    output = tmp_path / "out.jsonl"
+
+    runner = NativeBatchRunner(batch_engine, Provider.OPENAI, FAST_POLL)
+    report = loop.run_until_complete(runner.run(input_path, str(output)))
+
+    results = read_output(output)
+    assert [r.get("output") for r in results[:2]] == ["echo: first", "echo: second"]
+    assert [r["provider"] for r in results[:3]] == ["openai", "anthropic", "openai"]
+    assert results[2]["error"] == "Mock failure requested"
+    assert "Unknown provider" in results[3]["error"]
+    assert "no native batch API" in results[4]["error"] and "no native batch API" in results[5]["error"]
+    assert "Invalid input line" in results[6]["error"]
+    assert (report["completed"], report["failed"]) == (2, 5)
+    assert [m.content for m in batch_engine.get_session_history("chat").messages] == ["second", "echo: second"]
+    assert not (tmp_path / "out.jsonl.checkpoint").exists()
+
+
+def test_resume_after_a_crash_does_not_submit_twice(batch_engine, batch_server, loop, tmp_path, monkeypatch):
+    input_path = write_input(tmp_path / "in.jsonl", [
+        {"input": "one"}, {"input": "two", "provider": "anthropic"}, {"input": "x", "provider": "nope"},
+    ])
+    output = tmp_path / "out.jsonl"
+
+    async def crash(self, chunk):
+        raise Crash()
+
+    with monkeypatch.context() as patch:
+        patch.setattr(provider_batch.AnthropicBatchBackend, "_create", crash)
+        with pytest.raises(Crash):
+            loop.run_until_complete(NativeBatchRunner(batch_engine, Provider.OPENAI, FAST_POLL)
+                                    .run(input_path, str(output)))
+
+    runner = NativeBatchRunner(batch_engine, Provider.OPENAI, FAST_POLL)
+    loop.run_until_complete(runner.run(input_path, str(output), resume=True))
+
+    kinds = sorted(batch["kind"] for batch in batch_server.batches.values())
+    assert kinds == ["anthropic", "openai"]
+    results = read_output(output)
+    assert [r["index"] for r in results] == [0, 1, 2]
+    assert [r.get("output") for r in results[:2]] == ["echo: one", "echo: two"]
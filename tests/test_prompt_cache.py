@@ -0,0 +1,55 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.prompt_values import ChatPromptValue
+
+from engine import CACHE_CONTROL, add_cache_breakpoints
+from providers import Provider, ProviderConfig
+
+
+def cache_marks(prompt):
+    return [isinstance(m.content, list) and m.content[-1].get("cache_control") == CACHE_CONTROL
+            for m in prompt.to_messages()]
+
+
+def test_breakpoints_follow_the_system_message_and_the_history():
+    prompt = ChatPromptValue(messages=[SystemMessage(content="system"), HumanMessage(content="earlier"),
+                                       AIMessage(content="reply"), HumanMessage(content="new")])
+
+    marked = add_cache_breakpoints(prompt)
+
+    assert cache_marks(marked) == [True, False, True, False]
+    assert marked.to_messages()[0].content == [{"type": "text", "text": "system", "cache_control": CACHE_CONTROL}]
+    # The original prompt is left untouched
+    assert cache_marks(prompt) == [False] * 4
+
+
+def test_first_turn_only_caches_the_system_message():
+    marked = add_cache_breakpoints([SystemMessage(content="system"), HumanMessage(content="new")])
+
+    assert cache_marks(marked) == [True, False]
+
+
+def test_later_turns_reuse_the_previous_prompt_as_a_cached_prefix(engine, loop):
+    loop.run_until_complete(engine.ainvoke("s1", "First question"))
+    first = engine.turn_stats["s1"]
+    loop.run_until_complete(engine.ainvoke("s1", "Second question"))
+    second = engine.turn_stats["s1"]
+
+    assert second.prompt_tokens > first.prompt_tokens
+    # System message, first question and first reply come back unchanged
+    assert second.cached_tokens > first.cached_tokens
+    assert 0 < second.cached_ratio < 1
+
+
+def test_anthropic_requests_keep_the_breakpoints(make_engine):
+    pytest.importorskip("langchain_anthropic")
+    engine = make_engine({Provider.ANTHROPIC: ProviderConfig("key", "claude-x", base_url="http://anthropic.test")})
+    model = engine.clients.get(Provider.ANTHROPIC)
+    prompt = add_cache_breakpoints([SystemMessage(content="system"), HumanMessage(content="earlier"),
+                                    AIMessage(content="reply"), HumanMessage(content="new")])
+
+    payload = model._get_request_payload(prompt)
+
+    assert payload["system"] == [{"type": "text", "text": "system", "cache_control": CACHE_CONTROL}]
+    assert payload["messages"][1]["content"][-1]["cache_control"] == CACHE_CONTROL
+    assert payload["messages"][-1]["content"] == "new"
@@ -0,0 +1,105 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import httpx
+import pytest
+
+import mock_provider
+from mock_provider import MockProviderError
+from providers import Provider, ProviderConfig
+from rate_limit import ProviderRateLimiter, RetryScheduler, TokenBucket, is_retryable, retry_after
+from response_cache import ResponseCache
+
+
+def http_error(status: int, headers=None) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://provider.test")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return httpx.HTTPStatusError(f"HTTP {status}", request=request, response=response)
+
+
+def test_token_bucket_refills_continuously():
+    bucket = TokenBucket(per_minute=600)
+    bucket.consume(600)
+
+    assert bucket.time_until(1) == pytest.approx(0.1, abs=0.01)
+    # Requests above capacity wait for a full bucket instead of forever
+    assert bucket.time_until(10_000) == pytest.approx(60, abs=0.1)
+
+
+def test_limiter_waits_for_capacity_in_arrival_order(loop):
+    limiter = ProviderRateLimiter(requests_per_minute=600)
+    limiter.requests.consume(600)
+    served = []
+
+    async def request(i):
+        await limiter.acquire()
+        served.append(i)
+
+    async def run():
+        await asyncio.gather(*(request(i) for i in range(3)))
+
+    started = time.perf_counter()
+    loop.run_until_complete(run())
+
+    assert served == [0, 1, 2]
+    assert time.perf_counter() - started >= 0.25
+    assert limiter.metrics()["requests"] == 3 and limiter.metrics()["queue_depth"] == 0
+
+
+def test_pause_holds_queued_requests(loop):
+    limiter = ProviderRateLimiter()
+    limiter.pause(0.1)
+
+    assert loop.run_until_complete(limiter.acquire()) >= 0.09
+
+
+def test_retry_after_reads_every_header_form():
+    assert retry_after(http_error(429, {"retry-after": "2"})) == 2
+    assert retry_after(http_error(429, {"retry-after-ms": "250"})) == 0.25
+    assert 8 <= retry_after(http_error(429, {"retry-after": formatdate(time.time() + 10, usegmt=True)})) <= 10
+    assert retry_after(http_error(429, {"retry-after": "soon"})) is None
+    assert retry_after(ValueError("no response")) is None
+
+
+def test_is_retryable_by_status_and_error_type():
+    assert is_retryable(http_error(429))
+    assert is_retryable(http_error(503))
+    assert not is_retryable(http_error(400))
+    assert is_retryable(MockProviderError(500, "Mock server error"))
+    assert is_retryable(httpx.ConnectError("refused"))
+    assert is_retryable(asyncio.TimeoutError())
+    assert not is_retryable(ValueError("connection details missing"))
+
+
+def test_retry_delay_honours_the_server_within_the_cap():
+    scheduler = RetryScheduler(max_retries=2, base_delay=1, max_delay=5)
+
+    assert scheduler.delay(0, http_error(429, {"retry-after": "3"})) == 3
+    assert scheduler.delay(0, http_error(429, {"retry-after": "60"})) == 5
+    assert 0 <= scheduler.delay(3, http_error(500)) <= 5
+    assert not scheduler.should_retry(2, http_error(500))
+
+
+def test_rate_limited_calls_are_retried_after_pausing_the_limiter(make_engine, loop, monkeypatch):
+    monkeypatch.setenv("MOCK_RATE_LIMIT_RATE", "0.5")
+    monkeypatch.setenv("RETRY_MAX_DELAY", "0.05")
+    rolls = iter([0.0, 0.9])
+    monkeypatch.setattr(mock_provider.random, "random", lambda: next(rolls))
+    engine = make_engine()
+
+    assert loop.run_until_complete(engine.ainvoke("s1", "Hello"))
+    assert engine.retry.retries == 1
+    assert engine.rate_limiters[Provider.MOCK].paused_until > 0
+
+
+def test_cache_hits_do_not_wait_for_the_rate_limiter(make_engine, loop):
+    engine = make_engine({Provider.MOCK: ProviderConfig("mock", "mock-model", requests_per_minute=1)},
+                         response_cache=ResponseCache())
+    loop.run_until_complete(engine.ainvoke("s1", "Hello"))
+
+    started = time.perf_counter()
+    loop.run_until_complete(engine.ainvoke("s2", "Hello"))
+
+    assert time.perf_counter() - started < 1
+    assert engine.rate_limit_metrics()["mock"]["requests"] == 1
@@ -0,0 +1,85 @@
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from providers import Provider, ProviderConfig  # noqa: E402
+from recall import RECALL_PREFIX, RecallStore, build_embedder  # noqa: E402
+
+TURNS = {
+    "garden": "User: How often should I water my tomato plants?\nAssistant: Water tomatoes deeply twice a week.",
+    "car": "User: My car battery keeps dying overnight.\nAssistant: Check for a parasitic drain on the battery.",
+}
+
+
+def open_store(path, **kwargs) -> RecallStore:
+    embed, dim = build_embedder("ngram", 256)
+    return RecallStore(str(path), embed, dim, backend="numpy", **kwargs)
+
+
+def test_session_scope_only_recalls_the_sessions_own_turns(tmp_path):
+    store = open_store(tmp_path)
+    store.add("alice", TURNS["garden"])
+    store.add("bob", TURNS["car"])
+
+    assert [s.session_id for s in store.search("watering tomato plants", session_id="alice")] == ["alice"]
+    assert store.search("watering tomato plants", session_id="bob") == []
+    store.close()
+
+
+def test_scope_all_shares_turns_across_sessions(tmp_path):
+    store = open_store(tmp_path, scope="all")
+    store.add("alice", TURNS["garden"])
+
+    assert [s.session_id for s in store.search("watering tomato plants", session_id="bob")] == ["alice"]
+    store.close()
+
+
+def test_turns_still_in_the_window_and_weak_matches_are_skipped(tmp_path):
+    store = open_store(tmp_path)
+    store.add("alice", TURNS["garden"])
+    store.add("alice", TURNS["car"])
+
+    assert store.search("car battery dying", session_id="alice", recent=1) == []
+    assert store.search("quantum chromodynamics lecture notes", session_id="alice") == []
+    snippets = store.search("car battery dying", session_id="alice")
+    assert snippets[0].text == TURNS["car"] and snippets[0].score >= store.min_score
+    store.close()
+
+
+def test_reopening_repairs_vectors_written_without_their_rows(tmp_path):
+    store = open_store(tmp_path)
+    store.add("alice", TURNS["garden"])
+    store.close()
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(b"\0" * 256 * 4)
+
+    store = open_store(tmp_path)
+
+    assert store.count == 1
+    assert os.path.getsize(tmp_path / "vectors.f32") == 256 * 4
+    assert store.search("watering tomato plants", session_id="alice")[0].text == TURNS["garden"]
+    store.close()
+
+
+def test_engine_recalls_turns_that_left_the_window(make_engine, loop, tmp_path, monkeypatch):
+    # Short filler replies, so the stored turn is mostly the question
+    monkeypatch.setenv("MOCK_REPLY_TOKENS", "5")
+    engine = make_engine({Provider.MOCK: ProviderConfig("mock", "mock-model", history_tokens=120)},
+                         recall=open_store(tmp_path))
+
+    async def conversation():
+        await engine.ainvoke("s1", "How often should I water my tomato plants?")
+        for i in range(5):
+            await engine.ainvoke("s1", f"Unrelated small talk number {i}")
+        await asyncio.gather(*engine._background)
+        await engine.summarizer.wait()
+        history = engine.get_session_history("s1")
+        return await engine._recall("s1", "When do I water the tomato plants?", history)
+
+    excerpts = loop.run_until_complete(conversation())
+
+    assert excerpts.startswith(RECALL_PREFIX)
+    assert "tomato plants" in excerpts
@@ -0,0 +1,65 @@
+import json
+import sys
+
+from loguru import logger
+
+from request_log import REDACTED, DebugCallbackHandler, add_request_sink, configured_secrets, redact, truncate
+
+
+def test_redact_masks_configured_and_key_shaped_secrets():
+    text = 'key sk-abcdefghijkl, Authorization: Bearer abc.def, {"password": "hunter22"}, value s3cr3t-v4lue'
+
+    masked = redact(text, ["s3cr3t-v4lue"])
+
+    for secret in ("sk-abcdefghijkl", "abc.def", "hunter22", "s3cr3t-v4lue"):
+        assert secret not in masked
+    assert masked.count(REDACTED) == 4
+    assert redact("nothing to hide here") == "nothing to hide here"
+
+
+def test_configured_secrets_come_from_credential_variables():
+    environ = {"OPENAI_API_KEY": "sk-live-123456", "SESSION_TOKEN": "short", "HOME": "/home/someone-long"}
+
+    assert configured_secrets(environ) == ["sk-live-123456"]
+
+
+def test_truncate_notes_what_was_dropped():
+    assert truncate("abcdef", 4) == "abcd...[2 chars truncated]"
+    assert truncate("abc", 4) == "abc"
+
+
+def test_one_redacted_record_per_request(make_engine, loop, tmp_path):
+    path = tmp_path / "requests.jsonl"
+    sink = add_request_sink(str(path))
+    engine = make_engine(callback_factory=lambda provider: [
+        DebugCallbackHandler(provider, payload_chars=200, secrets=["s3cr3t-v4lue"])
+    ])
+    try:
+        loop.run_until_complete(engine.ainvoke("s1", "my password: hunter22 and token s3cr3t-v4lue " * 20))
+        loop.run_until_complete(logger.complete())
+    finally:
+        logger.remove(sink)
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert len(records) == 1
+    record = records[0]
+    assert record["event"] == "llm_request" and record["provider"] == "mock" and record["status"] == "ok"
+    assert "hunter22" not in record["prompt"] and "s3cr3t-v4lue" not in record["prompt"]
+    assert record["prompt"].endswith("chars truncated]")
+    assert record["output"]
+
+
+def test_records_are_not_built_without_a_sink(make_engine, loop, monkeypatch):
+    rendered = []
+    monkeypatch.setattr(DebugCallbackHandler, "_render", lambda self, *args, **kwargs: rendered.append(1) or "")
+    # Only an INFO-level console sink: nothing accepts DEBUG request records
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+    try:
+        engine = make_engine(callback_factory=lambda provider: [DebugCallbackHandler(provider)])
+        loop.run_until_complete(engine.ainvoke("s1", "Hello"))
+    finally:
+        logger.remove()
+        logger.add(sys.stderr)
+
+    assert rendered == []
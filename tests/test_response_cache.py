@@ -0,0 +1,131 @@
+import os
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+import response_cache
+from clients import ProviderClientRegistry
+from engine import ChatEngine
+from paths import DATA_DIR
+from providers import Provider, ProviderConfig
+from response_cache import ResponseCache, normalize_prompt, split_prompt
+from tokens import prompt_text
+
+SCOPE = ResponseCache.make_scope(Provider.MOCK, "mock-model", 0.7)
+
+HISTORY = [SystemMessage(content="You are a helpful assistant.")] + [
+    message
+    for i in range(20)
+    for message in (HumanMessage(content=f"Tell me about topic number {i} in detail."),
+                    AIMessage(content=f"Topic {i} is a long and interesting subject. " * 10))
+]
+
+
+def ask(cache: ResponseCache, history, question: str, answer: str = None):
+    """Look the question up in `history`'s context; store `answer` on a miss"""
+    prompt = history + [HumanMessage(content=question)]
+    normalized = normalize_prompt(prompt_text(prompt))
+    context, text = split_prompt(prompt, question)
+    cached = cache.lookup(SCOPE, normalized, context, text)
+    if cached is None and answer is not None:
+        cache.update(SCOPE, normalized, answer, context, text)
+    return cached
+
+
+def test_exact_hits_ignore_whitespace():
+    cache = ResponseCache()
+    ask(cache, HISTORY, "What is the capital of France?", "Paris")
+
+    assert ask(cache, HISTORY, "What is  the capital of France? ") == "Paris"
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["bytes_saved"] == len("Paris")
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = ResponseCache(disk_path=path)
+    ask(cache, HISTORY, "What is the capital of France?", "Paris")
+    cache.close()
+
+    cache = ResponseCache(disk_path=path)
+    assert ask(cache, HISTORY, "What is the capital of France?") == "Paris"
+    assert cache.stats()["disk_hits"] == 1
+    cache.close()
+
+
+def test_entries_expire():
+    cache = ResponseCache(ttl=-1)
+    ask(cache, HISTORY, "What is the capital of France?", "Paris")
+
+    assert ask(cache, HISTORY, "What is the capital of France?") is None
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    for question in ("one?", "two?", "three?"):
+        ask(cache, [], question, question.upper())
+
+    assert ask(cache, [], "one?") is None
+    assert ask(cache, [], "three?") == "THREE?"
+
+
+def test_semantic_tier_reuses_a_reworded_question_in_the_same_context():
+    pytest.importorskip("numpy")
+    cache = ResponseCache(semantic_threshold=0.8)
+    ask(cache, HISTORY, "What is the capital of France?", "Paris")
+
+    assert ask(cache, HISTORY, "What's the capital of France?") == "Paris"
+    assert cache.stats()["semantic_hits"] == 1
+
+
+def test_different_questions_with_the_same_history_do_not_collide():
+    pytest.importorskip("numpy")
+    cache = ResponseCache(semantic_threshold=0.8)
+    ask(cache, HISTORY, "What is the capital of France?", "Paris")
+
+    # Nearly the whole prompt is shared history; only the question is compared
+    assert ask(cache, HISTORY, "How tall is Mount Everest?") is None
+    assert cache.stats()["semantic_hits"] == 0
+
+
+def test_semantic_hits_need_the_same_context():
+    pytest.importorskip("numpy")
+    cache = ResponseCache(semantic_threshold=0.8)
+    ask(cache, HISTORY, "What is the capital of France?", "Paris")
+
+    assert ask(cache, HISTORY[:-2], "What's the capital of France?") is None
+
+
+def test_from_env_defaults_to_the_project_data_dir(monkeypatch):
+    paths = []
+    monkeypatch.setattr(response_cache, "DiskTier", lambda path, max_bytes: paths.append(path))
+
+    assert ResponseCache.from_env() is not None
+    assert paths == [os.path.join(DATA_DIR, "response_cache.db")]
+
+    monkeypatch.setenv("RESPONSE_CACHE", "off")
+    assert ResponseCache.from_env() is None
+
+
+def test_engine_serves_repeated_prompts_from_the_cache(make_engine, loop):
+    engine = make_engine(response_cache=ResponseCache())
+
+    first = loop.run_until_complete(engine.ainvoke("s1", "Hello"))
+    second = loop.run_until_complete(engine.ainvoke("s2", "Hello"))
+
+    assert first == second
+    assert engine.response_cache.stats()["hits"] == 1
+
+
+def test_engines_at_different_temperatures_do_not_share_entries(loop):
+    cache = ResponseCache()
+    providers = {Provider.MOCK: ProviderConfig("mock", "mock-model")}
+    engines = [ChatEngine(providers, list(providers), ProviderClientRegistry(providers, temperature=temperature),
+                          response_cache=cache)
+               for temperature in (0.0, 1.0, 1.0)]
+
+    for engine in engines:
+        loop.run_until_complete(engine.ainvoke("s1", "Hello"))
+        loop.run_until_complete(engine.aclose())
+
+    assert cache.stats()["misses"] == 2 and cache.stats()["hits"] == 1
@@ -0,0 +1,183 @@
+import asyncio
+import time
+
+import pytest
+
+from providers import Provider, ProviderConfig
+from router import CLOSED, HALF_OPEN, OPEN, AdaptiveRouter, CircuitBreaker, NoProviderAvailable
+
+A, B, C = Provider.OPENAI, Provider.ANTHROPIC, Provider.MOCK
+
+
+def streams(**behaviour):
+    """open_stream for AdaptiveRouter.astream: per provider name, a delay before
+    its reply or an exception raised instead of it"""
+    async def open_stream(provider):
+        outcome = behaviour[provider.name]
+        if isinstance(outcome, Exception):
+            raise outcome
+        await asyncio.sleep(outcome)
+        for word in (provider.value, " reply"):
+            yield word
+    return open_stream
+
+
+def collect(loop, router, ranked, open_stream, **kwargs):
+    async def run():
+        return [chunk async for chunk in router.astream(ranked, open_stream, **kwargs)]
+    return "".join(loop.run_until_complete(run()))
+
+
+def test_rank_prefers_fast_reliable_providers():
+    router = AdaptiveRouter([A, B, C])
+    router.record_success(A, 1.0, 0.5)
+    router.record_success(B, 0.5, 0.1)
+    router.record_failure(C, RuntimeError("HTTP 429 Too Many Requests"))
+
+    assert router.rank([A, B, C]) == [B, A, C]
+    assert AdaptiveRouter([A, B, C], adaptive=False).rank([C, B, A]) == [A, B, C]
+
+
+def test_explicit_provider_is_tried_first_while_its_breaker_is_closed():
+    router = AdaptiveRouter([A, B], failure_threshold=1)
+    router.record_success(A, 0.1, 0.1)
+    router.record_success(B, 5.0, 1.0)
+
+    assert router.rank([A, B], preferred=B) == [B, A]
+    router.record_failure(B, RuntimeError("boom"))
+    assert router.rank([A, B], preferred=B) == [A]
+
+
+def test_breaker_opens_then_lets_one_half_open_probe_through():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.failures == 0
+
+
+def test_astream_fails_over_before_the_first_chunk(loop):
+    router = AdaptiveRouter([A, B])
+    selected = []
+
+    reply = collect(loop, router, [A, B], streams(OPENAI=RuntimeError("down"), ANTHROPIC=0),
+                    on_select=selected.append)
+
+    assert reply == "anthropic reply"
+    assert selected == [B]
+    assert router.stats[A].failures == 1
+    assert router.stats[B].requests == 1 and router.stats[B].failures == 0
+
+
+def test_astream_raises_when_every_provider_fails(loop):
+    router = AdaptiveRouter([A, B])
+    with pytest.raises(RuntimeError, match="second"):
+        collect(loop, router, [A, B], streams(OPENAI=RuntimeError("first"), ANTHROPIC=RuntimeError("second")))
+    with pytest.raises(NoProviderAvailable):
+        collect(loop, router, [], streams())
+
+
+def test_hedge_takes_the_runner_up_when_the_primary_is_slow(loop):
+    router = AdaptiveRouter([A, B], hedge=True)
+    for _ in range(20):
+        router.record_success(A, 0.05, 0.01)
+
+    started = time.perf_counter()
+    reply = collect(loop, router, [A, B], streams(OPENAI=2.0, ANTHROPIC=0))
+
+    assert reply == "anthropic reply"
+    assert time.perf_counter() - started < 1
+    assert router.hedges_started == router.hedges_won == 1
+
+
+def tracked_streams(closed: list, **delays):
+    """open_stream whose streams note their provider in `closed` once they finish or are closed"""
+    async def open_stream(provider):
+        try:
+            await asyncio.sleep(delays[provider.name])
+            yield provider.value
+            await asyncio.sleep(10)
+            yield " reply"
+        finally:
+            closed.append(provider)
+    return open_stream
+
+
+def half_open_router(*providers) -> AdaptiveRouter:
+    router = AdaptiveRouter(list(providers), hedge=True, failure_threshold=1, reset_timeout=0)
+    for provider in providers:
+        router.record_failure(provider, RuntimeError("down"))
+    return router
+
+
+def cancel_after(loop, router, ranked, open_stream, seconds: float, chunks: list):
+    async def consume():
+        async for chunk in router.astream(ranked, open_stream):
+            chunks.append(chunk)
+
+    async def run():
+        task = asyncio.ensure_future(consume())
+        await asyncio.sleep(seconds)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    loop.run_until_complete(run())
+
+
+@pytest.mark.parametrize("first_token_after", [5.0, 0.0])
+def test_cancelling_a_half_open_probe_gives_the_slot_back(loop, first_token_after):
+    router = half_open_router(A)
+    closed, chunks = [], []
+
+    # Cancelled while waiting for the first token, or while streaming the rest
+    cancel_after(loop, router, [A], tracked_streams(closed, OPENAI=first_token_after), 0.1, chunks)
+
+    assert chunks == ([] if first_token_after else ["openai"])
+    assert closed == [A]
+    assert router.breaker(A).state == HALF_OPEN
+    assert router.breaker(A).available() and router.breaker(A).allow()
+
+
+def test_cancelling_a_hedged_request_closes_both_attempts(loop):
+    router = half_open_router(A)
+    for _ in range(20):
+        router.record_success(B, 0.01, 0.01)
+    closed = []
+
+    # B is slow this time, so A's half-open probe is started as its hedge
+    cancel_after(loop, router, [B, A], tracked_streams(closed, OPENAI=5.0, ANTHROPIC=5.0), 0.2, [])
+
+    assert router.hedges_started == 1
+    assert set(closed) == {A, B}
+    assert router.breaker(A).available()
+
+
+def test_coalesced_streams_leave_the_statistics_alone(loop):
+    router = AdaptiveRouter([A, B])
+
+    collect(loop, router, [A, B], streams(OPENAI=RuntimeError("down"), ANTHROPIC=0), coalesced=lambda p: True)
+
+    assert router.stats == {}
+
+
+def test_engine_fails_over_from_an_unreachable_provider(make_engine, loop, monkeypatch):
+    monkeypatch.setenv("RETRY_MAX_ATTEMPTS", "0")
+    engine = make_engine({A: ProviderConfig("key", "gpt-4o-mini", base_url="http://127.0.0.1:9/v1"),
+                          C: ProviderConfig("mock", "mock-model")})
+
+    reply = loop.run_until_complete(engine.ainvoke("s1", "Hello"))
+
+    assert reply
+    assert engine.turn_stats["s1"].provider == C
+    assert engine.router.stats[A].failures == 1
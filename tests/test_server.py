@@ -0,0 +1,185 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from asgi import MAX_BODY_BYTES, ASGIHost, listen_socket
+from metrics import MetricsRegistry
+from server import ChatServer, HTTPError
+
+
+@pytest.fixture
+def chat_server(engine):
+    return ChatServer(SimpleNamespace(engine=engine, metrics=MetricsRegistry()), ping_interval=0.5)
+
+
+@pytest.fixture
+def serving(chat_server, loop):
+    """Run `requests(client)` against the chat server behind the built-in host"""
+    def run(requests):
+        async def main():
+            await chat_server.startup()
+            host = ASGIHost(chat_server)
+            sock = listen_socket("127.0.0.1", 0)
+            await host.start(sock)
+            try:
+                url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+                async with httpx.AsyncClient(base_url=url) as client:
+                    return await requests(client)
+            finally:
+                await host.stop(1)
+        return loop.run_until_complete(main())
+    return run
+
+
+def parse_events(text: str):
+    events = []
+    for frame in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in frame.splitlines() if not line.startswith(":"))
+        events.append((lines.get("event"), json.loads(lines["data"])))
+    return events
+
+
+def test_chat_streams_server_sent_events(serving, engine):
+    async def requests(client):
+        return await client.post("/chat", json={"message": "Hello", "session_id": "s1"})
+
+    response = serving(requests)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/event-stream"
+    events = parse_events(response.text)
+    assert events[0] == ("session", {"session_id": "s1"})
+    assert events[-1][0] == "done" and events[-1][1]["provider"] == "mock"
+    text = "".join(data["text"] for event, data in events if event is None)
+    assert text == engine.get_session_history("s1").messages[-1].content
+
+
+def test_json_replies_and_session_endpoints(serving):
+    async def requests(client):
+        reply = await client.post("/chat", json={"message": "Hello", "session_id": "s1", "stream": False})
+        messages = await client.get("/sessions/s1/messages")
+        deleted = await client.delete("/sessions/s1")
+        after = await client.get("/sessions/s1/messages")
+        return reply, messages, deleted, after
+
+    reply, messages, deleted, after = serving(requests)
+
+    assert reply.json()["reply"]
+    assert [m["role"] for m in messages.json()["messages"]] == ["user", "assistant"]
+    assert deleted.status_code == 204
+    assert after.json()["messages"] == []
+
+
+def test_deleting_a_session_waits_for_its_turn_in_flight(serving, engine, monkeypatch):
+    monkeypatch.setenv("MOCK_TTFT", "0.4")
+
+    async def requests(client):
+        chat = asyncio.ensure_future(client.post("/chat", json={"message": "Hello", "session_id": "s1"}))
+        await asyncio.sleep(0.15)
+        started = time.perf_counter()
+        deleted = await client.delete("/sessions/s1")
+        waited = time.perf_counter() - started
+        return await chat, deleted, waited
+
+    chat, deleted, waited = serving(requests)
+
+    assert chat.status_code == 200 and deleted.status_code == 204
+    # Held until the turn's first token (about 0.25s away) and the rest of the reply
+    assert waited > 0.2
+    assert engine.get_session_history("s1").messages == []
+
+
+def test_bad_requests_are_rejected(serving):
+    async def requests(client):
+        return [
+            (await client.post("/chat", content=b"not json")).status_code,
+            (await client.post("/chat", json={"session_id": "s1"})).status_code,
+            (await client.post("/chat", json={"message": "hi", "session_id": "bad id!"})).status_code,
+            (await client.post("/chat", json={"message": "hi", "provider": "nope"})).status_code,
+            (await client.post("/chat", json={"message": "hi", "provider": "openai"})).status_code,
+            (await client.get("/chat")).status_code,
+            (await client.get("/nowhere")).status_code,
+        ]
+
+    assert serving(requests) == [400, 400, 400, 400, 400, 405, 404]
+
+
+def test_invalid_content_length_is_a_bad_request(serving):
+    async def requests(client):
+        port = client.base_url.port
+        statuses = []
+        for length in (b"abc", b"-5"):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"POST /chat HTTP/1.1\r\nhost: test\r\ncontent-length: " + length + b"\r\n\r\n")
+            statuses.append((await reader.readline()).split()[1])
+            writer.close()
+        return statuses
+
+    assert serving(requests) == [b"400", b"400"]
+
+
+def test_bodies_are_read_across_messages(loop):
+    def receiver(*messages):
+        queue = list(messages)
+
+        async def receive():
+            return queue.pop(0)
+        return receive
+
+    body = loop.run_until_complete(ChatServer._read_body(receiver(
+        {"type": "http.request", "body": b'{"message":', "more_body": True},
+        {"type": "http.request", "body": b' "hi"}', "more_body": False},
+    )))
+    assert json.loads(body) == {"message": "hi"}
+
+    with pytest.raises(HTTPError) as incomplete:
+        loop.run_until_complete(ChatServer._read_body(receiver(
+            {"type": "http.request", "body": b"{", "more_body": True}, {"type": "http.disconnect"})))
+    assert incomplete.value.status == 400
+
+    chunk = {"type": "http.request", "body": b"x" * (MAX_BODY_BYTES // 2 + 1), "more_body": True}
+    with pytest.raises(HTTPError) as too_large:
+        loop.run_until_complete(ChatServer._read_body(receiver(chunk, chunk)))
+    assert too_large.value.status == 413
+
+
+def test_a_disconnect_cancels_the_turn(make_engine, loop, monkeypatch):
+    monkeypatch.setenv("MOCK_TTFT", "2")
+    engine = make_engine()
+    server = ChatServer(SimpleNamespace(engine=engine, metrics=MetricsRegistry()))
+    sent = []
+    messages = [{"type": "http.request", "body": b'{"message": "Hello", "session_id": "s1"}'}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(0.1)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/chat"}
+    started = time.perf_counter()
+    loop.run_until_complete(server(scope, receive, send))
+
+    assert time.perf_counter() - started < 1
+    assert sent[0]["status"] == 200
+    assert engine.get_session_history("s1").messages == []
+    assert not server.in_flight
+
+
+def test_draining_servers_refuse_new_chats(chat_server, serving):
+    chat_server.draining = True
+
+    async def requests(client):
+        return await client.post("/chat", json={"message": "Hello"}), await client.get("/health")
+
+    chat, health = serving(requests)
+
+    assert chat.status_code == 503 and chat.headers["retry-after"] == "5"
+    assert health.json()["status"] == "draining"
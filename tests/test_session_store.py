@@ -0,0 +1,70 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from session_store import PersistentHistory, SQLiteSessionStore
+
+
+def turn(history, i):
+    history.add_messages([HumanMessage(content=f"question {i}"), AIMessage(content=f"answer {i}")])
+
+
+def test_resume_loads_only_the_tail_that_fits_the_budget(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    history = PersistentHistory(store, "s1", token_budget=10_000)
+    for i in range(50):
+        turn(history, i)
+
+    resumed = PersistentHistory(store, "s1", token_budget=30)
+
+    assert resumed.last_turn == 100
+    assert 0 < len(resumed.messages) < 100
+    assert resumed.messages[-1].content == "answer 49"
+    assert resumed.total_tokens <= 30
+    store.close()
+
+
+def test_sessions_survive_reopening_the_database(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SQLiteSessionStore(path)
+    turn(PersistentHistory(store, "s1", token_budget=1000), 0)
+    turn(PersistentHistory(store, "s2", token_budget=1000), 1)
+    store.close()
+
+    store = SQLiteSessionStore(path)
+    assert sorted(store.sessions()) == ["s1", "s2"]
+    assert [m.content for m in PersistentHistory(store, "s1", token_budget=1000).messages] == \
+        ["question 0", "answer 0"]
+    store.close()
+
+
+def test_refresh_picks_up_turns_appended_elsewhere(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    ours = PersistentHistory(store, "s1", token_budget=1000)
+    theirs = PersistentHistory(store, "s1", token_budget=1000)
+
+    assert not ours.refresh()
+    turn(theirs, 0)
+    assert ours.refresh()
+    assert ours.messages == theirs.messages
+    store.close()
+
+
+def test_clear_deletes_the_stored_session(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    history = PersistentHistory(store, "s1", token_budget=1000)
+    turn(history, 0)
+    store.save_summary("s1", "summary", 2)
+
+    history.clear()
+
+    assert store.last_turn("s1") == 0
+    assert store.load_summary("s1") == ("", 0)
+    store.close()
+
+
+def test_engine_resumes_sessions_from_the_store(make_engine, loop, tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    reply = loop.run_until_complete(make_engine(session_store=store).ainvoke("s1", "Hello"))
+
+    history = make_engine(session_store=SQLiteSessionStore(store.path)).get_session_history("s1")
+
+    assert [m.content for m in history.messages] == ["Hello", reply]
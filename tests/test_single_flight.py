@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from providers import Provider
+from single_flight import SingleFlight
+
+
+def upstream(calls, count=5, delay=0.02, error=None):
+    """open_stream for SingleFlight.stream, counting the upstream calls it starts"""
+    async def stream():
+        calls.append(1)
+        for i in range(count):
+            await asyncio.sleep(delay)
+            yield f"chunk{i}"
+        if error is not None:
+            raise error
+    return stream
+
+
+def test_keys_cover_provider_model_temperature_tools_and_messages():
+    prompt = [HumanMessage(content="hi")]
+    key = SingleFlight.make_key(Provider.MOCK, "mock-model", 0.7, prompt)
+
+    assert key == SingleFlight.make_key(Provider.MOCK, "mock-model", 0.7, [HumanMessage(content="hi")])
+    assert key != SingleFlight.make_key(Provider.MOCK, "mock-model", 0.2, prompt)
+    assert key != SingleFlight.make_key(Provider.MOCK, "other-model", 0.7, prompt)
+    assert key != SingleFlight.make_key(Provider.MOCK, "mock-model", 0.7, prompt, ["search"])
+    assert key != SingleFlight.make_key(Provider.MOCK, "mock-model", 0.7, [HumanMessage(content="hello")])
+
+
+def test_identical_requests_share_one_upstream_call(loop):
+    flights = SingleFlight()
+    calls, joined = [], []
+
+    async def caller():
+        return [chunk async for chunk in flights.stream("k", Provider.MOCK, "m", upstream(calls),
+                                                        lambda: joined.append(1))]
+
+    async def run():
+        return await asyncio.gather(*(caller() for _ in range(3)))
+
+    results = loop.run_until_complete(run())
+
+    assert results == [[f"chunk{i}" for i in range(5)]] * 3
+    assert len(calls) == 1 and len(joined) == 2
+    assert flights.stats() == {"upstream_calls": 1, "coalesced": 2, "max_waiters": 2, "in_flight": 0}
+
+
+def test_a_caller_leaving_does_not_cut_the_others_short(loop):
+    flights = SingleFlight()
+    calls = []
+
+    async def leaver():
+        async for _ in flights.stream("k", Provider.MOCK, "m", upstream(calls)):
+            break
+
+    async def stayer():
+        return [chunk async for chunk in flights.stream("k", Provider.MOCK, "m", upstream(calls))]
+
+    async def run():
+        return await asyncio.gather(leaver(), stayer())
+
+    assert loop.run_until_complete(run())[1] == [f"chunk{i}" for i in range(5)]
+    assert len(calls) == 1
+
+
+def test_errors_reach_every_caller(loop):
+    flights = SingleFlight()
+    calls = []
+
+    async def caller():
+        async for _ in flights.stream("k", Provider.MOCK, "m", upstream(calls, error=RuntimeError("boom"))):
+            pass
+
+    async def run():
+        return await asyncio.gather(caller(), caller(), return_exceptions=True)
+
+    errors = loop.run_until_complete(run())
+
+    assert [str(e) for e in errors] == ["boom", "boom"]
+    assert len(calls) == 1
+
+
+def test_aclose_cancels_abandoned_upstream_calls(loop):
+    flights = SingleFlight()
+    calls = []
+
+    async def run():
+        async for _ in flights.stream("k", Provider.MOCK, "m", upstream(calls, delay=5)):
+            pass
+
+    async def abandon():
+        caller = asyncio.ensure_future(run())
+        await asyncio.sleep(0.05)
+        caller.cancel()
+        await asyncio.gather(caller, return_exceptions=True)
+        await flights.aclose()
+
+    loop.run_until_complete(abandon())
+
+    assert flights.stats()["in_flight"] == 0
+    assert not flights._tasks
+
+
+def test_engine_coalesces_concurrent_identical_turns(make_engine, loop, monkeypatch):
+    monkeypatch.setenv("MOCK_TTFT", "0.2")
+    engine = make_engine()
+
+    async def run():
+        return await asyncio.gather(engine.ainvoke("s1", "Hello"), engine.ainvoke("s2", "Hello"))
+
+    first, second = loop.run_until_complete(run())
+
+    assert first == second
+    assert engine.single_flight.counters["coalesced"] == 1
+    # One upstream call, so one outcome for the router
+    assert engine.router.stats[Provider.MOCK].requests == 1
+
+
+def test_single_flight_can_be_switched_off(monkeypatch):
+    monkeypatch.setenv("SINGLE_FLIGHT", "off")
+    assert SingleFlight.from_env() is None
@@ -0,0 +1,42 @@
+from langchain_core.messages import AIMessageChunk
+
+import chat
+from engine import chunk_text
+
+
+def test_astream_yields_tokens_and_records_the_reply(engine, loop):
+    async def turn():
+        return [text async for text in engine.astream("s1", "Hello")]
+
+    parts = loop.run_until_complete(turn())
+
+    assert len(parts) > 1
+    messages = engine.get_session_history("s1").messages
+    assert [m.type for m in messages] == ["human", "ai"]
+    assert messages[1].content == "".join(parts)
+    stats = engine.turn_stats["s1"]
+    assert stats.time_to_first_token is not None
+    assert stats.time_to_first_token <= stats.total_time
+    assert stats.tokens > 0
+
+
+def test_ainvoke_returns_the_streamed_reply(engine, loop):
+    reply = loop.run_until_complete(engine.ainvoke("s1", "Hello"))
+
+    assert reply == engine.get_session_history("s1").messages[-1].content
+
+
+def test_chunk_text_joins_content_blocks():
+    assert chunk_text(AIMessageChunk(content="plain")) == "plain"
+    assert chunk_text(AIMessageChunk(content=[{"type": "text", "text": "a"}, {"type": "text", "text": "b"}])) == "ab"
+
+
+def test_stream_response_prints_as_tokens_arrive(engine, loop, capsys):
+    app = chat.ChatApp.__new__(chat.ChatApp)
+    app.engine, app.session_id, app.pinned_provider = engine, "s1", None
+
+    stats = loop.run_until_complete(app._stream_response("Hello"))
+
+    reply = engine.get_session_history("s1").messages[-1].content
+    assert capsys.readouterr().out == f"\nAssistant: {reply}\n"
+    assert stats is engine.turn_stats["s1"]
@@ -0,0 +1,90 @@
+from langchain_core.messages import AIMessage, HumanMessage
+
+from providers import Provider, ProviderConfig
+from session_store import PersistentHistory, SQLiteSessionStore
+from summary import SUMMARY_PREFIX, RollingSummary, Summarizer
+
+
+def test_pending_messages_stand_in_until_they_are_folded():
+    saved = []
+    summary = RollingSummary(save=lambda text, covered: saved.append((text, covered)))
+    summary.add(HumanMessage(content="my name is Ada"), 10)
+    summary.add(AIMessage(content="hello Ada"), 10)
+
+    assert [m.content for m in summary.messages()] == ["my name is Ada", "hello Ada"]
+    summary.fold("The user is called Ada.", 1)
+
+    assert summary.messages()[0].content == SUMMARY_PREFIX + "The user is called Ada."
+    assert summary.messages()[1].content == "hello Ada"
+    assert (summary.covered, summary.pending_tokens) == (1, 10)
+    assert saved == [("The user is called Ada.", 1)]
+
+
+def test_backlog_over_its_cap_drops_the_oldest_messages():
+    summary = RollingSummary(max_pending_tokens=25)
+    for i in range(4):
+        summary.add(HumanMessage(content=f"message {i}"), 10)
+
+    assert [m.content for m, _ in summary.pending] == ["message 2", "message 3"]
+    assert summary.covered == 2
+
+
+def test_summarizer_folds_in_the_background_and_retries_after_failures(loop):
+    calls = []
+    fail = [True]
+
+    async def complete(provider, model, messages):
+        calls.append((provider, model))
+        if fail[0]:
+            raise RuntimeError("provider down")
+        return " summary of the earlier turns "
+
+    summarizer = Summarizer(complete)
+    summary = RollingSummary()
+    summary.add(HumanMessage(content="hello"), 5)
+
+    async def fold():
+        summarizer.schedule("s1", summary, Provider.OPENAI)
+        await summarizer.wait()
+
+    loop.run_until_complete(fold())
+    assert summarizer.failures == 1 and summary.pending
+
+    fail[0] = False
+    loop.run_until_complete(fold())
+    assert summary.text == "summary of the earlier turns"
+    assert not summary.pending
+    assert calls == [(Provider.OPENAI, "gpt-4o-mini")] * 2
+
+
+def test_engine_summarizes_what_leaves_the_window(make_engine, loop, monkeypatch):
+    monkeypatch.setenv("MOCK_REPLY_TOKENS", "8")
+    engine = make_engine({Provider.MOCK: ProviderConfig("mock", "mock-model", history_tokens=80)})
+
+    for i in range(6):
+        loop.run_until_complete(engine.ainvoke("s1", f"question number {i}"))
+    loop.run_until_complete(engine.summarizer.wait())
+
+    summary = engine.get_session_history("s1").summary
+    assert summary.text
+    assert summary.covered > 0
+    assert engine.summarizer.runs > 0
+
+
+def test_summaries_are_resumed_with_the_session(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    history = PersistentHistory(store, "s1", token_budget=40, trim_ratio=0.5)
+    history.attach_summary(RollingSummary(max_pending_tokens=1000))
+    for i in range(6):
+        history.add_messages([HumanMessage(content=f"question {i}"), AIMessage(content=f"answer {i}")])
+    history.summary.fold("Six questions were asked.", 2)
+
+    resumed = PersistentHistory(store, "s1", token_budget=40, trim_ratio=0.5)
+    resumed.attach_summary(RollingSummary(max_pending_tokens=1000))
+
+    assert resumed.summary.text == "Six questions were asked."
+    assert resumed.summary.covered == 2
+    # Everything after what the summary covers is either queued on it again or in the window
+    remaining = [m.content for m, _ in resumed.summary.pending] + [m.content for m in resumed.messages]
+    assert remaining == [f"{kind} {i}" for i in range(1, 6) for kind in ("question", "answer")]
+    store.close()
@@ -0,0 +1,187 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.tools import StructuredTool
+
+from metrics import MetricsRegistry
+from tools import BUILTIN_TOOLS, MAX_PRIME_LIMIT, ToolRuntime, ToolSpec, count_primes
+
+
+def call(name: str, call_id: str = "c1", **args) -> dict:
+    return {"name": name, "args": args, "id": call_id, "type": "tool_call"}
+
+
+def counting_tool(seen: list, delay: float = 0.05, kind: str = "async") -> ToolSpec:
+    async def lookup(word: str) -> str:
+        """Look a word up."""
+        seen.append(word)
+        await asyncio.sleep(delay)
+        return word.upper()
+    return ToolSpec(StructuredTool.from_function(coroutine=lookup), kind, idempotent=True)
+
+
+def test_calls_run_concurrently_and_results_keep_their_order(loop):
+    runtime = ToolRuntime([BUILTIN_TOOLS["wait"](), BUILTIN_TOOLS["blocking_wait"]()])
+    calls = [call("wait", "a", seconds=0.3), call("blocking_wait", "b", seconds=0.3),
+             call("blocking_wait", "c", seconds=0.1), call("wait", "d", seconds=0.1)]
+
+    started = time.perf_counter()
+    results = loop.run_until_complete(runtime.run(calls))
+    elapsed = time.perf_counter() - started
+    runtime.close()
+
+    assert elapsed < 0.6
+    assert [r.tool_call_id for r in results] == ["a", "b", "c", "d"]
+    assert [r.content for r in results] == ["waited 0.3s", "blocked 0.3s", "blocked 0.1s", "waited 0.1s"]
+    assert all(r.status == "success" for r in results)
+
+
+def test_failures_and_timeouts_become_error_messages(loop):
+    def explode() -> str:
+        """Always fails."""
+        raise RuntimeError("boom")
+
+    metrics = MetricsRegistry()
+    runtime = ToolRuntime([BUILTIN_TOOLS["wait"](), ToolSpec(StructuredTool.from_function(func=explode))],
+                          timeout=0.1, metrics=metrics)
+    results = loop.run_until_complete(runtime.run([
+        call("wait", "a", seconds=5), call("explode", "b"), call("missing", "c"), call("wait", "d", seconds=0)
+    ]))
+    runtime.close()
+
+    assert [r.status for r in results] == ["error", "error", "error", "success"]
+    assert results[0].content == "Error: wait timed out"
+    assert results[1].content == "Error: RuntimeError: boom"
+    assert results[2].content == "Error: unknown tool 'missing'"
+    assert runtime.counters["timeouts"] == 1 and runtime.counters["errors"] == 1
+    outcomes = {dict(labels)["outcome"] for labels in metrics.histograms["llm_tool_duration_seconds"]}
+    assert outcomes == {"ok", "timeout", "error"}
+
+
+def test_idempotent_results_are_cached_and_identical_calls_shared(loop):
+    seen = []
+    runtime = ToolRuntime([counting_tool(seen)])
+
+    first = loop.run_until_complete(runtime.run([call("lookup", "a", word="x"), call("lookup", "b", word="x"),
+                                                 call("lookup", "c", word="y")]))
+    again = loop.run_until_complete(runtime.run([call("lookup", "d", word="x")]))
+    runtime.close()
+
+    assert [r.content for r in first + again] == ["X", "X", "Y", "X"]
+    assert sorted(seen) == ["x", "y"]
+    assert runtime.counters["shared"] == 1 and runtime.counters["cache_hits"] == 1
+    assert runtime.stats()["cached"] == 2 and runtime.stats()["in_flight"] == 0
+
+
+def test_cached_results_expire_and_the_cache_is_bounded(loop):
+    seen = []
+    runtime = ToolRuntime([counting_tool(seen, delay=0)], cache_size=2, cache_ttl=0.1)
+
+    for word in ("a", "b", "c", "a"):
+        loop.run_until_complete(runtime.run([call("lookup", word=word)]))
+    assert seen == ["a", "b", "c", "a"]
+    assert runtime.stats()["cached"] == 2
+
+    time.sleep(0.15)
+    loop.run_until_complete(runtime.run([call("lookup", word="c")]))
+    runtime.close()
+    assert seen[-1] == "c" and runtime.counters["cache_hits"] == 0
+
+
+def test_count_primes_runs_in_a_worker_process_within_its_bound(loop):
+    runtime = ToolRuntime([BUILTIN_TOOLS["count_primes"]()], max_processes=1)
+    results = loop.run_until_complete(runtime.run([
+        call("count_primes", "a", limit=100), call("count_primes", "b", limit=MAX_PRIME_LIMIT + 1),
+        call("count_primes", "c", limit=-1),
+    ]))
+    runtime.close()
+
+    assert results[0].content == "25"
+    # Out-of-range limits are rejected before reaching a worker
+    assert [r.status for r in results[1:]] == ["error", "error"]
+    assert "ValidationError" in results[1].content
+    assert count_primes(2) == 0 and count_primes(1000) == 168
+
+
+def test_tool_specs_check_their_kind():
+    def blocking() -> str:
+        """Blocks."""
+        return ""
+
+    async def coroutine() -> str:
+        """Awaits."""
+        return ""
+
+    assert ToolSpec(StructuredTool.from_function(func=blocking)).kind == "thread"
+    assert ToolSpec(StructuredTool.from_function(coroutine=coroutine)).kind == "async"
+    with pytest.raises(ValueError):
+        ToolSpec(StructuredTool.from_function(func=blocking), "gpu")
+    with pytest.raises(ValueError):
+        ToolSpec(StructuredTool.from_function(coroutine=coroutine), "process")
+
+
+def test_from_env_builds_the_named_builtin_tools(monkeypatch):
+    assert ToolRuntime.from_env() is None
+
+    monkeypatch.setenv("TOOLS", "wait, bogus")
+    monkeypatch.setenv("TOOL_MAX_ROUNDS", "2")
+    runtime = ToolRuntime.from_env()
+    assert list(runtime.specs) == ["wait"] and runtime.max_rounds == 2
+    runtime.close()
+
+    monkeypatch.setenv("TOOLS", "bogus")
+    assert ToolRuntime.from_env() is None
+
+
+def test_engine_runs_requested_tools_and_keeps_only_text_in_history(make_engine, loop):
+    runtime = ToolRuntime([BUILTIN_TOOLS["wait"](), BUILTIN_TOOLS["blocking_wait"]()])
+    engine = make_engine(tools=runtime)
+
+    started = time.perf_counter()
+    reply = loop.run_until_complete(engine.ainvoke(
+        "s1", 'Please wait({"seconds": 0.3}) and blocking_wait({"seconds": 0.3})'))
+
+    # Both calls ran at once, within the one tool round
+    assert time.perf_counter() - started < 0.6
+    assert reply.startswith("wait: waited 0.3s; blocking_wait: blocked 0.3s;")
+    assert [m.type for m in engine.get_session_history("s1").messages] == ["human", "ai"]
+    assert runtime.counters["calls"] == 2
+
+
+def test_a_cancelled_caller_does_not_cancel_a_shared_call(loop):
+    seen = []
+    runtime = ToolRuntime([counting_tool(seen, delay=0.2)])
+
+    async def run():
+        owner = asyncio.ensure_future(runtime.run([call("lookup", "a", word="x")]))
+        await asyncio.sleep(0.05)
+        other = asyncio.ensure_future(runtime.run([call("lookup", "b", word="x")]))
+        await asyncio.sleep(0.05)
+        # The turn that started the call is abandoned
+        owner.cancel()
+        await asyncio.gather(owner, return_exceptions=True)
+        return await other
+
+    results = loop.run_until_complete(run())
+    cached = loop.run_until_complete(runtime.run([call("lookup", "c", word="x")]))
+    loop.run_until_complete(runtime.aclose())
+
+    assert [(r.status, r.content) for r in results + cached] == [("success", "X")] * 2
+    assert seen == ["x"]
+    assert runtime.counters["shared"] == 1 and runtime.counters["cache_hits"] == 1
+
+
+def test_aclose_cancels_shared_calls_still_running(loop):
+    runtime = ToolRuntime([counting_tool([], delay=5)])
+
+    async def run():
+        caller = asyncio.ensure_future(runtime.run([call("lookup", word="x")]))
+        await asyncio.sleep(0.05)
+        caller.cancel()
+        await asyncio.gather(caller, return_exceptions=True)
+        await runtime.aclose()
+
+    loop.run_until_complete(run())
+
+    assert runtime.stats()["in_flight"] == 0
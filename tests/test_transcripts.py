@@ -0,0 +1,131 @@
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from transcripts import COLUMNS, TranscriptArchive
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+DAY = datetime(2024, 6, 1, 12, tzinfo=timezone.utc).timestamp()
+
+
+class Recorder:
+    """Stands in for the archive; keeps the rows the engine records"""
+    def __init__(self):
+        self.rows = []
+        self.closed = False
+
+    def record(self, *row, **kwargs):
+        self.rows.append(row)
+
+    def close(self):
+        self.closed = True
+
+
+def archive(tmp_path, **kwargs) -> TranscriptArchive:
+    pytest.importorskip("pyarrow")
+    return TranscriptArchive(str(tmp_path / "transcripts"), **kwargs)
+
+
+def record(store: TranscriptArchive, ts: float, provider="openai", outcome="ok", latency=1.0, text="hello"):
+    store.record("s1", provider, "gpt", outcome, 100, 20, 10, 0.2, latency, text, f"reply to {text}", ts=ts)
+
+
+def segments(path):
+    return sorted(os.path.relpath(os.path.join(root, name), path)
+                  for root, _, names in os.walk(path) for name in names)
+
+
+def test_from_env_is_none_when_disabled_or_without_pyarrow(monkeypatch):
+    monkeypatch.setenv("TRANSCRIPTS", "off")
+    assert TranscriptArchive.from_env() is None
+
+    monkeypatch.delenv("TRANSCRIPTS")
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    assert TranscriptArchive.from_env() is None
+
+
+def test_engine_records_finished_and_failed_turns(make_engine, loop, monkeypatch):
+    recorder = Recorder()
+    engine = make_engine(transcripts=recorder)
+    reply = loop.run_until_complete(engine.ainvoke("s1", "Hello"))
+
+    monkeypatch.setenv("MOCK_ERROR_RATE", "1")
+    monkeypatch.setenv("RETRY_MAX_ATTEMPTS", "0")
+    failing = make_engine(transcripts=recorder)
+    with pytest.raises(Exception):
+        loop.run_until_complete(failing.ainvoke("s2", "Hello"))
+    loop.run_until_complete(failing.aclose())
+
+    (session, provider, model, outcome, *_, user_input, output), failed = recorder.rows
+    assert (session, provider, model, outcome) == ("s1", "mock", "mock-model", "ok")
+    assert (user_input, output) == ("Hello", reply)
+    assert failed[0] == "s2" and failed[3] == "error" and failed[-1] == ""
+    assert recorder.closed
+
+
+def test_rows_are_written_as_one_segment_on_close(tmp_path, monkeypatch):
+    import pyarrow.parquet as pq
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-live-secret-value")
+    store = archive(tmp_path, text_chars=40)
+    for i in range(3):
+        record(store, DAY + i, text=f"key sk-live-secret-value {i} " + "x" * 50)
+    store.close()
+
+    files = segments(store.path)
+    assert len(files) == 1 and files[0].startswith("date=2024-06-01/part-")
+    table = pq.read_table(os.path.join(store.path, files[0]))
+    assert table.column_names == list(COLUMNS)
+    assert table.num_rows == 3
+    texts = table["input"].to_pylist()
+    assert all("sk-live-secret-value" not in text for text in texts)
+    assert all(len(text) <= 40 + len("[REDACTED]") for text in texts)
+    assert store.stats() == {"rows_written": 3, "segments_written": 1, "dropped": 0, "queued": 0}
+
+
+def test_segments_split_on_size_day_and_interval(tmp_path):
+    store = archive(tmp_path, batch_rows=2, flush_interval=0.1)
+    for i in range(3):
+        record(store, DAY + i)
+    record(store, DAY + 86400)
+    deadline = time.monotonic() + 5
+    while store.stats()["rows_written"] < 4 and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+    # Two full segments, the day-1 remainder, and the next day's row after the interval
+    assert store.stats()["rows_written"] == 4
+    files = segments(store.path)
+    assert [name.split("/")[0] for name in files] == ["date=2024-06-01"] * 2 + ["date=2024-06-02"]
+    store.close()
+
+
+def test_text_columns_can_be_dropped(tmp_path):
+    import pyarrow.parquet as pq
+    store = archive(tmp_path, text_chars=0)
+    record(store, DAY)
+    store.close()
+
+    table = pq.read_table(os.path.join(store.path, segments(store.path)[0]))
+    assert table["input"].to_pylist() == [None] and table["output"].to_pylist() == [None]
+
+
+def test_query_aggregates_per_group_and_filters_days(tmp_path):
+    store = archive(tmp_path)
+    record(store, DAY, provider="openai", latency=1.0)
+    record(store, DAY + 1, provider="openai", outcome="error", latency=3.0)
+    record(store, DAY + 2, provider="anthropic", latency=2.0)
+    record(store, DAY + 86400, provider="anthropic", latency=4.0)
+    store.close()
+    from query_transcripts import aggregate
+
+    rows = aggregate(store.path, ["provider"], "latency_s")
+    assert [(row["provider"], row["turns"], row["failed"]) for row in rows] == [("anthropic", 2, 0), ("openai", 2, 1)]
+    assert rows[1]["mean"] == 2.0
+    assert rows[1]["prompt_tokens"] == 200
+
+    since = datetime.fromtimestamp(DAY + 86400 - 60, timezone.utc)
+    rows = aggregate(store.path, ["day"], "latency_s", since=since)
+    assert [(row["day"], row["turns"]) for row in rows] == [("2024-06-02", 1)]